@@ -0,0 +1,391 @@
+"""
+Backtesting de los modelos de predicción con evaluación de origen móvil.
+
+Para cada sensor, horizonte y modelo se eligen varios orígenes en el historial;
+en cada uno se ajusta el modelo con la ventana de entrenamiento anterior y se
+predicen las lecturas reales del horizonte siguiente. Se mide la precisión
+(MAE y cobertura del intervalo de confianza) junto con el tiempo de ajuste y de
+predicción y la memoria máxima de cada modelo. Los sensores se reparten en un
+pool de procesos (una tarea por sensor, para enviar cada historial una vez).
+
+El resultado alimenta la selección de modelo por sensor: el servicio de
+predicción usa el modelo más barato que cumple los requisitos de precisión.
+
+Uso como script sobre una granja sintética (desde el directorio ``backend``)::
+
+    python -m ai.backtesting --sensors 10 --days 60 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from ai.forecasting import (
+    DEFAULT_MODEL,
+    HORIZON_DURATIONS,
+    PREDICTION_TYPES,
+    TRAINING_WINDOWS,
+    available_models,
+    create_model,
+)
+
+# Número mínimo de lecturas para ajustar y evaluar un origen
+MIN_TRAIN_POINTS = 24
+MIN_TEST_POINTS = 3
+
+# Espacio de nombres del estado compartido con la selección de modelo por
+# sensor y horizonte, resultado del último backtest
+SELECTION_NAMESPACE = "model_selection"
+
+
+def rolling_origins(timestamps: np.ndarray, time_horizon: str, origins: int) -> List[float]:
+    """
+    Orígenes de evaluación repartidos por el historial, del más reciente al más antiguo.
+    """
+    if timestamps.size == 0:
+        return []
+    horizon = HORIZON_DURATIONS[time_horizon].total_seconds()
+    train_window = TRAINING_WINDOWS[time_horizon].total_seconds()
+    first_origin = float(timestamps[0]) + train_window
+    last_origin = float(timestamps[-1]) - horizon
+    if last_origin < first_origin:
+        return []
+    stride = max(horizon, (last_origin - first_origin) / max(origins, 1))
+    result = []
+    origin = last_origin
+    while origin >= first_origin and len(result) < origins:
+        result.append(origin)
+        origin -= stride
+    return result
+
+
+def evaluate_model(
+    model_name: str,
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    time_horizon: str,
+    origins: int = 5,
+    measure_memory: bool = True,
+) -> Dict[str, Any]:
+    """
+    Evalúa un modelo sobre una serie con origen móvil.
+
+    La memoria se mide en una pasada aparte con ``tracemalloc`` para no
+    distorsionar los tiempos.
+    """
+    horizon = HORIZON_DURATIONS[time_horizon].total_seconds()
+    train_window = TRAINING_WINDOWS[time_horizon].total_seconds()
+
+    errors = []
+    covered = 0
+    widths = []
+    fit_seconds = 0.0
+    predict_seconds = 0.0
+    evaluated = 0
+    first_split = None
+
+    for origin in rolling_origins(timestamps, time_horizon, origins):
+        train_lo = np.searchsorted(timestamps, origin - train_window, side="left")
+        split = np.searchsorted(timestamps, origin, side="right")
+        test_hi = np.searchsorted(timestamps, origin + horizon, side="right")
+        if split - train_lo < MIN_TRAIN_POINTS or test_hi - split < MIN_TEST_POINTS:
+            continue
+        train_ts, train_values = timestamps[train_lo:split], values[train_lo:split]
+        test_ts, test_values = timestamps[split:test_hi], values[split:test_hi]
+
+        t0 = time.perf_counter()
+        model = create_model(model_name).fit(train_ts, train_values)
+        t1 = time.perf_counter()
+        prediction, lower, upper = model.predict(test_ts)
+        t2 = time.perf_counter()
+
+        fit_seconds += t1 - t0
+        predict_seconds += t2 - t1
+        errors.append(np.abs(prediction - test_values))
+        covered += int(np.count_nonzero((test_values >= lower) & (test_values <= upper)))
+        widths.append(upper - lower)
+        evaluated += 1
+        if first_split is None:
+            first_split = (train_ts, train_values, test_ts)
+
+    result: Dict[str, Any] = {
+        "model": model_name,
+        "time_horizon": time_horizon,
+        "origins": evaluated,
+    }
+    if not evaluated:
+        result["error"] = "Historial insuficiente para evaluar"
+        return result
+
+    errors = np.concatenate(errors)
+    result.update({
+        "mae": float(errors.mean()),
+        "coverage": covered / errors.size,
+        "interval_width": float(np.concatenate(widths).mean()),
+        "fit_ms": fit_seconds * 1000 / evaluated,
+        "predict_ms": predict_seconds * 1000 / evaluated,
+        "peak_memory_kb": None,
+    })
+
+    if measure_memory:
+        train_ts, train_values, test_ts = first_split
+        tracemalloc.start()
+        try:
+            create_model(model_name).fit(train_ts, train_values).predict(test_ts)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result["peak_memory_kb"] = peak / 1024
+
+    return result
+
+
+def _evaluate_sensor(task: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Tarea ejecutada en el pool: evalúa todos los horizontes y modelos de un
+    sensor, de modo que su historial se envía (o se abre) una sola vez.
+    """
+    timestamps, values = task["timestamps"], task["values"]
+    results = []
+    try:
+        if values is None:
+            # Serie de segmentos proyectados en memoria: el proceso los abre
+            # en lugar de recibir una copia del historial
+            timestamps, values = timestamps.arrays()
+    except Exception as exc:  # un sensor ilegible no debe abortar el backtest
+        results = [
+            {"model": model, "time_horizon": time_horizon, "origins": 0, "error": str(exc)}
+            for time_horizon in task["time_horizons"]
+            for model in task["models"]
+        ]
+    else:
+        for time_horizon in task["time_horizons"]:
+            for model in task["models"]:
+                try:
+                    result = evaluate_model(
+                        model, timestamps, values, time_horizon, task["origins"], task["measure_memory"],
+                    )
+                except Exception as exc:  # un modelo que falla no debe abortar el backtest
+                    result = {"model": model, "time_horizon": time_horizon, "origins": 0, "error": str(exc)}
+                results.append(result)
+    for result in results:
+        result["sensor_id"] = task["sensor_id"]
+        result["prediction_type"] = task["prediction_type"]
+    return results
+
+
+def run_backtest(
+    series: Dict[Hashable, Tuple[str, np.ndarray, np.ndarray]],
+    time_horizons: Optional[List[str]] = None,
+    models: Optional[List[str]] = None,
+    origins: int = 5,
+    max_workers: Optional[int] = None,
+    measure_memory: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Ejecuta el backtest de todas las combinaciones sensor × horizonte × modelo.
+
+    ``series`` asocia cada sensor con ``(prediction_type, timestamps, values)``.
+    En lugar de los arrays puede llevar ``(prediction_type, source, None)``,
+    donde ``source`` tiene un método ``arrays()`` (``SeriesSource`` de
+    ``database/segment_files.py``) que cada proceso resuelve por su cuenta.
+    Cada sensor es una tarea del pool. Con ``max_workers=1`` las tareas se
+    ejecutan en el proceso actual. Lanza ValueError si algún horizonte, modelo
+    o tipo de predicción no es válido.
+    """
+    time_horizons = time_horizons or list(HORIZON_DURATIONS)
+    models = models or list(available_models())
+    for time_horizon in time_horizons:
+        if time_horizon not in HORIZON_DURATIONS:
+            raise ValueError(f"Horizonte temporal no válido: {time_horizon}")
+    unavailable = [model for model in models if model not in available_models()]
+    if unavailable:
+        raise ValueError(
+            f"Modelos no disponibles: {', '.join(unavailable)}. Deben ser de: {', '.join(available_models())}"
+        )
+    for sensor_id, (prediction_type, _, _) in series.items():
+        if prediction_type not in PREDICTION_TYPES:
+            raise ValueError(f"Tipo de predicción no válido para el sensor {sensor_id}: {prediction_type}")
+
+    tasks = [
+        {
+            "sensor_id": sensor_id,
+            "prediction_type": prediction_type,
+            "timestamps": timestamps,
+            "values": values,
+            "time_horizons": time_horizons,
+            "models": models,
+            "origins": origins,
+            "measure_memory": measure_memory,
+        }
+        for sensor_id, (prediction_type, timestamps, values) in series.items()
+    ]
+
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+    if max_workers <= 1 or len(tasks) <= 1:
+        return [result for task in tasks for result in _evaluate_sensor(task)]
+
+    # "spawn" evita heredar hilos y bloqueos del servidor al crear los procesos
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        return [result for results in executor.map(_evaluate_sensor, tasks) for result in results]
+
+
+def select_models(
+    results: List[Dict[str, Any]],
+    min_coverage: float = 0.8,
+    mae_tolerance: float = 0.1,
+) -> Dict[Tuple[Hashable, str], Dict[str, Any]]:
+    """
+    Elige para cada sensor y horizonte el modelo más barato que cumple la precisión.
+
+    Un modelo cumple si su cobertura es al menos ``min_coverage`` y su MAE no
+    supera en más de ``mae_tolerance`` (fracción) al mejor MAE obtenido. El coste
+    es el tiempo de ajuste más el de predicción. Si ninguno cumple, se elige el
+    de menor MAE.
+    """
+    grouped: Dict[Tuple[Hashable, str], List[Dict[str, Any]]] = {}
+    for result in results:
+        if "error" in result:
+            continue
+        grouped.setdefault((result["sensor_id"], result["time_horizon"]), []).append(result)
+
+    selection = {}
+    for key, candidates in grouped.items():
+        best_mae = min(candidate["mae"] for candidate in candidates)
+        eligible = [
+            candidate for candidate in candidates
+            if candidate["coverage"] >= min_coverage and candidate["mae"] <= best_mae * (1 + mae_tolerance)
+        ]
+        if eligible:
+            chosen = min(eligible, key=lambda candidate: candidate["fit_ms"] + candidate["predict_ms"])
+        else:
+            chosen = min(candidates, key=lambda candidate: candidate["mae"])
+        selection[key] = {
+            "sensor_id": key[0],
+            "time_horizon": key[1],
+            "model": chosen["model"],
+            "mae": chosen["mae"],
+            "coverage": chosen["coverage"],
+            "cost_ms": chosen["fit_ms"] + chosen["predict_ms"],
+            "meets_accuracy": bool(eligible),
+        }
+    return selection
+
+
+def _selection_key(sensor_id: Hashable, time_horizon: str) -> str:
+    return f"{sensor_id}:{time_horizon}"
+
+
+def update_model_selection(selection: Dict[Tuple[Hashable, str], Dict[str, Any]]):
+    """
+    Actualiza la selección de modelos usada por el servicio de predicción en
+    todos los workers.
+    """
+    from database.shared_state import get_state_backend
+
+    backend = get_state_backend()
+    for (sensor_id, time_horizon), item in selection.items():
+        backend.put(SELECTION_NAMESPACE, _selection_key(sensor_id, time_horizon), item)
+
+
+def get_model_selection() -> List[Dict[str, Any]]:
+    """
+    Selección de modelos vigente.
+    """
+    from database.shared_state import get_state_backend
+
+    return get_state_backend().all(SELECTION_NAMESPACE)
+
+
+def get_selected_model(sensor_id: Hashable, time_horizon: str) -> str:
+    """
+    Modelo a usar para un sensor y horizonte (el modelo por defecto si no hay
+    selección o si el modelo elegido ya no está disponible).
+    """
+    from database.shared_state import get_state_backend
+
+    selected = get_state_backend().get(SELECTION_NAMESPACE, _selection_key(sensor_id, time_horizon))
+    if selected and selected["model"] in available_models():
+        return selected["model"]
+    return DEFAULT_MODEL
+
+
+def synthetic_series(sensors: int, days: int, interval_seconds: float, seed: int) -> Dict[Hashable, Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Series sintéticas para ejecutar el backtest sin datos reales.
+    """
+    from utils import synthetic_data
+
+    end = datetime(2025, 1, 1) + timedelta(days=days)
+    series = {}
+    for i in range(sensors):
+        prediction_type = PREDICTION_TYPES[i % len(PREDICTION_TYPES)]
+        generated = synthetic_data.generate_series(
+            prediction_type, end - timedelta(days=days), end, interval_seconds,
+            seed=synthetic_data.sensor_seed(seed, i), gap_rate=0.01, anomaly_rate=0.002,
+        )
+        series[i + 1] = (prediction_type, generated.timestamps, generated.values)
+    return series
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Backtesting de los modelos de predicción")
+    parser.add_argument("--sensors", type=int, default=len(PREDICTION_TYPES), help="Sensores sintéticos")
+    parser.add_argument("--days", type=int, default=60, help="Días de historial sintético")
+    parser.add_argument("--interval", type=float, default=600.0, help="Segundos entre lecturas")
+    parser.add_argument("--horizons", nargs="*", help="Horizontes a evaluar (por defecto, todos)")
+    parser.add_argument("--models", nargs="*", help="Modelos a evaluar (por defecto, todos los disponibles)")
+    parser.add_argument("--origins", type=int, default=5, help="Orígenes por combinación")
+    parser.add_argument("--workers", type=int, help="Procesos del pool")
+    parser.add_argument("--min-coverage", type=float, default=0.8, help="Cobertura mínima del intervalo")
+    parser.add_argument("--mae-tolerance", type=float, default=0.1, help="Tolerancia sobre el mejor MAE")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Fichero donde guardar el informe JSON")
+    args = parser.parse_args(argv)
+
+    # Validar antes de generar las series para no fallar en cada tarea
+    unavailable = [model for model in args.models or [] if model not in available_models()]
+    if unavailable:
+        parser.error(f"modelos no disponibles: {', '.join(unavailable)} (disponibles: {', '.join(available_models())})")
+    invalid = [horizon for horizon in args.horizons or [] if horizon not in HORIZON_DURATIONS]
+    if invalid:
+        parser.error(f"horizontes no válidos: {', '.join(invalid)} (válidos: {', '.join(HORIZON_DURATIONS)})")
+
+    series = synthetic_series(args.sensors, args.days, args.interval, args.seed)
+    started = time.perf_counter()
+    results = run_backtest(series, args.horizons, args.models, args.origins, args.workers)
+    elapsed = time.perf_counter() - started
+    selection = select_models(results, args.min_coverage, args.mae_tolerance)
+
+    print(f"{'sensor':>6} {'tipo':<14} {'horiz.':<6} {'modelo':<15} {'MAE':>10} {'cobert.':>8} {'ajuste ms':>10} {'pred. ms':>9} {'mem. KB':>9}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['sensor_id']:>6} {result['prediction_type']:<14} {result['time_horizon']:<6} {result['model']:<15} error: {result['error']}")
+            continue
+        print(
+            f"{result['sensor_id']:>6} {result['prediction_type']:<14} {result['time_horizon']:<6} {result['model']:<15} "
+            f"{result['mae']:>10.3f} {result['coverage']:>8.2%} {result['fit_ms']:>10.2f} {result['predict_ms']:>9.2f} "
+            f"{result['peak_memory_kb']:>9.1f}"
+        )
+    print(f"\nSelección de modelos ({elapsed:.2f} s):")
+    for item in selection.values():
+        flag = "" if item["meets_accuracy"] else " (no cumple la precisión)"
+        print(f"  sensor {item['sensor_id']} {item['time_horizon']}: {item['model']}{flag}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump({"results": results, "selection": list(selection.values())}, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Modelos de predicción de series temporales de sensores.
+
+Todos los modelos comparten la misma interfaz: ``fit(timestamps, values)`` con
+marcas de tiempo en segundos epoch, y ``predict(timestamps)`` que devuelve la
+predicción y los límites inferior y superior del intervalo de confianza del
+95 %. Los modelos básicos solo dependen de NumPy; los que usan scikit-learn o
+Prophet importan esas librerías al ajustarse, y solo se registran si están
+instaladas.
+"""
+import importlib.util
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import Dict, List, Tuple, Type
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400.0
+
+# Cuantil normal del intervalo de confianza del 95 %
+Z_95 = 1.96
+
+Forecast = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Tipos de predicción soportados
+PREDICTION_TYPES = ["temperature", "humidity", "ph", "soil_moisture", "light"]
+
+# Duración de cada horizonte temporal
+HORIZON_DURATIONS = {
+    "1h": timedelta(hours=1),
+    "6h": timedelta(hours=6),
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+}
+
+# Número de puntos de predicción de cada horizonte
+HORIZON_POINTS = {
+    "1h": 12,
+    "6h": 18,
+    "24h": 24,
+    "7d": 28,
+}
+
+# Historial usado para ajustar los modelos en cada horizonte
+TRAINING_WINDOWS = {
+    "1h": timedelta(days=2),
+    "6h": timedelta(days=3),
+    "24h": timedelta(days=7),
+    "7d": timedelta(days=28),
+}
+
+
+class ForecastModel(ABC):
+    """
+    Interfaz común de los modelos de predicción.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def fit(self, timestamps: np.ndarray, values: np.ndarray) -> "ForecastModel":
+        ...
+
+    @abstractmethod
+    def predict(self, timestamps: np.ndarray) -> Forecast:
+        ...
+
+    @staticmethod
+    def _interval(prediction: np.ndarray, sigma: np.ndarray) -> Forecast:
+        return prediction, prediction - Z_95 * sigma, prediction + Z_95 * sigma
+
+
+def _median_step(timestamps: np.ndarray) -> float:
+    if timestamps.size < 2:
+        return 60.0
+    return float(np.median(np.diff(timestamps))) or 60.0
+
+
+def _daily_features(timestamps: np.ndarray, origin: float, harmonics: int = 2) -> np.ndarray:
+    """
+    Matriz de diseño con constante, tendencia lineal (en días) y armónicos diarios.
+    """
+    days = (timestamps - origin) / SECONDS_PER_DAY
+    columns = [np.ones_like(days), days]
+    for k in range(1, harmonics + 1):
+        angle = 2 * np.pi * k * days
+        columns.append(np.sin(angle))
+        columns.append(np.cos(angle))
+    return np.column_stack(columns)
+
+
+class NaiveForecaster(ForecastModel):
+    """
+    Repite el último valor observado; la incertidumbre crece con el horizonte.
+    """
+
+    name = "naive"
+
+    def fit(self, timestamps, values):
+        self._last_time = float(timestamps[-1])
+        self._last_value = float(values[-1])
+        self._step = _median_step(timestamps)
+        self._sigma = float(np.std(np.diff(values))) if values.size > 1 else 0.0
+        self._spread = float(np.std(values))
+        return self
+
+    def predict(self, timestamps):
+        steps = np.maximum((timestamps - self._last_time) / self._step, 1.0)
+        sigma = np.minimum(self._sigma * np.sqrt(steps), 2 * self._spread)
+        prediction = np.full(timestamps.shape, self._last_value)
+        return self._interval(prediction, sigma)
+
+
+class SeasonalNaiveForecaster(ForecastModel):
+    """
+    Repite el valor observado a la misma hora del último día disponible.
+    """
+
+    name = "seasonal_naive"
+    period = SECONDS_PER_DAY
+
+    def fit(self, timestamps, values):
+        self._timestamps = timestamps
+        self._values = values
+        self._last_time = float(timestamps[-1])
+        lagged = self._lookup(timestamps[timestamps >= timestamps[0] + self.period] - self.period)
+        recent = values[timestamps >= timestamps[0] + self.period]
+        self._sigma = float(np.std(recent - lagged)) if recent.size else float(np.std(values))
+        return self
+
+    def _lookup(self, timestamps: np.ndarray) -> np.ndarray:
+        index = np.clip(np.searchsorted(self._timestamps, timestamps), 0, self._timestamps.size - 1)
+        return self._values[index]
+
+    def predict(self, timestamps):
+        periods_back = np.ceil((timestamps - self._last_time) / self.period)
+        prediction = self._lookup(timestamps - periods_back * self.period)
+        sigma = np.full(timestamps.shape, self._sigma)
+        return self._interval(prediction, sigma)
+
+
+class HarmonicRegressionForecaster(ForecastModel):
+    """
+    Regresión lineal por mínimos cuadrados sobre tendencia y ciclo diario.
+    """
+
+    name = "harmonic"
+
+    def fit(self, timestamps, values):
+        self._origin = float(timestamps[0])
+        design = _daily_features(timestamps, self._origin)
+        self._coefficients, *_ = np.linalg.lstsq(design, values, rcond=None)
+        residuals = values - design @ self._coefficients
+        self._sigma = float(np.std(residuals))
+        return self
+
+    def predict(self, timestamps):
+        prediction = _daily_features(timestamps, self._origin) @ self._coefficients
+        return self._interval(prediction, np.full(timestamps.shape, self._sigma))
+
+
+class HoltForecaster(ForecastModel):
+    """
+    Suavizado exponencial doble (Holt) con tendencia amortiguada.
+    """
+
+    name = "holt"
+    alpha = 0.3
+    beta = 0.05
+    phi = 0.98
+    max_points = 2000
+
+    def fit(self, timestamps, values):
+        timestamps = timestamps[-self.max_points:]
+        values = values[-self.max_points:]
+        level, trend = float(values[0]), 0.0
+        errors = []
+        for value in values[1:].tolist():
+            forecast = level + self.phi * trend
+            errors.append(value - forecast)
+            new_level = self.alpha * value + (1 - self.alpha) * forecast
+            trend = self.beta * (new_level - level) + (1 - self.beta) * self.phi * trend
+            level = new_level
+        self._level, self._trend = level, trend
+        self._last_time = float(timestamps[-1])
+        self._step = _median_step(timestamps)
+        self._sigma = float(np.std(errors)) if errors else 0.0
+        self._spread = float(np.std(values))
+        return self
+
+    def predict(self, timestamps):
+        steps = np.maximum((timestamps - self._last_time) / self._step, 1.0)
+        # Suma geométrica de la tendencia amortiguada: phi + phi^2 + ... + phi^h
+        damping = self.phi * (1 - self.phi ** steps) / (1 - self.phi)
+        prediction = self._level + damping * self._trend
+        sigma = np.minimum(self._sigma * np.sqrt(steps), 2 * self._spread)
+        return self._interval(prediction, sigma)
+
+
+class RandomForestForecaster(ForecastModel):
+    """
+    Bosque aleatorio de scikit-learn sobre la hora del día y la tendencia.
+    """
+
+    name = "random_forest"
+    requires = "sklearn"
+
+    def fit(self, timestamps, values):
+        from sklearn.ensemble import RandomForestRegressor
+
+        self._origin = float(timestamps[0])
+        features = _daily_features(timestamps, self._origin, harmonics=1)[:, 1:]
+        self._model = RandomForestRegressor(n_estimators=50, max_depth=8, n_jobs=1, random_state=0)
+        self._model.fit(features, values)
+        self._sigma = float(np.std(values - self._model.predict(features)))
+        return self
+
+    def predict(self, timestamps):
+        features = _daily_features(timestamps, self._origin, harmonics=1)[:, 1:]
+        prediction = self._model.predict(features)
+        return self._interval(prediction, np.full(timestamps.shape, self._sigma))
+
+
+class ProphetForecaster(ForecastModel):
+    """
+    Modelo Prophet con estacionalidad diaria.
+    """
+
+    name = "prophet"
+    requires = "prophet"
+
+    def fit(self, timestamps, values):
+        import pandas as pd
+        from prophet import Prophet
+
+        self._model = Prophet(
+            daily_seasonality=True, weekly_seasonality=False,
+            yearly_seasonality=False, interval_width=0.95,
+        )
+        self._model.fit(pd.DataFrame({"ds": pd.to_datetime(timestamps, unit="s"), "y": values}))
+        return self
+
+    def predict(self, timestamps):
+        import pandas as pd
+
+        forecast = self._model.predict(pd.DataFrame({"ds": pd.to_datetime(timestamps, unit="s")}))
+        return (
+            forecast["yhat"].to_numpy(),
+            forecast["yhat_lower"].to_numpy(),
+            forecast["yhat_upper"].to_numpy(),
+        )
+
+
+# Modelos disponibles, del más barato al más costoso
+MODEL_CLASSES: List[Type[ForecastModel]] = [
+    NaiveForecaster,
+    SeasonalNaiveForecaster,
+    HarmonicRegressionForecaster,
+    HoltForecaster,
+    RandomForestForecaster,
+    ProphetForecaster,
+]
+
+# Modelo por defecto cuando no hay selección por backtesting
+DEFAULT_MODEL = "harmonic"
+
+
+def available_models() -> Dict[str, Type[ForecastModel]]:
+    """
+    Modelos cuyas dependencias están instaladas, indexados por nombre.
+    """
+    models = {}
+    for model_class in MODEL_CLASSES:
+        requires = getattr(model_class, "requires", None)
+        if requires and importlib.util.find_spec(requires) is None:
+            continue
+        models[model_class.name] = model_class
+    return models
+
+
+def create_model(name: str) -> ForecastModel:
+    """
+    Crea una instancia del modelo indicado.
+    """
+    models = available_models()
+    if name not in models:
+        raise ValueError(f"Modelo no disponible: {name}. Debe ser uno de: {', '.join(models)}")
+    return models[name]()
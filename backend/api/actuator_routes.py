@@ -1,7 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
+import math
+
+from api.history_routes import INTERVAL_SECONDS
+from database.actuator_journal import actuator_journal
+from database.shared_state import Registry, get_state_backend, state_sync
+from utils.replication import replication_shipper
 
 # Crear el router para los actuadores
 router = APIRouter(
@@ -16,12 +22,38 @@ class ActuatorBase(BaseModel):
     type: str  # "pump", "light", "fan", "heater", etc.
     location: str
     description: Optional[str] = None
+    flow_rate: Optional[float] = None  # Caudal en L/min (bombas), para calcular el consumo de agua
 
 class ActuatorState(BaseModel):
     actuator_id: int
     state: bool  # True = encendido, False = apagado
     value: Optional[float] = None  # Para actuadores con valores variables (ej. intensidad)
-    timestamp: datetime = datetime.now()
+    timestamp: Optional[datetime] = None  # Por defecto, el instante de recepción
+    issued_by: Optional[str] = None  # Usuario, regla o sistema que emite el comando
+
+class ActuatorEvent(ActuatorState):
+    timestamp: datetime
+    issued_by: str
+    transition: bool  # True si el comando cambió el estado del actuador
+
+class UsageBucket(BaseModel):
+    start: datetime
+    end: datetime
+    on_seconds: float
+    duty_cycle: float
+    activations: int
+    water_liters: Optional[float] = None
+
+class ActuatorUsage(BaseModel):
+    actuator_id: int
+    start: datetime
+    end: datetime
+    interval: str
+    on_seconds: float
+    duty_cycle: float
+    activations: int
+    water_liters: Optional[float] = None
+    buckets: List[UsageBucket]
 
 class ActuatorCreate(ActuatorBase):
     pass
@@ -44,6 +76,7 @@ SAMPLE_ACTUATORS = [
         "type": "pump",
         "location": "Invernadero 1",
         "description": "Bomba principal del sistema de riego del invernadero 1",
+        "flow_rate": 12.0,
         "created_at": datetime.now(),
         "is_active": True,
         "current_state": False,
@@ -73,98 +106,250 @@ SAMPLE_ACTUATORS = [
     }
 ]
 
+# Registro de actuadores compartido por todos los workers
+actuator_registry = Registry("actuators", seed=SAMPLE_ACTUATORS)
+
+# Canal de publicación de las entradas del diario entre workers y espacio
+# de nombres del estado compartido donde se guardan
+JOURNAL_CHANNEL = "actuator_journal"
+JOURNAL_NAMESPACE = "actuator_journal"
+
+# Número máximo de periodos de un informe de uso
+MAX_USAGE_BUCKETS = 10000
+
+def _apply_remote_journal_entry(payload: Dict[str, Any]):
+    """
+    Añade al diario local una entrada registrada por otro worker.
+    """
+    actuator_journal.record(
+        payload["actuator_id"], payload["timestamp"], payload["state"], payload["value"], payload["issued_by"],
+        seq=payload.get("seq"),
+    )
+
+state_sync.subscribe(JOURNAL_CHANNEL, _apply_remote_journal_entry)
+
+def load_journal() -> int:
+    """
+    Reconstruye el diario del worker con las entradas guardadas en el estado
+    compartido (se llama al arrancar). Devuelve cuántas se han añadido.
+    """
+    return actuator_journal.load(get_state_backend().all(JOURNAL_NAMESPACE))
+
+def record_command(
+    actuator_id: int,
+    timestamp: datetime,
+    state: bool,
+    value: Optional[float] = None,
+    issued_by: str = "api",
+    seq: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Registra un comando en el diario, lo guarda en el estado compartido, lo
+    publica a los demás workers y lo replica. Actualiza el estado actual del
+    actuador si es el más reciente.
+
+    Con ``seq`` (reservado antes por quien lo llama) registrar el mismo
+    comando otra vez no lo duplica y devuelve None.
+    """
+    backend = get_state_backend()
+    if seq is None:
+        seq = backend.next_id(JOURNAL_NAMESPACE)
+    entry = actuator_journal.record(actuator_id, timestamp.timestamp(), state, value, issued_by, seq=seq)
+    if entry is None:
+        return None
+    stored = {
+        "seq": seq,
+        "actuator_id": actuator_id,
+        "timestamp": entry["timestamp"],
+        "state": state,
+        "value": value,
+        "issued_by": issued_by,
+    }
+    backend.put(JOURNAL_NAMESPACE, str(seq), stored, sort_key=seq)
+    backend.publish(JOURNAL_CHANNEL, stored)
+    replication_shipper.capture_actuator_event(entry)
+
+    # El estado actual es el de la entrada más reciente del diario, que puede
+    # no ser esta si el comando llega con una marca de tiempo atrasada
+    latest = actuator_journal.latest(actuator_id)
+    if latest["timestamp"] == entry["timestamp"]:
+        fields = {"current_state": state}
+        if entry["transition"] and state:
+            fields["last_activated"] = timestamp
+        actuator_registry.update(actuator_id, fields)
+    return entry
+
+def _event(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {**entry, "timestamp": datetime.fromtimestamp(entry["timestamp"])}
+
+def _usage_boundaries(start: datetime, end: datetime, interval: str) -> List[datetime]:
+    """
+    Límites de los periodos del informe, alineados a la hora o a la medianoche.
+    """
+    step = timedelta(seconds=INTERVAL_SECONDS[interval])
+    if interval == "hourly":
+        first = start.replace(minute=0, second=0, microsecond=0)
+    else:
+        first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    count = math.ceil((end - first) / step)
+    if count > MAX_USAGE_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El informe tendría {count} periodos (máximo {MAX_USAGE_BUCKETS}); use un intervalo mayor"
+        )
+    boundaries = [start] + [first + step * i for i in range(1, count)]
+    boundaries.append(end)
+    return boundaries
+
 # Rutas para los actuadores
 @router.get("/", response_model=List[Actuator])
 async def get_all_actuators():
     """
     Obtiene todos los actuadores registrados en el sistema.
     """
-    return SAMPLE_ACTUATORS
+    return actuator_registry.all()
 
 @router.get("/{actuator_id}", response_model=Actuator)
 async def get_actuator(actuator_id: int):
     """
     Obtiene un actuador específico por su ID.
     """
-    for actuator in SAMPLE_ACTUATORS:
-        if actuator["id"] == actuator_id:
-            return actuator
-    raise HTTPException(status_code=404, detail="Actuador no encontrado")
+    actuator = actuator_registry.get(actuator_id)
+    if actuator is None:
+        raise HTTPException(status_code=404, detail="Actuador no encontrado")
+    return actuator
 
 @router.post("/", response_model=Actuator, status_code=status.HTTP_201_CREATED)
 async def create_actuator(actuator: ActuatorCreate):
     """
     Crea un nuevo actuador en el sistema.
     """
-    # En una implementación real, esto se guardaría en la base de datos
-    new_id = len(SAMPLE_ACTUATORS) + 1
-    new_actuator = {
-        "id": new_id,
+    new_actuator = actuator_registry.create({
         "name": actuator.name,
         "type": actuator.type,
         "location": actuator.location,
         "description": actuator.description,
+        "flow_rate": actuator.flow_rate,
         "created_at": datetime.now(),
         "is_active": True,
         "current_state": False,
         "last_activated": None
-    }
-    SAMPLE_ACTUATORS.append(new_actuator)
+    })
     return new_actuator
 
-@router.post("/{actuator_id}/control", response_model=ActuatorState)
+@router.post("/{actuator_id}/control", response_model=ActuatorEvent)
 async def control_actuator(actuator_id: int, state: ActuatorState):
     """
     Controla el estado de un actuador específico.
+
+    El comando se registra en el diario del actuador junto con quién lo emitió.
     """
-    # Verificar que el actuador existe
-    actuator_exists = False
-    for actuator in SAMPLE_ACTUATORS:
-        if actuator["id"] == actuator_id:
-            actuator_exists = True
-            # Actualizar el estado del actuador
-            actuator["current_state"] = state.state
-            if state.state:
-                actuator["last_activated"] = datetime.now()
-            break
-    
-    if not actuator_exists:
+    if actuator_registry.get(actuator_id) is None:
         raise HTTPException(status_code=404, detail="Actuador no encontrado")
+
+    entry = record_command(
+        actuator_id, state.timestamp or datetime.now(), state.state, state.value, state.issued_by or "api"
+    )
     
     # En una implementación real, esto enviaría comandos al hardware
-    # y se guardaría en la base de datos
-    
     # Simular conexión con Mycodo o sistema de control
     # En este punto se enviarían los comandos al hardware real
     
-    return state
+    return _event(entry)
 
-@router.get("/{actuator_id}/history", response_model=List[ActuatorState])
-async def get_actuator_history(actuator_id: int, limit: int = 10):
+@router.get("/{actuator_id}/history", response_model=List[ActuatorEvent])
+async def get_actuator_history(
+    actuator_id: int,
+    limit: int = 10,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+):
     """
-    Obtiene el historial de estados de un actuador específico.
+    Obtiene el historial de comandos de un actuador, del más reciente al más antiguo.
     """
     # Verificar que el actuador existe
-    actuator_exists = False
-    for actuator in SAMPLE_ACTUATORS:
-        if actuator["id"] == actuator_id:
-            actuator_exists = True
-            break
-    
-    if not actuator_exists:
+    if actuator_registry.get(actuator_id) is None:
         raise HTTPException(status_code=404, detail="Actuador no encontrado")
-    
-    # En una implementación real, esto se obtendría de la base de datos
-    # Generamos datos de ejemplo para desarrollo
-    sample_history = []
-    for i in range(limit):
-        sample_history.append(
-            ActuatorState(
-                actuator_id=actuator_id,
-                state=i % 2 == 0,  # Alternar entre True y False
-                value=50.0 if i % 3 == 0 else None,  # Algunos valores tienen intensidad
-                timestamp=datetime.now()
-            )
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="El límite debe ser mayor que 0")
+
+    entries = actuator_journal.entries(
+        actuator_id,
+        start_date.timestamp() if start_date else None,
+        end_date.timestamp() if end_date else None,
+        limit,
+    )
+    return [_event(entry) for entry in entries]
+
+@router.get("/{actuator_id}/state", response_model=ActuatorEvent)
+async def get_actuator_state_at(actuator_id: int, at: Optional[datetime] = None):
+    """
+    Obtiene el estado de un actuador en un instante (por defecto, ahora): el
+    del último comando registrado hasta ese momento.
+    """
+    if actuator_registry.get(actuator_id) is None:
+        raise HTTPException(status_code=404, detail="Actuador no encontrado")
+    entry = actuator_journal.state_at(actuator_id, (at or datetime.now()).timestamp())
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No hay estados registrados hasta esa fecha")
+    return _event(entry)
+
+@router.get("/{actuator_id}/usage", response_model=ActuatorUsage)
+async def get_actuator_usage(
+    actuator_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    interval: str = "daily"
+):
+    """
+    Obtiene el tiempo encendido, el ciclo de trabajo y el número de encendidos
+    de un actuador por hora, día o semana. Para las bombas con caudal
+    configurado incluye el consumo de agua estimado.
+    """
+    actuator = actuator_registry.get(actuator_id)
+    if actuator is None:
+        raise HTTPException(status_code=404, detail="Actuador no encontrado")
+    if interval not in INTERVAL_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervalo no válido. Debe ser uno de: {', '.join(INTERVAL_SECONDS)}"
         )
-    
-    return sample_history
+
+    # Por defecto, los últimos 7 días; el tiempo futuro no cuenta como encendido
+    now = datetime.now()
+    end_date = min(end_date or now, now)
+    start_date = start_date or end_date - timedelta(days=7)
+    if start_date >= end_date:
+        raise HTTPException(status_code=400, detail="La fecha de inicio debe ser anterior a la de fin")
+
+    boundaries = _usage_boundaries(start_date, end_date, interval)
+    usage = actuator_journal.usage(actuator_id, [boundary.timestamp() for boundary in boundaries])
+    flow_rate = actuator.get("flow_rate")
+
+    def liters(on_seconds: float) -> Optional[float]:
+        return None if flow_rate is None else round(flow_rate * on_seconds / 60, 2)
+
+    buckets = []
+    for (bucket_start, bucket_end), (on_seconds, activations) in zip(zip(boundaries, boundaries[1:]), usage):
+        duration = (bucket_end - bucket_start).total_seconds()
+        buckets.append({
+            "start": bucket_start,
+            "end": bucket_end,
+            "on_seconds": round(on_seconds, 1),
+            "duty_cycle": round(on_seconds / duration, 4) if duration else 0.0,
+            "activations": activations,
+            "water_liters": liters(on_seconds),
+        })
+
+    total_on = sum(on_seconds for on_seconds, _ in usage)
+    return {
+        "actuator_id": actuator_id,
+        "start": start_date,
+        "end": end_date,
+        "interval": interval,
+        "on_seconds": round(total_on, 1),
+        "duty_cycle": round(total_on / (end_date - start_date).total_seconds(), 4),
+        "activations": sum(activations for _, activations in usage),
+        "water_liters": liters(total_on),
+        "buckets": buckets,
+    }
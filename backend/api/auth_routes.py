@@ -0,0 +1,139 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+from typing import List, Optional
+from pydantic import BaseModel
+from datetime import datetime
+
+from utils.auth import ADMIN_ROLE, INGEST_ROLE, ROLES, USER_ROLE, auth_enabled, auth_service
+
+# Crear el router de autenticación
+router = APIRouter(
+    prefix="/auth",
+    tags=["auth"],
+)
+
+# Modelos Pydantic
+class Token(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+class Principal(BaseModel):
+    kind: str
+    sub: str
+    role: str
+
+class UserCreate(BaseModel):
+    username: str
+    password: str
+    role: str = USER_ROLE
+
+class User(BaseModel):
+    username: str
+    role: str
+    disabled: bool = False
+    created_at: Optional[datetime] = None
+
+class ApiKeyCreate(BaseModel):
+    name: str
+    role: str = INGEST_ROLE
+
+class ApiKey(BaseModel):
+    id: str
+    name: str
+    role: str
+    revoked: bool = False
+    created_at: Optional[datetime] = None
+
+class ApiKeyCreated(ApiKey):
+    key: str
+
+def current_principal(request: Request) -> Optional[dict]:
+    """
+    Principal autenticado de la petición (None si la autenticación está desactivada).
+    """
+    return getattr(request.state, "principal", None)
+
+def require_admin(request: Request):
+    """
+    Con la autenticación activa, solo los administradores gestionan usuarios y claves.
+    """
+    principal = current_principal(request)
+    if auth_enabled() and (principal is None or principal["role"] != ADMIN_ROLE):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Se requiere un administrador")
+
+def _check_role(role: str):
+    if role not in ROLES:
+        raise HTTPException(status_code=400, detail=f"Rol no válido; use uno de: {', '.join(ROLES)}")
+
+# Rutas
+@router.post("/token", response_model=Token)
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    """
+    Obtiene un token de acceso con usuario y contraseña. La contraseña se
+    verifica con bcrypt fuera del bucle de eventos.
+    """
+    user = await auth_service.authenticate_user(form_data.username, form_data.password)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuario o contraseña incorrectos",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token, expires_in = auth_service.create_access_token(user)
+    return {"access_token": access_token, "token_type": "bearer", "expires_in": expires_in}
+
+@router.get("/me", response_model=Principal)
+async def read_me(request: Request):
+    """
+    Usuario o clave de API con que se ha autenticado la petición.
+    """
+    principal = current_principal(request)
+    if principal is None:
+        raise HTTPException(status_code=404, detail="La autenticación está desactivada")
+    return principal
+
+@router.get("/users", response_model=List[User], dependencies=[Depends(require_admin)])
+async def get_users():
+    """
+    Usuarios registrados.
+    """
+    return auth_service.all_users()
+
+@router.post("/users", response_model=User, status_code=201, dependencies=[Depends(require_admin)])
+async def create_user(user: UserCreate):
+    """
+    Da de alta un usuario (o cambia la contraseña y el rol de uno existente).
+    """
+    _check_role(user.role)
+    if user.role == INGEST_ROLE:
+        raise HTTPException(status_code=400, detail="El rol de ingesta es solo para claves de API")
+    password_hash = await auth_service.hash_password(user.password)
+    return auth_service.save_user(user.username, password_hash, user.role)
+
+@router.get("/api-keys", response_model=List[ApiKey], dependencies=[Depends(require_admin)])
+async def get_api_keys():
+    """
+    Claves de API emitidas (sin la clave, que solo se muestra al crearla).
+    """
+    return auth_service.all_api_keys()
+
+@router.post("/api-keys", response_model=ApiKeyCreated, status_code=201, dependencies=[Depends(require_admin)])
+async def create_api_key(api_key: ApiKeyCreate):
+    """
+    Emite una clave de API para un cliente máquina. Se envía en la cabecera
+    ``X-API-Key``; guárdela, porque no se puede volver a consultar.
+    """
+    _check_role(api_key.role)
+    key, record = auth_service.create_api_key(api_key.name, api_key.role)
+    return {**record, "key": key}
+
+@router.delete("/api-keys/{key_id}", response_model=ApiKey, dependencies=[Depends(require_admin)])
+async def revoke_api_key(key_id: str):
+    """
+    Revoca una clave de API en todos los workers.
+    """
+    record = auth_service.revoke_api_key(key_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Clave de API no encontrada")
+    return record
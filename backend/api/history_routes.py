@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 
+import numpy as np
+
+from api.sensor_routes import sensor_registry
+from database.reading_sketches import reading_sketches
+from database.readings_store import reading_store
+from utils.admission import ROWS_PER_TOKEN, admission, client_id, plan_query, run_analytics
+from utils.sensor_status import STATUS_THRESHOLDS, classify_status
+
 # Crear el router para el registro histórico
 router = APIRouter(
     prefix="/history",
@@ -24,6 +32,7 @@ class HistoricalDataQuery(BaseModel):
     start_date: datetime
     end_date: datetime
     interval: Optional[str] = "raw"  # raw, hourly, daily, weekly
+    allow_promotion: bool = True  # Pasar a un intervalo más grueso si la consulta es demasiado grande
     
 class HistoricalDataSummary(BaseModel):
     sensor_id: int
@@ -32,9 +41,68 @@ class HistoricalDataSummary(BaseModel):
     min_value: float
     max_value: float
     avg_value: float
+    p5: float
+    p50: float
+    p95: float
+    count: int
+    start_date: datetime
+    end_date: datetime
+
+class HistogramBin(BaseModel):
+    lower: Optional[float] = None  # None = banda abierta por abajo
+    upper: Optional[float] = None  # None = banda abierta por arriba
+    count: int
+    fraction: float
+    hours: float  # Horas con el valor dentro de la banda
+
+class SensorHistogram(BaseModel):
+    sensor_id: int
+    sensor_type: str
+    unit: str
     count: int
     start_date: datetime
     end_date: datetime
+    bins: List[HistogramBin]
+
+# Percentiles del resumen
+SUMMARY_QUANTILES = (0.05, 0.5, 0.95)
+
+# Número máximo de bandas de un histograma
+MAX_HISTOGRAM_BINS = 200
+
+# Duración en segundos de cada intervalo de agregación
+INTERVAL_SECONDS = {
+    "hourly": 3600,
+    "daily": 86400,
+    "weekly": 604800,
+}
+
+def _get_sensor_metadata(sensor_id: int) -> Dict[str, Any]:
+    """
+    Obtiene el tipo y la unidad de un sensor registrado.
+    """
+    sensor = sensor_registry.get(sensor_id)
+    if sensor is not None:
+        return sensor
+    raise HTTPException(status_code=404, detail=f"Sensor no encontrado: {sensor_id}")
+
+def _build_points(sensor: Dict[str, Any], timestamps: np.ndarray, values: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Convierte arrays de marcas de tiempo y valores en puntos históricos.
+    """
+    values = np.round(values, 2)
+    statuses = classify_status(sensor["type"], values)
+    return [
+        {
+            "sensor_id": sensor["id"],
+            "sensor_type": sensor["type"],
+            "value": value,
+            "timestamp": datetime.fromtimestamp(timestamp),
+            "status": point_status,
+            "unit": sensor["unit"],
+        }
+        for timestamp, value, point_status in zip(timestamps.tolist(), values.tolist(), statuses.tolist())
+    ]
 
 # Rutas para el registro histórico
 @router.get("/sensors/{sensor_id}", response_model=List[HistoricalDataPoint])
@@ -46,162 +114,71 @@ async def get_sensor_history(
 ):
     """
     Obtiene el historial de lecturas de un sensor específico.
+
+    Si el rango contiene más de ``limit`` lecturas, se agregan en ``limit``
+    intervalos iguales (media de cada intervalo).
     """
     # Si no se especifican fechas, usar últimas 24 horas
     if not end_date:
         end_date = datetime.now()
     if not start_date:
         start_date = end_date - timedelta(days=1)
-    
-    # En una implementación real, esto se obtendría de la base de datos
-    # Generamos datos de ejemplo para desarrollo
-    sample_history = []
-    
-    # Determinar tipo de sensor y unidad (en una implementación real se obtendría de la BD)
-    sensor_type = "temperature"
-    unit = "°C"
-    if sensor_id == 2:
-        sensor_type = "soil_moisture"
-        unit = "%"
-    elif sensor_id == 3:
-        sensor_type = "ph"
-        unit = "pH"
-    
-    # Generar datos de ejemplo
-    time_step = (end_date - start_date) / min(limit, 100)
-    current_time = start_date
-    
-    base_value = 0
-    if sensor_type == "temperature":
-        base_value = 25.0
-    elif sensor_type == "soil_moisture":
-        base_value = 65.0
-    elif sensor_type == "ph":
-        base_value = 6.8
-    
-    for i in range(min(limit, 100)):
-        # Simular variación en los valores
-        variation = (i * 0.2) - (i * 0.1 if i % 2 == 0 else 0)
-        value = base_value + variation
-        
-        # Determinar estado basado en el valor
-        status = "normal"
-        if sensor_type == "temperature":
-            if value > 30:
-                status = "warning"
-            if value > 35:
-                status = "critical"
-        elif sensor_type == "soil_moisture":
-            if value < 40:
-                status = "warning"
-            if value < 20:
-                status = "critical"
-        elif sensor_type == "ph":
-            if value < 6.0 or value > 7.5:
-                status = "warning"
-            if value < 5.5 or value > 8.0:
-                status = "critical"
-        
-        sample_history.append(
-            HistoricalDataPoint(
-                sensor_id=sensor_id,
-                sensor_type=sensor_type,
-                value=round(value, 2),
-                timestamp=current_time,
-                status=status,
-                unit=unit
-            )
-        )
-        current_time += time_step
-    
-    return sample_history
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="El límite debe ser mayor que cero")
+
+    if limit > admission.max_rows:
+        raise HTTPException(status_code=400, detail=f"El límite no puede superar {admission.max_rows}")
+
+    sensor = _get_sensor_metadata(sensor_id)
+    return await run_analytics(_sensor_history, sensor, start_date.timestamp(), end_date.timestamp(), limit)
+
+def _sensor_history(sensor: Dict[str, Any], start: float, end: float, limit: int) -> List[Dict[str, Any]]:
+    timestamps, values = reading_store.range(sensor["id"], start, end)
+
+    if timestamps.size > limit:
+        step = (end - start) / limit
+        timestamps, values, _ = reading_store.resample(sensor["id"], start, end, step)
+
+    return _build_points(sensor, timestamps, values)
 
 @router.post("/query", response_model=Dict[int, List[HistoricalDataPoint]])
-async def query_historical_data(query: HistoricalDataQuery):
+async def query_historical_data(query: HistoricalDataQuery, request: Request, response: Response):
     """
     Consulta datos históricos para múltiples sensores en un rango de fechas.
+
+    Antes de ejecutarla se estima su coste (filas que devolvería). Si supera
+    el límite, se pasa al intervalo más fino que quepa (``allow_promotion``)
+    o se rechaza con 413. Las cabeceras ``X-Query-Interval`` y
+    ``X-Estimated-Rows`` indican el intervalo usado y el coste estimado.
     """
-    # En una implementación real, esto se obtendría de la base de datos
-    # Generamos datos de ejemplo para desarrollo
+    interval = query.interval or "raw"
+    if interval != "raw" and interval not in INTERVAL_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervalo no válido. Debe ser uno de: raw, {', '.join(INTERVAL_SECONDS)}"
+        )
+
+    start, end = query.start_date.timestamp(), query.end_date.timestamp()
+    sensors = [_get_sensor_metadata(sensor_id) for sensor_id in query.sensor_ids]
+
+    interval, rows = plan_query(query.sensor_ids, start, end, interval, INTERVAL_SECONDS, query.allow_promotion)
+    admission.charge(client_id(request.scope), rows / ROWS_PER_TOKEN)
+    response.headers["X-Query-Interval"] = interval
+    response.headers["X-Estimated-Rows"] = str(rows)
+
+    return await run_analytics(_query_points, sensors, start, end, interval)
+
+def _query_points(sensors: List[Dict[str, Any]], start: float, end: float, interval: str) -> Dict[int, List[Dict[str, Any]]]:
     result = {}
-    
-    for sensor_id in query.sensor_ids:
-        # Determinar tipo de sensor y unidad (en una implementación real se obtendría de la BD)
-        sensor_type = "temperature"
-        unit = "°C"
-        if sensor_id == 2:
-            sensor_type = "soil_moisture"
-            unit = "%"
-        elif sensor_id == 3:
-            sensor_type = "ph"
-            unit = "pH"
-        
-        # Generar datos de ejemplo
-        sample_history = []
-        
+
+    for sensor in sensors:
         # Ajustar intervalo según lo solicitado
-        if query.interval == "hourly":
-            time_step = timedelta(hours=1)
-        elif query.interval == "daily":
-            time_step = timedelta(days=1)
-        elif query.interval == "weekly":
-            time_step = timedelta(weeks=1)
-        else:  # raw
-            time_step = timedelta(minutes=10)
-        
-        current_time = query.start_date
-        
-        base_value = 0
-        if sensor_type == "temperature":
-            base_value = 25.0
-        elif sensor_type == "soil_moisture":
-            base_value = 65.0
-        elif sensor_type == "ph":
-            base_value = 6.8
-        
-        while current_time <= query.end_date:
-            # Simular variación en los valores
-            hours = current_time.hour
-            day_factor = (current_time.day % 5) * 0.2
-            
-            # Crear variación diurna para temperatura
-            if sensor_type == "temperature":
-                hour_variation = 3 * (1 - abs(hours - 12) / 12)  # Mayor al mediodía
-                value = base_value + hour_variation + day_factor
-            else:
-                value = base_value + day_factor
-            
-            # Determinar estado basado en el valor
-            status = "normal"
-            if sensor_type == "temperature":
-                if value > 30:
-                    status = "warning"
-                if value > 35:
-                    status = "critical"
-            elif sensor_type == "soil_moisture":
-                if value < 40:
-                    status = "warning"
-                if value < 20:
-                    status = "critical"
-            elif sensor_type == "ph":
-                if value < 6.0 or value > 7.5:
-                    status = "warning"
-                if value < 5.5 or value > 8.0:
-                    status = "critical"
-            
-            sample_history.append(
-                HistoricalDataPoint(
-                    sensor_id=sensor_id,
-                    sensor_type=sensor_type,
-                    value=round(value, 2),
-                    timestamp=current_time,
-                    status=status,
-                    unit=unit
-                )
-            )
-            current_time += time_step
-        
-        result[sensor_id] = sample_history
+        if interval == "raw":
+            timestamps, values = reading_store.range(sensor["id"], start, end)
+        else:
+            timestamps, values, _ = reading_store.resample(sensor["id"], start, end, INTERVAL_SECONDS[interval])
+
+        result[sensor["id"]] = _build_points(sensor, timestamps, values)
     
     return result
 
@@ -213,6 +190,10 @@ async def get_historical_summary(
 ):
     """
     Obtiene un resumen estadístico de los datos históricos para los sensores especificados.
+
+    Los percentiles 5, 50 y 95 se calculan combinando los histogramas horarios
+    de cada sensor (error relativo máximo del 0,5 %). Los sensores sin
+    lecturas en el rango se omiten del resultado.
     """
     # Si no se especifican fechas, usar últimos 7 días
     if not end_date:
@@ -220,51 +201,96 @@ async def get_historical_summary(
     if not start_date:
         start_date = end_date - timedelta(days=7)
     
-    # En una implementación real, esto se calcularía a partir de los datos en la base de datos
-    # Generamos datos de ejemplo para desarrollo
     summaries = []
     
     for sensor_id in sensor_ids:
-        # Determinar tipo de sensor y unidad (en una implementación real se obtendría de la BD)
-        sensor_type = "temperature"
-        unit = "°C"
-        if sensor_id == 2:
-            sensor_type = "soil_moisture"
-            unit = "%"
-        elif sensor_id == 3:
-            sensor_type = "ph"
-            unit = "pH"
-        
-        # Generar resumen de ejemplo
-        base_value = 0
-        if sensor_type == "temperature":
-            base_value = 25.0
-            min_value = base_value - 5.0
-            max_value = base_value + 8.0
-            avg_value = base_value + 1.5
-        elif sensor_type == "soil_moisture":
-            base_value = 65.0
-            min_value = base_value - 15.0
-            max_value = base_value + 10.0
-            avg_value = base_value - 2.0
-        elif sensor_type == "ph":
-            base_value = 6.8
-            min_value = base_value - 0.5
-            max_value = base_value + 0.3
-            avg_value = base_value - 0.1
+        sensor = _get_sensor_metadata(sensor_id)
+        distribution = await run_analytics(
+            reading_sketches.distribution, sensor_id, start_date.timestamp(), end_date.timestamp()
+        )
+        if distribution is None:
+            continue
+        p5, p50, p95 = distribution.quantiles(SUMMARY_QUANTILES)
         
         summaries.append(
             HistoricalDataSummary(
                 sensor_id=sensor_id,
-                sensor_type=sensor_type,
-                unit=unit,
-                min_value=round(min_value, 2),
-                max_value=round(max_value, 2),
-                avg_value=round(avg_value, 2),
-                count=168,  # Ejemplo: 24 horas * 7 días = 168 lecturas horarias
+                sensor_type=sensor["type"],
+                unit=sensor["unit"],
+                min_value=round(distribution.min, 2),
+                max_value=round(distribution.max, 2),
+                avg_value=round(distribution.mean, 2),
+                p5=round(p5, 2),
+                p50=round(p50, 2),
+                p95=round(p95, 2),
+                count=distribution.count,
                 start_date=start_date,
                 end_date=end_date
             )
         )
     
     return summaries
+
+@router.get("/histogram", response_model=SensorHistogram)
+async def get_histogram(
+    sensor_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    edges: Optional[List[float]] = Query(None),
+    bins: int = 10
+):
+    """
+    Distribución de las lecturas de un sensor en bandas de valores.
+
+    Las bandas se definen con ``edges`` (límites en orden creciente, p. ej.
+    ``edges=5.5&edges=6.0``). Sin ``edges`` se usan los umbrales de estado del
+    tipo de sensor (para el pH, las bandas normal, warning y critical) o, si
+    el tipo no tiene umbrales, ``bins`` bandas iguales entre el mínimo y el
+    máximo. Los límites de hasta tres cifras significativas son exactos.
+    """
+    # Si no se especifican fechas, usar últimos 7 días
+    if not end_date:
+        end_date = datetime.now()
+    if not start_date:
+        start_date = end_date - timedelta(days=7)
+
+    sensor = _get_sensor_metadata(sensor_id)
+    distribution = await run_analytics(
+        reading_sketches.distribution, sensor_id, start_date.timestamp(), end_date.timestamp()
+    )
+    if distribution is None:
+        raise HTTPException(status_code=404, detail="No hay lecturas del sensor en el rango indicado")
+
+    if edges is None:
+        thresholds = STATUS_THRESHOLDS.get(sensor["type"])
+        if thresholds:
+            edges = sorted({bound for level in thresholds.values() for bound in level if bound is not None})
+        else:
+            if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+                raise HTTPException(status_code=400, detail=f"bins debe estar entre 1 y {MAX_HISTOGRAM_BINS}")
+            edges = np.linspace(distribution.min, distribution.max, bins + 1)[1:-1].tolist()
+    if len(edges) >= MAX_HISTOGRAM_BINS:
+        raise HTTPException(status_code=400, detail=f"Como mucho {MAX_HISTOGRAM_BINS - 1} límites")
+    if any(high <= low for low, high in zip(edges, edges[1:])):
+        raise HTTPException(status_code=400, detail="Los límites deben estar en orden creciente")
+
+    counts, hours = distribution.histogram(edges)
+    bounds = [None] + list(edges) + [None]
+    return SensorHistogram(
+        sensor_id=sensor_id,
+        sensor_type=sensor["type"],
+        unit=sensor["unit"],
+        count=distribution.count,
+        start_date=start_date,
+        end_date=end_date,
+        bins=[
+            HistogramBin(
+                lower=bounds[i],
+                upper=bounds[i + 1],
+                count=int(counts[i]),
+                fraction=round(float(counts[i]) / distribution.count, 4),
+                hours=round(float(hours[i]), 2),
+            )
+            for i in range(len(counts))
+        ]
+    )
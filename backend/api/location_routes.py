@@ -0,0 +1,194 @@
+from fastapi import APIRouter, HTTPException
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from api.actuator_routes import actuator_registry
+from api.sensor_routes import sensor_registry
+from utils.admission import admission
+from utils.locations import (
+    HOUR_SECONDS,
+    LEVELS,
+    location_aggregates,
+    location_keys,
+    location_level,
+    location_name,
+    location_parent,
+)
+
+# Crear el router de ubicaciones (granja → invernadero → zona)
+router = APIRouter(
+    prefix="/locations",
+    tags=["locations"],
+    responses={404: {"description": "Ubicación no encontrada"}},
+)
+
+# Los agregados obtienen el tipo, la unidad y la ubicación de cada sensor del registro
+location_aggregates.bind(sensor_registry.get)
+
+# Intervalos de los agregados, múltiplos de la cubeta horaria
+AGGREGATE_INTERVALS = {
+    "hourly": 1,
+    "daily": 24,
+    "weekly": 168,
+}
+
+# Modelos Pydantic
+class LocationNode(BaseModel):
+    location: str  # Clave de la ubicación ("" = granja, "Invernadero 1/Zona A" = zona)
+    name: str
+    level: str  # farm, greenhouse, zone
+    parent: Optional[str] = None
+    sensors: int
+    actuators: int
+    sensor_types: List[str]
+
+class LocationStatus(BaseModel):
+    location: str
+    name: str
+    level: str
+    sensor_type: str
+    unit: str
+    sensors: int
+    current_avg: Optional[float] = None  # Media de las últimas lecturas de sus sensores
+    worst_status: str  # normal, warning, critical
+    status_counts: Dict[str, int]
+    stale: int  # Sensores sin lecturas recientes
+    last_reading_time: Optional[datetime] = None
+
+class LocationAggregatePoint(BaseModel):
+    location: str
+    sensor_type: str
+    timestamp: datetime
+    avg_value: float
+    min_value: float
+    max_value: float
+    count: int
+
+def _check_level(level: Optional[str]):
+    if level is not None and level not in LEVELS:
+        raise HTTPException(status_code=400, detail=f"Nivel no válido. Debe ser uno de: {', '.join(LEVELS)}")
+
+# Rutas
+@router.get("/", response_model=List[LocationNode])
+async def get_locations():
+    """
+    Árbol de ubicaciones a partir de la ubicación de sensores y actuadores,
+    con los que hay en cada una (incluidas sus ubicaciones hijas).
+    """
+    nodes: Dict[str, Dict] = {}
+
+    def node(key: str) -> Dict:
+        if key not in nodes:
+            nodes[key] = {
+                "location": key,
+                "name": location_name(key),
+                "level": location_level(key),
+                "parent": location_parent(key),
+                "sensors": 0,
+                "actuators": 0,
+                "sensor_types": set(),
+            }
+        return nodes[key]
+
+    for sensor in sensor_registry.all():
+        for key in location_keys(sensor.get("location")):
+            node(key)["sensors"] += 1
+            node(key)["sensor_types"].add(sensor["type"])
+    for actuator in actuator_registry.all():
+        for key in location_keys(actuator.get("location")):
+            node(key)["actuators"] += 1
+    node("")
+    return [
+        {**nodes[key], "sensor_types": sorted(nodes[key]["sensor_types"])}
+        for key in sorted(nodes, key=lambda key: (LEVELS.index(location_level(key)), key))
+    ]
+
+@router.get("/status", response_model=List[LocationStatus])
+async def get_location_status(level: Optional[str] = None, sensor_type: Optional[str] = None):
+    """
+    Estado actual por ubicación y tipo de sensor (por ejemplo, el peor pH de
+    cada zona con ``level=zone&sensor_type=ph``). Se mantiene al ingerir, así
+    que no recorre las lecturas.
+    """
+    _check_level(level)
+    rows = location_aggregates.status(level, sensor_type)
+    for row in rows:
+        if row["last_reading_time"] is not None:
+            row["last_reading_time"] = datetime.fromtimestamp(row["last_reading_time"])
+    return rows
+
+@router.get("/aggregates", response_model=List[LocationAggregatePoint])
+async def get_location_aggregates(
+    sensor_type: str,
+    location: Optional[str] = None,
+    level: str = "greenhouse",
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    interval: str = "hourly",
+):
+    """
+    Media, mínimo y máximo de un tipo de sensor por ubicación e intervalo
+    (por ejemplo, la humedad del suelo de cada invernadero por hora). Sin
+    ``location`` devuelve todas las ubicaciones del nivel ``level``. Se
+    calcula con las cubetas horarias precalculadas.
+    """
+    _check_level(level)
+    if interval not in AGGREGATE_INTERVALS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervalo no válido. Debe ser uno de: {', '.join(AGGREGATE_INTERVALS)}"
+        )
+    # Si no se especifican fechas, usar últimas 24 horas
+    if not end_date:
+        end_date = datetime.now()
+    if not start_date:
+        start_date = end_date - timedelta(days=1)
+    start, end = start_date.timestamp(), end_date.timestamp()
+    step = AGGREGATE_INTERVALS[interval] * HOUR_SECONDS
+
+    if location is not None:
+        # Normalizar la clave ("Invernadero 1 / Zona A" -> "Invernadero 1/Zona A")
+        location = location_keys(location)[-1]
+        keys = [location]
+    else:
+        keys = location_aggregates.locations(level, sensor_type)
+    rows = len(keys) * (int((end - start) // step) + 1)
+    if rows > admission.max_rows:
+        raise HTTPException(status_code=413, detail=f"La consulta devolvería {rows} filas (máximo {admission.max_rows})")
+
+    # Intervalos alineados con la hora de start_date
+    base = int(start // HOUR_SECONDS) * HOUR_SECONDS
+    points = []
+    for key in keys:
+        buckets = location_aggregates.hourly(key, sensor_type, start, end)
+        if buckets is None:
+            if location is not None:
+                raise HTTPException(status_code=404, detail="No hay datos de ese tipo en la ubicación")
+            continue
+        hours, counts, sums, mins, maxs = buckets
+        if hours.size == 0:
+            continue
+        # Agrupar las cubetas horarias consecutivas del mismo intervalo
+        groups = (hours * HOUR_SECONDS - base) // step
+        boundaries = np.concatenate(([0], np.nonzero(np.diff(groups))[0] + 1))
+        group_counts = np.add.reduceat(counts, boundaries)
+        group_sums = np.add.reduceat(sums, boundaries)
+        group_mins = np.minimum.reduceat(mins, boundaries)
+        group_maxs = np.maximum.reduceat(maxs, boundaries)
+        group_starts = base + groups[boundaries] * step
+        for timestamp, count, total, low, high in zip(
+            group_starts.tolist(), group_counts.tolist(), group_sums.tolist(), group_mins.tolist(), group_maxs.tolist()
+        ):
+            points.append({
+                "location": key,
+                "sensor_type": sensor_type,
+                "timestamp": datetime.fromtimestamp(timestamp),
+                "avg_value": total / count,
+                "min_value": low,
+                "max_value": high,
+                "count": count,
+            })
+    return points
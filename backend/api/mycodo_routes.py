@@ -3,6 +3,9 @@ from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
 
+from utils.calibration import calibrate_batch, calibration_table, default_calibration
+from utils.ingest import group_readings, ingest_readings
+
 # Crear el router para la integración con Mycodo
 router = APIRouter(
     prefix="/mycodo",
@@ -61,10 +64,20 @@ class MycodoSensorReading(BaseModel):
     sensor_id: str
     sensor_type: str
     value: float
-    timestamp: datetime = datetime.now()
+    timestamp: Optional[datetime] = None  # Por defecto, el instante de recepción
     unit: str
     location: Optional[str] = None
 
+class SensorCalibration(BaseModel):
+    slope: float = 1.0
+    offset: float = 0.0
+    temperature_sensor: Optional[str] = None  # Sonda RTD emparejada (por defecto, la RTD del lote en la misma ubicación)
+    temperature_coefficient: Optional[float] = None  # Por °C (en el DO, 1 = corregir y 0 = el circuito ya recibe T); por defecto, el del tipo de sensor
+    reference_temperature: Optional[float] = None  # Por defecto, la del tipo de sensor (25 °C; 20 °C en el DO)
+
+class SensorCalibrationRecord(SensorCalibration):
+    sensor_id: str
+
 class MycodoConfig(BaseModel):
     host: str
     port: int
@@ -84,8 +97,7 @@ async def receive_mycodo_readings(readings: List[MycodoSensorReading]):
     """
     Recibe lecturas de sensores desde Mycodo.
     """
-    # En una implementación real, esto guardaría las lecturas en la base de datos
-    # y posiblemente activaría análisis o alertas
+    # En una implementación real, esto posiblemente activaría análisis o alertas
     
     # Verificar que los tipos de sensores son válidos
     valid_sensor_types = [sensor["code"] for sensor in ATLAS_SENSOR_TYPES]
@@ -96,24 +108,57 @@ async def receive_mycodo_readings(readings: List[MycodoSensorReading]):
                 detail=f"Tipo de sensor no válido: {reading.sensor_type}. Debe ser uno de: {', '.join(valid_sensor_types)}"
             )
     
-    # Procesar las lecturas (en una implementación real)
-    processed_readings = []
-    for reading in readings:
-        # Aquí se procesarían las lecturas según sea necesario
-        processed_readings.append({
-            "sensor_id": reading.sensor_id,
-            "sensor_type": reading.sensor_type,
-            "value": reading.value,
-            "timestamp": reading.timestamp,
-            "processed": True
-        })
+    # Calibrar y compensar el lote completo antes de guardarlo, agrupado por sensor
+    received_at = datetime.now().timestamp()
+    sensor_types = {reading.sensor_id: reading.sensor_type for reading in readings}
+    locations = {reading.sensor_id: reading.location for reading in readings}
+    batch, compensated = calibrate_batch(
+        group_readings(
+            (reading.sensor_id, reading.timestamp.timestamp() if reading.timestamp else received_at, reading.value)
+            for reading in readings
+        ),
+        sensor_types,
+        locations,
+    )
+    processed = ingest_readings(batch)
     
     return {
         "status": "success",
         "message": f"Recibidas {len(readings)} lecturas de sensores",
-        "processed": len(processed_readings)
+        "processed": processed,
+        "compensated": compensated
     }
 
+@router.get("/calibration", response_model=List[SensorCalibrationRecord])
+async def get_calibrations():
+    """
+    Obtiene las calibraciones configuradas de las sondas Atlas Scientific.
+    """
+    return calibration_table.all_configs()
+
+@router.get("/calibration/{sensor_id}", response_model=SensorCalibrationRecord)
+async def get_calibration(sensor_id: str, sensor_type: Optional[str] = None):
+    """
+    Obtiene la calibración de una sonda (la calibración por defecto de su tipo
+    si no tiene una propia).
+    """
+    config = calibration_table.get_config(sensor_id)
+    if config is None:
+        return {"sensor_id": sensor_id, **default_calibration(sensor_type or "")}
+    return config
+
+@router.put("/calibration/{sensor_id}", response_model=SensorCalibrationRecord)
+async def set_calibration(sensor_id: str, calibration: SensorCalibration):
+    """
+    Configura la calibración y la compensación por temperatura de una sonda.
+    Se aplica a las lecturas recibidas a partir de ese momento.
+    """
+    if calibration.slope == 0:
+        raise HTTPException(status_code=400, detail="La pendiente de calibración no puede ser 0")
+    if calibration.temperature_sensor == sensor_id:
+        raise HTTPException(status_code=400, detail="Una sonda no puede compensarse con su propia lectura")
+    return calibration_table.set_config(sensor_id, calibration.model_dump())
+
 @router.post("/config", status_code=status.HTTP_200_OK)
 async def set_mycodo_config(config: MycodoConfig):
     """
@@ -3,6 +3,22 @@ from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
 
+import numpy as np
+
+from ai.forecasting import (
+    HORIZON_DURATIONS,
+    HORIZON_POINTS,
+    PREDICTION_TYPES,
+    TRAINING_WINDOWS,
+    available_models,
+    create_model,
+)
+from api.sensor_routes import sensor_registry
+from database.readings_store import reading_store
+from database.segment_files import SeriesSource, segment_store
+from database.shared_state import Registry, get_state_backend, state_sync
+from utils.admission import run_analytics
+
 # Crear el router para las predicciones
 router = APIRouter(
     prefix="/predictions",
@@ -24,10 +40,52 @@ class PredictionResult(BaseModel):
     confidence_interval: Optional[Dict[str, List[float]]] = None
     created_at: datetime = datetime.now()
     status: str = "success"  # success, failed, processing
+    model: Optional[str] = None
     
 class PredictionRequest(PredictionBase):
     pass
 
+class BacktestRequest(BaseModel):
+    sensor_ids: Optional[List[int]] = None  # Por defecto, todos los sensores con datos
+    time_horizons: Optional[List[str]] = None
+    models: Optional[List[str]] = None
+    origins: int = 5
+    min_coverage: float = 0.8
+    mae_tolerance: float = 0.1
+
+class BacktestResult(BaseModel):
+    sensor_id: int
+    prediction_type: str
+    time_horizon: str
+    model: str
+    origins: int
+    mae: Optional[float] = None
+    coverage: Optional[float] = None
+    interval_width: Optional[float] = None
+    fit_ms: Optional[float] = None
+    predict_ms: Optional[float] = None
+    peak_memory_kb: Optional[float] = None
+    error: Optional[str] = None
+
+class ModelSelection(BaseModel):
+    sensor_id: int
+    time_horizon: str
+    model: str
+    mae: float
+    coverage: float
+    cost_ms: float
+    meets_accuracy: bool
+
+class BacktestReport(BaseModel):
+    results: List[BacktestResult]
+    selection: List[ModelSelection]
+
+class BacktestJob(BaseModel):
+    job_id: int
+    status: str  # pending, running, done, failed
+    report: Optional[BacktestReport] = None
+    error: Optional[str] = None
+
 # Datos de ejemplo para desarrollo
 SAMPLE_PREDICTIONS = [
     {
@@ -49,17 +107,46 @@ SAMPLE_PREDICTIONS = [
     }
 ]
 
+# Registro de predicciones compartido por todos los workers
+prediction_registry = Registry("predictions", seed=SAMPLE_PREDICTIONS)
+
+# Cola de trabajos de backtesting
+BACKTEST_QUEUE = "backtest"
+
+def _forecast(sensor_id: int, time_horizon: str):
+    """
+    Ajusta el modelo seleccionado para el sensor con su historial reciente y
+    predice el horizonte solicitado a partir de la última lectura.
+    """
+    last = reading_store.latest(sensor_id)
+    if last is None:
+        return None
+    last_time = last[0]
+    timestamps, values = reading_store.range(
+        sensor_id, last_time - TRAINING_WINDOWS[time_horizon].total_seconds(), last_time
+    )
+    # El backtesting (pool de procesos, tracemalloc) se carga al primer uso
+    from ai import backtesting
+
+    model_name = backtesting.get_selected_model(sensor_id, time_horizon)
+    model = create_model(model_name).fit(timestamps, values)
+
+    step = HORIZON_DURATIONS[time_horizon].total_seconds() / HORIZON_POINTS[time_horizon]
+    forecast_times = last_time + step * np.arange(1, HORIZON_POINTS[time_horizon] + 1)
+    prediction, lower, upper = model.predict(forecast_times)
+    return model_name, forecast_times, prediction, lower, upper
+
 # Rutas para las predicciones
 @router.post("/", response_model=PredictionResult)
 async def create_prediction(prediction_request: PredictionRequest):
     """
     Crea una nueva predicción basada en datos históricos de un sensor.
+
+    Se usa el modelo elegido para el sensor en el último backtest o, si no lo
+    hay, el modelo por defecto.
     """
-    # En una implementación real, esto invocaría al módulo de IA para generar predicciones
-    # Aquí generamos datos de ejemplo para desarrollo
-    
     # Verificar que el tipo de predicción es válido
-    valid_types = ["temperature", "humidity", "ph", "soil_moisture", "light"]
+    valid_types = PREDICTION_TYPES
     if prediction_request.prediction_type not in valid_types:
         raise HTTPException(
             status_code=400, 
@@ -67,52 +154,36 @@ async def create_prediction(prediction_request: PredictionRequest):
         )
     
     # Verificar que el horizonte temporal es válido
-    valid_horizons = ["1h", "6h", "24h", "7d"]
+    valid_horizons = list(HORIZON_DURATIONS)
     if prediction_request.time_horizon not in valid_horizons:
         raise HTTPException(
             status_code=400, 
             detail=f"Horizonte temporal no válido. Debe ser uno de: {', '.join(valid_horizons)}"
         )
     
-    # Generar predicción de ejemplo
-    predicted_values = []
-    lower_bounds = []
-    upper_bounds = []
-    
-    # Generar valores según el tipo de predicción
-    base_value = 0
-    if prediction_request.prediction_type == "temperature":
-        base_value = 25.0
-    elif prediction_request.prediction_type == "humidity":
-        base_value = 65.0
-    elif prediction_request.prediction_type == "ph":
-        base_value = 6.8
-    elif prediction_request.prediction_type == "soil_moisture":
-        base_value = 70.0
-    elif prediction_request.prediction_type == "light":
-        base_value = 5000.0
+    # Verificar que el sensor existe y mide lo que se quiere predecir
+    sensor = sensor_registry.get(prediction_request.sensor_id)
+    if sensor is None:
+        raise HTTPException(status_code=404, detail=f"Sensor no encontrado: {prediction_request.sensor_id}")
+    if sensor["type"] != prediction_request.prediction_type:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El sensor {prediction_request.sensor_id} es de tipo {sensor['type']}, no {prediction_request.prediction_type}"
+        )
     
-    # Generar valores de predicción
-    num_points = 24  # Por defecto, 24 puntos
-    if prediction_request.time_horizon == "1h":
-        num_points = 12
-    elif prediction_request.time_horizon == "6h":
-        num_points = 18
-    elif prediction_request.time_horizon == "7d":
-        num_points = 28
+    # Ajustar y predecir fuera del bucle de eventos
+    forecast = await run_analytics(_forecast, prediction_request.sensor_id, prediction_request.time_horizon)
+    if forecast is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No hay datos históricos para el sensor {prediction_request.sensor_id}"
+        )
+    model_name, forecast_times, prediction, lower, upper = forecast
     
-    for i in range(num_points):
-        # Simular variación en los valores
-        variation = (i * 0.2) - (i * 0.1 if i % 2 == 0 else 0)
-        value = base_value + variation
-        
-        # Añadir a las listas
-        predicted_values.append({
-            "timestamp": datetime.now(),
-            "value": round(value, 2)
-        })
-        lower_bounds.append(round(value - 0.5, 2))
-        upper_bounds.append(round(value + 0.5, 2))
+    predicted_values = [
+        {"timestamp": datetime.fromtimestamp(timestamp), "value": round(value, 2)}
+        for timestamp, value in zip(forecast_times.tolist(), prediction.tolist())
+    ]
     
     # Crear objeto de predicción
     prediction_result = PredictionResult(
@@ -121,22 +192,125 @@ async def create_prediction(prediction_request: PredictionRequest):
         time_horizon=prediction_request.time_horizon,
         predicted_values=predicted_values,
         confidence_interval={
-            "lower": lower_bounds,
-            "upper": upper_bounds
+            "lower": np.round(lower, 2).tolist(),
+            "upper": np.round(upper, 2).tolist()
         },
         created_at=datetime.now(),
-        status="success"
+        status="success",
+        model=model_name
     )
     
     return prediction_result
 
+def _validate_backtest(backtest_request: BacktestRequest):
+    """
+    Verifica los modelos y horizontes solicitados para un backtest.
+    """
+    unknown_models = [model for model in backtest_request.models or [] if model not in available_models()]
+    if unknown_models:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modelos no disponibles: {', '.join(unknown_models)}. Deben ser de: {', '.join(available_models())}"
+        )
+    invalid_horizons = [
+        horizon for horizon in backtest_request.time_horizons or [] if horizon not in HORIZON_DURATIONS
+    ]
+    if invalid_horizons:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Horizonte temporal no válido. Debe ser uno de: {', '.join(HORIZON_DURATIONS)}"
+        )
+
+def _execute_backtest(backtest_request: BacktestRequest) -> Dict[str, Any]:
+    """
+    Ejecuta el backtest sobre los sensores con datos y actualiza la selección
+    de modelos. Lanza ValueError si no hay sensores que evaluar.
+    """
+    from ai import backtesting
+
+    # Sensores con un tipo de predicción válido y datos en el almacén
+    series = {}
+    for sensor in sensor_registry.all():
+        if backtest_request.sensor_ids is not None and sensor["id"] not in backtest_request.sensor_ids:
+            continue
+        if sensor["type"] not in PREDICTION_TYPES:
+            continue
+        if segment_store.enabled:
+            # Los procesos del backtest abren los segmentos en lugar de recibir copias
+            source = SeriesSource.from_store(sensor["id"])
+            if source.size:
+                series[sensor["id"]] = (sensor["type"], source, None)
+        else:
+            timestamps, values = reading_store.range(sensor["id"])
+            if timestamps.size:
+                series[sensor["id"]] = (sensor["type"], timestamps, values)
+    if not series:
+        raise ValueError("No hay sensores con datos históricos para evaluar")
+
+    results = backtesting.run_backtest(
+        series,
+        backtest_request.time_horizons or list(HORIZON_DURATIONS),
+        backtest_request.models or list(available_models()),
+        backtest_request.origins,
+    )
+    selection = backtesting.select_models(results, backtest_request.min_coverage, backtest_request.mae_tolerance)
+    backtesting.update_model_selection(selection)
+    return {"results": results, "selection": list(selection.values())}
+
+def _run_backtest_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ejecuta un trabajo de backtesting reclamado de la cola compartida.
+    """
+    return _execute_backtest(BacktestRequest(**payload))
+
+state_sync.register_job(BACKTEST_QUEUE, _run_backtest_job)
+
+@router.post("/backtest", response_model=BacktestReport)
+async def run_backtest(backtest_request: BacktestRequest):
+    """
+    Evalúa los modelos de predicción sobre el historial de los sensores con
+    origen móvil y actualiza la selección de modelo de cada sensor.
+    """
+    _validate_backtest(backtest_request)
+    try:
+        return await run_analytics(_execute_backtest, backtest_request)
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+
+@router.post("/backtest/jobs", response_model=BacktestJob, status_code=status.HTTP_202_ACCEPTED)
+async def enqueue_backtest(backtest_request: BacktestRequest):
+    """
+    Encola un backtest para que lo ejecute en segundo plano el primer worker libre.
+    """
+    _validate_backtest(backtest_request)
+    job_id = get_state_backend().enqueue(BACKTEST_QUEUE, backtest_request.model_dump())
+    return {"job_id": job_id, "status": "pending"}
+
+@router.get("/backtest/jobs/{job_id}", response_model=BacktestJob)
+async def get_backtest_job(job_id: int):
+    """
+    Obtiene el estado y, si ha terminado, el resultado de un backtest encolado.
+    """
+    job = get_state_backend().get_job(job_id)
+    if job is None or job["queue"] != BACKTEST_QUEUE:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return {"job_id": job_id, "status": job["status"], "report": job["result"], "error": job["error"]}
+
+@router.get("/models", response_model=List[ModelSelection])
+async def get_model_selection():
+    """
+    Obtiene el modelo seleccionado para cada sensor y horizonte.
+    """
+    from ai import backtesting
+
+    return backtesting.get_model_selection()
+
 @router.get("/{sensor_id}", response_model=List[PredictionResult])
 async def get_predictions_for_sensor(sensor_id: int):
     """
     Obtiene todas las predicciones para un sensor específico.
     """
-    # En una implementación real, esto se obtendría de la base de datos
-    sensor_predictions = [p for p in SAMPLE_PREDICTIONS if p["sensor_id"] == sensor_id]
+    sensor_predictions = [p for p in prediction_registry.all() if p["sensor_id"] == sensor_id]
     
     if not sensor_predictions:
         # Si no hay predicciones, devolver lista vacía
@@ -149,9 +323,8 @@ async def get_latest_prediction(sensor_id: int, prediction_type: str):
     """
     Obtiene la predicción más reciente de un tipo específico para un sensor.
     """
-    # En una implementación real, esto se obtendría de la base de datos
     matching_predictions = [
-        p for p in SAMPLE_PREDICTIONS 
+        p for p in prediction_registry.all() 
         if p["sensor_id"] == sensor_id and p["prediction_type"] == prediction_type
     ]
     
@@ -0,0 +1,336 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from typing import Any, Dict, Hashable, List, Optional
+from pydantic import BaseModel
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+import os
+import threading
+
+from api.actuator_routes import JOURNAL_NAMESPACE, actuator_registry, record_command
+from api.sensor_routes import sensor_registry
+from database.shared_state import Registry, get_state_backend
+from utils.ingest import ingest_readings
+from utils.replication import STREAMS, decode_segment, replication_shipper
+
+# Crear el router de replicación (lado del servidor central y estado del nodo)
+router = APIRouter(
+    prefix="/replication",
+    tags=["replication"],
+)
+
+# Nodos conocidos y correspondencia entre identificadores del nodo y locales
+NODES_NAMESPACE = "replication_nodes"
+SOURCES_NAMESPACE = "replication_sources"
+
+# Resúmenes horarios recibidos, por sensor local y hora. Se guardan aparte de
+# las lecturas: el nodo envía también las lecturas en bruto del mismo sensor
+ROLLUPS_NAMESPACE = "replication_rollups"
+
+# Secuencia del diario asignada a cada comando replicado, para no duplicarlo
+# si el nodo reenvía un segmento que no llegó a confirmarse
+APPLIED_COMMANDS_NAMESPACE = "replication_applied_commands"
+
+# Campos obligatorios de los registros de cada flujo
+RECORD_FIELDS = {
+    "actuator_events": ("actuator_id", "timestamp", "state"),
+    "rollups": ("sensor_id", "hour", "mean"),
+    "readings": ("sensor_id", "timestamps", "values"),
+}
+
+# Campos de los sensores y actuadores que viajan con cada segmento
+SOURCE_FIELDS = ("name", "type", "location", "unit", "description", "flow_rate")
+
+class SegmentAck(BaseModel):
+    node_id: str
+    stream: str
+    acked_seq: int
+    applied: int
+
+class HourlyRollup(BaseModel):
+    sensor_id: int
+    node_id: str
+    hour: datetime
+    mean: float
+    min: Optional[float] = None
+    max: Optional[float] = None
+    count: Optional[int] = None
+
+class ReplicationNode(BaseModel):
+    node_id: str
+    cursors: Dict[str, int]
+    last_seen: Optional[datetime] = None
+    records_received: int = 0
+
+def _check_token(x_replication_token: Optional[str] = Header(None)):
+    """
+    Si el servidor tiene REPLICATION_TOKEN, los nodos deben enviarlo.
+    """
+    token = os.getenv("REPLICATION_TOKEN")
+    if token and x_replication_token != token:
+        raise HTTPException(status_code=401, detail="Token de replicación no válido")
+
+def _cursor_name(node_id: str, stream: str) -> str:
+    return f"replication:{node_id}:{stream}"
+
+def describe_sources(stream: str, ids: List[Hashable]) -> Dict[str, Dict[str, Any]]:
+    """
+    Metadatos de los sensores o actuadores de un segmento, para que el
+    servidor central pueda darlos de alta.
+    """
+    registry = actuator_registry if stream == "actuator_events" else sensor_registry
+    result = {}
+    for source_id in ids:
+        record = registry.get(source_id) if isinstance(source_id, int) else None
+        if record is not None:
+            result[str(source_id)] = {field: record[field] for field in SOURCE_FIELDS if record.get(field) is not None}
+    return result
+
+# Caché local de la correspondencia (las entradas no cambian una vez creadas)
+_local_ids: Dict[str, int] = {}
+_local_ids_lock = threading.Lock()
+
+def _local_id(node_id: str, kind: str, remote_id: Hashable, metadata: Optional[Dict[str, Any]]) -> int:
+    """
+    Identificador local del sensor o actuador ``remote_id`` del nodo. La
+    primera vez se da de alta con los metadatos enviados por el nodo.
+    """
+    key = f"{node_id}:{kind}:{remote_id}"
+    with _local_ids_lock:
+        if key in _local_ids:
+            return _local_ids[key]
+
+    backend = get_state_backend()
+    registry: Registry = actuator_registry if kind == "actuator" else sensor_registry
+    mapping = backend.get(SOURCES_NAMESPACE, key)
+    if mapping is None:
+        record_id = registry.reserve_id()
+        mapping = {"id": record_id, "node_id": node_id, "kind": kind, "remote_id": remote_id}
+        # Si otro worker se adelantó, se usa su entrada
+        if backend.put_if_absent(SOURCES_NAMESPACE, key, mapping):
+            metadata = metadata or {}
+            fields = {
+                "name": metadata.get("name") or f"{node_id} {remote_id}",
+                "type": metadata.get("type", "unknown"),
+                "location": metadata.get("location") or node_id,
+                "description": metadata.get("description"),
+                "created_at": datetime.now(),
+                "origin": {"node_id": node_id, "remote_id": remote_id},
+            }
+            if kind == "actuator":
+                fields.update({
+                    "flow_rate": metadata.get("flow_rate"),
+                    "is_active": True,
+                    "current_state": False,
+                    "last_activated": None,
+                })
+            else:
+                fields.update({"unit": metadata.get("unit", ""), "last_reading": None, "last_reading_time": None})
+            registry.create(fields, record_id=record_id)
+        else:
+            mapping = backend.get(SOURCES_NAMESPACE, key)
+
+    with _local_ids_lock:
+        _local_ids[key] = mapping["id"]
+    return mapping["id"]
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _record_error(stream: str, record: Any, previous_seq: int) -> Optional[str]:
+    """
+    Motivo por el que un registro no se puede aplicar, o None si es válido.
+    """
+    if not isinstance(record, dict):
+        return "El registro no es un objeto"
+    seq = record.get("seq")
+    if not isinstance(seq, int) or isinstance(seq, bool) or seq <= previous_seq:
+        return "Secuencia ausente o no creciente"
+    missing = [field for field in RECORD_FIELDS[stream] if field not in record]
+    if missing:
+        return f"Faltan los campos {missing}"
+    source_id = record["actuator_id" if stream == "actuator_events" else "sensor_id"]
+    if not isinstance(source_id, (int, str)) or isinstance(source_id, bool):
+        return "Identificador de origen no válido"
+    if stream == "actuator_events":
+        if not _is_number(record["timestamp"]) or not isinstance(record["state"], bool):
+            return "Marca de tiempo o estado no válidos"
+        if record.get("value") is not None and not _is_number(record["value"]):
+            return "Valor no válido"
+    elif stream == "rollups":
+        if not _is_number(record["hour"]) or not _is_number(record["mean"]):
+            return "Hora o media no válidas"
+        if any(record.get(field) is not None and not _is_number(record[field]) for field in ("min", "max", "count")):
+            return "Mínimo, máximo o número de lecturas no válidos"
+    else:
+        timestamps, values = record["timestamps"], record["values"]
+        if not isinstance(timestamps, list) or not isinstance(values, list) or len(timestamps) != len(values):
+            return "Listas de lecturas no válidas"
+        if not all(_is_number(item) for item in timestamps) or not all(_is_number(item) for item in values):
+            return "Lecturas no numéricas"
+    return None
+
+def _validate_records(stream: str, records: Any):
+    """
+    Comprueba todo el segmento antes de aplicar nada: un registro mal formado
+    se rechaza con 400 sin tocar el cursor.
+    """
+    if not isinstance(records, list):
+        raise HTTPException(status_code=400, detail="Los registros del segmento no son una lista")
+    previous_seq = 0
+    for index, record in enumerate(records):
+        error = _record_error(stream, record, previous_seq)
+        if error:
+            raise HTTPException(status_code=400, detail={"message": error, "index": index})
+        previous_seq = record["seq"]
+
+def _command_seq(node_id: str, remote_seq: int) -> int:
+    """
+    Secuencia del diario del comando ``remote_seq`` del nodo; se reserva la
+    primera vez y se reutiliza si el comando vuelve a llegar.
+    """
+    backend = get_state_backend()
+    key = f"{node_id}:{remote_seq}"
+    applied = backend.get(APPLIED_COMMANDS_NAMESPACE, key)
+    if applied is None:
+        applied = {"seq": backend.next_id(JOURNAL_NAMESPACE)}
+        if not backend.put_if_absent(APPLIED_COMMANDS_NAMESPACE, key, applied):
+            applied = backend.get(APPLIED_COMMANDS_NAMESPACE, key)
+    return applied["seq"]
+
+def _apply_records(node_id: str, stream: str, records: List[Dict[str, Any]], sources: Dict[str, Any]):
+    """
+    Aplica registros ya validados. Es idempotente: aplicar otra vez los
+    mismos registros no duplica comandos ni lecturas.
+    """
+    if stream == "actuator_events":
+        for record in records:
+            actuator_id = _local_id(node_id, "actuator", record["actuator_id"], sources.get(str(record["actuator_id"])))
+            record_command(
+                actuator_id, datetime.fromtimestamp(record["timestamp"]), record["state"],
+                record.get("value"), f"{node_id}:{record.get('issued_by', 'api')}",
+                seq=_command_seq(node_id, record["seq"]),
+            )
+        return
+
+    if stream == "rollups":
+        backend = get_state_backend()
+        for record in records:
+            sensor_id = _local_id(node_id, "sensor", record["sensor_id"], sources.get(str(record["sensor_id"])))
+            hour = int(record["hour"])
+            backend.put(ROLLUPS_NAMESPACE, f"{sensor_id}:{hour}", {
+                "sensor_id": sensor_id,
+                "node_id": node_id,
+                "hour": hour,
+                "mean": record["mean"],
+                "min": record.get("min"),
+                "max": record.get("max"),
+                "count": record.get("count"),
+            }, sort_key=hour)
+        return
+
+    batch: Dict[Hashable, tuple] = {}
+    for record in records:
+        sensor_id = _local_id(node_id, "sensor", record["sensor_id"], sources.get(str(record["sensor_id"])))
+        timestamps, values = batch.setdefault(sensor_id, ([], []))
+        timestamps.extend(record["timestamps"])
+        values.extend(record["values"])
+    ingest_readings(batch, only_missing=True)
+
+def _apply_segment(segment: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Aplica un segmento exactamente una vez: solo los registros con secuencia
+    mayor que la última aplicada para el nodo y el flujo.
+
+    El cursor avanza después de aplicar los registros. Si el proceso se
+    interrumpe entre medias, el nodo reenvía el segmento y, como aplicarlo es
+    idempotente, no se duplica nada; tampoco si dos workers reciben el mismo
+    segmento a la vez.
+    """
+    node_id, stream = segment.get("node_id"), segment.get("stream")
+    records = segment.get("records") or []
+    if not node_id or stream not in STREAMS:
+        raise HTTPException(status_code=400, detail="Segmento sin nodo o con un flujo desconocido")
+    _validate_records(stream, records)
+
+    backend = get_state_backend()
+    name = _cursor_name(node_id, stream)
+    acked = backend.get_counter(name)
+    new_records = [record for record in records if record["seq"] > acked]
+    if not new_records:
+        # Segmento repetido: ya estaba aplicado
+        return {"node_id": node_id, "stream": stream, "acked_seq": acked, "applied": 0}
+    if new_records[0]["seq"] > acked + 1 and not segment.get("resync"):
+        raise HTTPException(status_code=409, detail={"message": "Faltan registros anteriores", "acked_seq": acked})
+
+    _apply_records(node_id, stream, new_records, segment.get("sources") or {})
+
+    # Otro worker puede haber avanzado el cursor mientras tanto con una parte
+    # de estos registros: se avanza hasta el último aplicado aquí
+    last_seq = new_records[-1]["seq"]
+    current = acked
+    while current < last_seq and not backend.advance_counter(name, current, last_seq):
+        current = backend.get_counter(name)
+    if current >= last_seq:
+        # Ya los había confirmado otro worker
+        return {"node_id": node_id, "stream": stream, "acked_seq": current, "applied": 0}
+
+    node = backend.get(NODES_NAMESPACE, node_id) or {"node_id": node_id, "records_received": 0}
+    node.update({"last_seen": datetime.now(), "records_received": node["records_received"] + len(new_records)})
+    backend.put(NODES_NAMESPACE, node_id, node)
+    return {"node_id": node_id, "stream": stream, "acked_seq": last_seq, "applied": len(new_records)}
+
+def _node(node_id: str) -> Dict[str, Any]:
+    backend = get_state_backend()
+    node = backend.get(NODES_NAMESPACE, node_id) or {"node_id": node_id}
+    return {**node, "cursors": {stream: backend.get_counter(_cursor_name(node_id, stream)) for stream in STREAMS}}
+
+# Rutas del servidor central
+@router.post("/segments", response_model=SegmentAck, dependencies=[Depends(_check_token)])
+async def receive_segment(request: Request, x_segment_checksum: Optional[str] = Header(None)):
+    """
+    Recibe un segmento comprimido con gzip de un nodo. Reenviar un segmento
+    ya aplicado no duplica datos; si faltan registros anteriores se responde
+    409 con la última secuencia aplicada para que el nodo continúe desde ahí.
+    """
+    try:
+        segment = decode_segment(await request.body(), x_segment_checksum)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return await run_in_threadpool(_apply_segment, segment)
+
+@router.get("/nodes", response_model=List[ReplicationNode], dependencies=[Depends(_check_token)])
+async def get_nodes():
+    """
+    Nodos que han replicado datos a este servidor.
+    """
+    return [_node(node["node_id"]) for node in get_state_backend().all(NODES_NAMESPACE)]
+
+@router.get("/nodes/{node_id}", response_model=ReplicationNode, dependencies=[Depends(_check_token)])
+async def get_node(node_id: str):
+    """
+    Última secuencia aplicada de cada flujo de un nodo (0 si no ha enviado nada).
+    """
+    return _node(node_id)
+
+@router.get("/sensors/{sensor_id}/rollups", response_model=List[HourlyRollup], dependencies=[Depends(_check_token)])
+async def get_sensor_rollups(sensor_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    """
+    Resúmenes horarios recibidos de un sensor replicado, por orden de hora.
+    """
+    start = start_date.timestamp() if start_date else float("-inf")
+    end = end_date.timestamp() if end_date else float("inf")
+    rollups = [
+        {**rollup, "hour": datetime.fromtimestamp(rollup["hour"])}
+        for rollup in get_state_backend().all(ROLLUPS_NAMESPACE)
+        if rollup["sensor_id"] == sensor_id and start <= rollup["hour"] <= end
+    ]
+    return sorted(rollups, key=lambda rollup: rollup["hour"])
+
+# Estado del nodo
+@router.get("/status")
+async def get_replication_status():
+    """
+    Estado de la replicación de este nodo: registros pendientes por flujo,
+    secuencias confirmadas y último error.
+    """
+    return await run_in_threadpool(replication_shipper.status)
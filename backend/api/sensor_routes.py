@@ -1,7 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+
+from database.readings_store import reading_store
+from database.shared_state import Registry, get_state_backend, state_sync
+from utils.ingest import ingest_readings
+from utils.sensor_status import classify_status
+from utils.virtual_sensors import virtual_sensor_graph
 
 # Crear el router para los sensores
 router = APIRouter(
@@ -27,11 +34,22 @@ class SensorReading(BaseModel):
 class SensorCreate(SensorBase):
     pass
 
+class VirtualSensorDefinition(BaseModel):
+    expression: str  # p. ej. "vpd(t, rh)"
+    inputs: Dict[str, int]  # Variable de la expresión -> ID del sensor de entrada
+    aggregate: Optional[str] = None  # "integral" o "sum" dentro de la ventana
+    window: str = "daily"  # hourly, daily, weekly
+    max_staleness_seconds: Optional[int] = None  # Antigüedad máxima de las entradas
+
+class VirtualSensorCreate(SensorBase):
+    virtual: VirtualSensorDefinition
+
 class Sensor(SensorBase):
     id: int
     created_at: datetime
     last_reading: Optional[float] = None
     last_reading_time: Optional[datetime] = None
+    virtual: Optional[VirtualSensorDefinition] = None
     
     class Config:
         orm_mode = True
@@ -73,33 +91,57 @@ SAMPLE_SENSORS = [
     }
 ]
 
+# Registro de sensores compartido por todos los workers
+sensor_registry = Registry("sensors", seed=SAMPLE_SENSORS)
+
+# Canal de publicación de los sensores virtuales nuevos entre workers
+VIRTUAL_SENSORS_CHANNEL = "virtual_sensors"
+
+def _register_remote_virtual_sensor(sensor_id: int):
+    """
+    Añade al grafo local un sensor virtual creado por otro worker.
+    """
+    sensor = sensor_registry.get(sensor_id)
+    if sensor is not None and sensor.get("virtual"):
+        virtual_sensor_graph.register(sensor_id, sensor["virtual"])
+
+state_sync.subscribe(VIRTUAL_SENSORS_CHANNEL, _register_remote_virtual_sensor)
+
+def _with_latest(sensor: Dict) -> Dict:
+    """
+    Completa un sensor con su última lectura, tomada del almacén de lecturas
+    (el registro no se actualiza en cada lectura).
+    """
+    latest = reading_store.latest(sensor["id"])
+    if latest is not None:
+        sensor["last_reading_time"] = datetime.fromtimestamp(latest[0])
+        sensor["last_reading"] = latest[1]
+    return sensor
+
 # Rutas para los sensores
 @router.get("/", response_model=List[Sensor])
 async def get_all_sensors():
     """
     Obtiene todos los sensores registrados en el sistema.
     """
-    return SAMPLE_SENSORS
+    return [_with_latest(sensor) for sensor in sensor_registry.all()]
 
 @router.get("/{sensor_id}", response_model=Sensor)
 async def get_sensor(sensor_id: int):
     """
     Obtiene un sensor específico por su ID.
     """
-    for sensor in SAMPLE_SENSORS:
-        if sensor["id"] == sensor_id:
-            return sensor
-    raise HTTPException(status_code=404, detail="Sensor no encontrado")
+    sensor = sensor_registry.get(sensor_id)
+    if sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor no encontrado")
+    return _with_latest(sensor)
 
 @router.post("/", response_model=Sensor, status_code=status.HTTP_201_CREATED)
 async def create_sensor(sensor: SensorCreate):
     """
     Crea un nuevo sensor en el sistema.
     """
-    # En una implementación real, esto se guardaría en la base de datos
-    new_id = len(SAMPLE_SENSORS) + 1
-    new_sensor = {
-        "id": new_id,
+    new_sensor = sensor_registry.create({
         "name": sensor.name,
         "type": sensor.type,
         "location": sensor.location,
@@ -108,8 +150,38 @@ async def create_sensor(sensor: SensorCreate):
         "created_at": datetime.now(),
         "last_reading": None,
         "last_reading_time": None
-    }
-    SAMPLE_SENSORS.append(new_sensor)
+    })
+    return new_sensor
+
+@router.post("/virtual", response_model=Sensor, status_code=status.HTTP_201_CREATED)
+async def create_virtual_sensor(sensor: VirtualSensorCreate):
+    """
+    Crea un sensor virtual calculado a partir de otros sensores (VPD, punto
+    de rocío, integral de luz diaria...) y calcula su historial.
+    """
+    definition = sensor.virtual.model_dump()
+    missing = [input_id for input_id in definition["inputs"].values() if sensor_registry.get(input_id) is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Sensores de entrada no encontrados: {missing}")
+    try:
+        # Validar la expresión antes de crear el sensor (la evalúa, así que fuera del bucle de eventos)
+        await run_in_threadpool(virtual_sensor_graph.validate, None, definition)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    new_sensor = sensor_registry.create({
+        "name": sensor.name,
+        "type": sensor.type,
+        "location": sensor.location,
+        "unit": sensor.unit,
+        "description": sensor.description,
+        "created_at": datetime.now(),
+        "last_reading": None,
+        "last_reading_time": None,
+        "virtual": definition
+    })
+    await run_in_threadpool(virtual_sensor_graph.register, new_sensor["id"], definition)
+    get_state_backend().publish(VIRTUAL_SENSORS_CHANNEL, new_sensor["id"])
     return new_sensor
 
 @router.post("/{sensor_id}/readings", response_model=SensorReading)
@@ -117,48 +189,39 @@ async def add_sensor_reading(sensor_id: int, reading: SensorReading):
     """
     Registra una nueva lectura para un sensor específico.
     """
-    # Verificar que el sensor existe
-    sensor_exists = False
-    for sensor in SAMPLE_SENSORS:
-        if sensor["id"] == sensor_id:
-            sensor_exists = True
-            # Actualizar la última lectura del sensor
-            sensor["last_reading"] = reading.value
-            sensor["last_reading_time"] = reading.timestamp
-            break
-    
-    if not sensor_exists:
+    if sensor_id in virtual_sensor_graph:
+        raise HTTPException(status_code=400, detail="Los sensores virtuales no admiten lecturas")
+
+    if sensor_registry.get(sensor_id) is None:
         raise HTTPException(status_code=404, detail="Sensor no encontrado")
-    
-    # En una implementación real, esto se guardaría en la base de datos
+
+    ingest_readings({sensor_id: ([reading.timestamp.timestamp()], [reading.value])})
     return reading
 
 @router.get("/{sensor_id}/readings", response_model=List[SensorReading])
 async def get_sensor_readings(sensor_id: int, limit: int = 10):
     """
-    Obtiene las últimas lecturas de un sensor específico.
+    Obtiene las últimas lecturas de un sensor específico, de la más reciente
+    a la más antigua.
     """
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="El límite debe ser mayor que cero")
+
     # Verificar que el sensor existe
-    sensor_exists = False
-    for sensor in SAMPLE_SENSORS:
-        if sensor["id"] == sensor_id:
-            sensor_exists = True
-            break
-    
-    if not sensor_exists:
+    sensor = sensor_registry.get(sensor_id)
+    if sensor is None:
         raise HTTPException(status_code=404, detail="Sensor no encontrado")
     
-    # En una implementación real, esto se obtendría de la base de datos
-    # Generamos datos de ejemplo para desarrollo
-    sample_readings = []
-    for i in range(limit):
-        sample_readings.append(
-            SensorReading(
-                sensor_id=sensor_id,
-                value=20 + (i * 0.5),  # Valores de ejemplo
-                timestamp=datetime.now(),
-                status="normal"
-            )
-        )
+    timestamps, values = reading_store.range(sensor_id)
+    timestamps, values = timestamps[-limit:][::-1], values[-limit:][::-1]
+    statuses = classify_status(sensor["type"], values)
     
-    return sample_readings
+    return [
+        SensorReading(
+            sensor_id=sensor_id,
+            value=value,
+            timestamp=datetime.fromtimestamp(timestamp),
+            status=reading_status
+        )
+        for timestamp, value, reading_status in zip(timestamps.tolist(), values.tolist(), statuses.tolist())
+    ]
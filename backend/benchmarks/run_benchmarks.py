@@ -0,0 +1,571 @@
+"""
+Suite de benchmarks y pruebas de carga para las rutas críticas de la API.
+
+Se ejecuta sin conexión (la aplicación se carga en el mismo proceso a través de
+``TestClient``) sobre una granja sintética de tamaño configurable, y mide
+rendimiento (peticiones/s) y latencia p50/p99 de cada escenario. La aplicación
+arranca con su ciclo de vida completo y la admisión con la configuración de
+despliegue; las peticiones se reparten entre ``--clients`` clientes simulados.
+
+La memoria residente máxima (RSS) es la de todo el proceso, así que se informa
+una vez para la ejecución completa. De cada escenario se mide la variación
+del RSS y, en unas iteraciones adicionales con ``tracemalloc`` (fuera de las
+medidas de tiempo), el pico de memoria reservada por una petición.
+
+Uso (desde el directorio ``backend``)::
+
+    python -m benchmarks.run_benchmarks --profile pi4 --save-baseline
+    python -m benchmarks.run_benchmarks --profile pi4 --check
+
+Con ``--check`` el proceso termina con código 1 si algún escenario empeora más
+allá de la tolerancia respecto a la línea base guardada.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from database.readings_store import reading_store
+from utils import synthetic_data
+
+# Directorio donde se guardan las líneas base por perfil de hardware
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Tipos de sensores usados para poblar la granja sintética
+FARM_SENSOR_TYPES = ["temperature", "soil_moisture", "ph", "humidity", "light"]
+
+# Tipos Atlas Scientific aceptados por /mycodo/readings
+MYCODO_SENSOR_TYPES = ["ph", "ec", "do", "rtd"]
+
+# Inicio del periodo de retención de la granja sintética
+FARM_ORIGIN = datetime(2025, 1, 1)
+
+# Minutos de lecturas pregeneradas por sensor para los escenarios de ingesta
+LIVE_MINUTES = 24 * 60
+
+ACTUATOR_TYPES = ["pump", "light", "fan", "heater"]
+
+PREDICTION_HORIZONS = ["1h", "6h", "24h", "7d"]
+
+
+class SyntheticFarm:
+    """
+    Granja sintética reproducible: sensores, actuadores y lecturas.
+
+    El tamaño se controla con el número de sensores, la frecuencia de
+    muestreo (lecturas por minuto) y la retención (días de historial). Las
+    lecturas proceden del generador de ``utils.synthetic_data``.
+    """
+
+    def __init__(self, sensors: int, rate: float, retention_days: int, seed: int = 42):
+        self.sensors = sensors
+        self.rate = rate
+        self.retention_days = retention_days
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.sensor_ids: List[int] = []
+        self.actuator_ids: List[int] = []
+        # Bloques de lecturas pregeneradas para la ingesta (un minuto por bloque)
+        self._live: Dict[str, synthetic_data.SyntheticSeries] = {}
+
+    def populate(self, client: TestClient, actuators: int):
+        """
+        Registra los sensores y actuadores de la granja en la API y carga el
+        historial de lecturas y de estados de los actuadores.
+        """
+        sensors = []
+        for i in range(self.sensors):
+            sensor_type = FARM_SENSOR_TYPES[i % len(FARM_SENSOR_TYPES)]
+            response = client.post("/sensors/", json={
+                "name": f"Bench {sensor_type} {i}",
+                "type": sensor_type,
+                "location": f"Invernadero {i % 4 + 1}",
+                "unit": synthetic_data.get_profile(sensor_type)["unit"],
+            })
+            response.raise_for_status()
+            sensors.append(response.json())
+            self.sensor_ids.append(sensors[-1]["id"])
+
+        retention_end = FARM_ORIGIN + timedelta(days=self.retention_days)
+        for i in range(actuators):
+            actuator_type = ACTUATOR_TYPES[i % len(ACTUATOR_TYPES)]
+            response = client.post("/actuators/", json={
+                "name": f"Bench actuador {i}",
+                "type": actuator_type,
+                "location": f"Invernadero {i % 4 + 1}",
+                "flow_rate": 12.0 if actuator_type == "pump" else None,
+            })
+            response.raise_for_status()
+            actuator_id = response.json()["id"]
+            self.actuator_ids.append(actuator_id)
+            # La programación entra por la API, como los comandos reales:
+            # diario, estado compartido y evento para el resto de workers
+            timestamps, states = synthetic_data.generate_actuator_schedule(
+                actuator_type, FARM_ORIGIN, retention_end,
+                seed=synthetic_data.sensor_seed(self.seed, f"actuator_{i}"),
+            )
+            for timestamp, state in zip(timestamps.tolist(), states.tolist()):
+                client.post(f"/actuators/{actuator_id}/control", json={
+                    "actuator_id": actuator_id,
+                    "state": bool(state),
+                    "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+                    "issued_by": "schedule",
+                }).raise_for_status()
+
+        # Cargar el historial de la retención directamente en el almacén
+        synthetic_data.bulk_load(
+            reading_store, sensors, FARM_ORIGIN, retention_end,
+            interval_seconds=60 / self.rate, seed=self.seed, gap_rate=0.01, anomaly_rate=0.002,
+        )
+
+    def _live_values(self, key: str, sensor_type: str, count: int) -> np.ndarray:
+        """
+        Valores sintéticos para la ingesta en vivo, generados una sola vez.
+        """
+        if key not in self._live:
+            end = FARM_ORIGIN + timedelta(days=self.retention_days + 1)
+            self._live[key] = synthetic_data.generate_series(
+                sensor_type, end - timedelta(minutes=count), end, 60,
+                seed=synthetic_data.sensor_seed(self.seed, key),
+            )
+        return self._live[key].values
+
+    def sensor_reading(self, sensor_index: int, timestamp: datetime) -> Dict[str, Any]:
+        """
+        Genera una lectura para el sensor indicado en el instante dado.
+        """
+        sensor_type = FARM_SENSOR_TYPES[sensor_index % len(FARM_SENSOR_TYPES)]
+        values = self._live_values(f"sensor_{sensor_index}", sensor_type, LIVE_MINUTES)
+        minute = int((timestamp - FARM_ORIGIN).total_seconds() // 60)
+        return {
+            "sensor_id": self.sensor_ids[sensor_index],
+            "value": round(float(values[minute % values.size]), 3),
+            "timestamp": timestamp.isoformat(),
+            "status": "normal",
+        }
+
+    def mycodo_batch(self, timestamp: datetime) -> List[Dict[str, Any]]:
+        """
+        Genera un lote de lecturas Mycodo: un minuto de datos de toda la granja.
+        """
+        per_sensor = max(1, int(round(self.rate)))
+        step = timedelta(seconds=60 / per_sensor)
+        minute = int((timestamp - FARM_ORIGIN).total_seconds() // 60)
+        batch = []
+        for i in range(self.sensors):
+            code = MYCODO_SENSOR_TYPES[i % len(MYCODO_SENSOR_TYPES)]
+            values = self._live_values(f"atlas_{code}_{i}", code, LIVE_MINUTES)
+            for k in range(per_sensor):
+                batch.append({
+                    "sensor_id": f"atlas_{code}_{i}",
+                    "sensor_type": code,
+                    "value": round(float(values[(minute * per_sensor + k) % values.size]), 3),
+                    "timestamp": (timestamp + step * k).isoformat(),
+                    "unit": synthetic_data.get_profile(code)["unit"],
+                    "location": f"Invernadero {i % 4 + 1}",
+                })
+        return batch
+
+    def random_range(self, max_days: Optional[float] = None):
+        """
+        Devuelve un rango (inicio, fin) aleatorio dentro del periodo de retención.
+        """
+        span_days = min(max_days or self.retention_days, self.retention_days)
+        start = FARM_ORIGIN + timedelta(days=self.rng.uniform(0, self.retention_days - span_days))
+        return start, start + timedelta(days=span_days)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    Percentil por el método del rango más cercano sobre una lista ordenada.
+    """
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    """
+    Memoria residente máxima del proceso en MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KB y macOS en bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """
+    Memoria residente actual del proceso en MB (None si no se puede leer).
+    """
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def allocation_peak_mb(operation: Callable[[int], int], start: int, iterations: int) -> float:
+    """
+    Pico de memoria reservada (Python y NumPy) por encima de la ya reservada
+    al empezar, en MB, durante ``iterations`` llamadas a ``operation``.
+    """
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        for i in range(iterations):
+            operation(start + i)
+        return max(0.0, tracemalloc.get_traced_memory()[1] - baseline) / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+# Iteraciones de cada escenario con tracemalloc, que ralentiza las peticiones
+TRACED_ITERATIONS = 5
+
+
+def run_scenario(name: str, operation: Callable[[int], int], iterations: int, warmup: int) -> Dict[str, Any]:
+    """
+    Ejecuta un escenario y devuelve sus métricas.
+
+    ``operation`` recibe el número de iteración y devuelve la cantidad de
+    elementos procesados (por ejemplo, lecturas de un lote) para calcular el
+    rendimiento por elemento además del rendimiento por petición.
+    """
+    for i in range(warmup):
+        operation(i)
+
+    rss_before = current_rss_mb()
+    latencies = []
+    items = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        items += operation(warmup + i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    rss_after = current_rss_mb()
+    alloc_peak = allocation_peak_mb(operation, warmup + iterations, min(iterations, TRACED_ITERATIONS))
+
+    latencies.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "items": items,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(iterations / elapsed, 2) if elapsed else 0.0,
+        "items_per_s": round(items / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "rss_delta_mb": round(rss_after - rss_before, 2) if rss_before is not None and rss_after is not None else None,
+        "alloc_peak_mb": round(alloc_peak, 3),
+    }
+
+
+def _checked(response) -> Any:
+    """
+    Falla el benchmark si la API responde con un error.
+    """
+    if response.status_code >= 400:
+        hint = " (la admisión limita a cada cliente: pruebe con más --clients)" if response.status_code == 429 else ""
+        raise RuntimeError(
+            f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:200]}{hint}"
+        )
+    return response
+
+
+class SimulatedClients:
+    """
+    Envoltorio ASGI que reparte las peticiones por turnos entre ``clients``
+    direcciones de cliente distintas.
+
+    La admisión se mantiene con su configuración de despliegue; así sus
+    límites por cliente se aplican a una carga de varios paneles y
+    integraciones, como en producción, en lugar de a un único cliente que
+    hace todas las peticiones del benchmark.
+    """
+
+    def __init__(self, app, clients: int):
+        self.app = app
+        self.clients = max(1, clients)
+        self._requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            index = self._requests % self.clients
+            self._requests += 1
+            scope = {**scope, "client": (f"10.0.{index // 256}.{index % 256}", 50000)}
+        await self.app(scope, receive, send)
+
+
+def wait_until_ready(client: TestClient, timeout: float = 300.0):
+    """
+    Espera a que termine el calentamiento del arranque (segmentos, diario,
+    módulo de IA) antes de poblar la granja.
+    """
+    deadline = time.monotonic() + timeout
+    while client.get("/ready").status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"La API no está lista tras {timeout:.0f} s")
+        time.sleep(0.1)
+
+
+def build_scenarios(client: TestClient, farm: SyntheticFarm) -> Dict[str, Callable[[int], int]]:
+    """
+    Define las operaciones de cada escenario sobre la granja sintética.
+    """
+    origin = FARM_ORIGIN
+    minutes_per_day = 24 * 60
+
+    def ingest_mycodo(i: int) -> int:
+        batch = farm.mycodo_batch(origin + timedelta(minutes=i))
+        _checked(client.post("/mycodo/readings", json=batch))
+        return len(batch)
+
+    def ingest_sensor(i: int) -> int:
+        index = i % farm.sensors
+        timestamp = origin + timedelta(minutes=i // farm.sensors % (farm.retention_days * minutes_per_day))
+        sensor_id = farm.sensor_ids[index]
+        _checked(client.post(f"/sensors/{sensor_id}/readings", json=farm.sensor_reading(index, timestamp)))
+        return 1
+
+    def history_range(i: int) -> int:
+        sensor_id = farm.sensor_ids[i % farm.sensors]
+        start, end = farm.random_range(max_days=1)
+        response = _checked(client.get(
+            f"/history/sensors/{sensor_id}",
+            params={"start_date": start.isoformat(), "end_date": end.isoformat(), "limit": 100},
+        ))
+        return len(response.json())
+
+    def history_aggregate(i: int) -> int:
+        count = min(farm.sensors, 5)
+        first = i % farm.sensors
+        sensor_ids = [farm.sensor_ids[(first + k) % farm.sensors] for k in range(count)]
+        start, end = farm.random_range(max_days=7)
+        response = _checked(client.post("/history/query", json={
+            "sensor_ids": sensor_ids,
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "interval": "hourly",
+        }))
+        return sum(len(points) for points in response.json().values())
+
+    def history_summary(i: int) -> int:
+        count = min(farm.sensors, 5)
+        first = i % farm.sensors
+        sensor_ids = [farm.sensor_ids[(first + k) % farm.sensors] for k in range(count)]
+        start, end = farm.random_range()
+        response = _checked(client.request(
+            "GET", "/history/summary", json=sensor_ids,
+            params={"start_date": start.isoformat(), "end_date": end.isoformat()},
+        ))
+        return len(response.json())
+
+    def history_histogram(i: int) -> int:
+        sensor_id = farm.sensor_ids[i % farm.sensors]
+        start, end = farm.random_range()
+        response = _checked(client.get("/history/histogram", params={
+            "sensor_id": sensor_id, "start_date": start.isoformat(), "end_date": end.isoformat(),
+        }))
+        return len(response.json()["bins"])
+
+    def predictions(i: int) -> int:
+        index = i % farm.sensors
+        response = _checked(client.post("/predictions/", json={
+            "sensor_id": farm.sensor_ids[index],
+            "prediction_type": FARM_SENSOR_TYPES[index % len(FARM_SENSOR_TYPES)],
+            "time_horizon": PREDICTION_HORIZONS[i % len(PREDICTION_HORIZONS)],
+        }))
+        return len(response.json()["predicted_values"])
+
+    def actuator_control(i: int) -> int:
+        actuator_id = farm.actuator_ids[i % len(farm.actuator_ids)]
+        _checked(client.post(f"/actuators/{actuator_id}/control", json={
+            "actuator_id": actuator_id,
+            "state": i % 2 == 0,
+            "timestamp": (origin + timedelta(minutes=i)).isoformat(),
+        }))
+        return 1
+
+    def actuator_usage(i: int) -> int:
+        actuator_id = farm.actuator_ids[i % len(farm.actuator_ids)]
+        response = _checked(client.get(f"/actuators/{actuator_id}/usage", params={
+            "start_date": origin.isoformat(),
+            "end_date": (origin + timedelta(days=farm.retention_days)).isoformat(),
+            "interval": "daily",
+        }))
+        return len(response.json()["buckets"])
+
+    return {
+        "ingest_mycodo": ingest_mycodo,
+        "ingest_sensor": ingest_sensor,
+        "history_range": history_range,
+        "history_aggregate": history_aggregate,
+        "history_summary": history_summary,
+        "history_histogram": history_histogram,
+        "predictions": predictions,
+        "actuator_control": actuator_control,
+        "actuator_usage": actuator_usage,
+    }
+
+
+def compare_with_baseline(
+    results: List[Dict[str, Any]],
+    baseline: Dict[str, Any],
+    tolerance: float,
+    peak_rss: Optional[float] = None,
+) -> List[str]:
+    """
+    Compara los resultados con la línea base y devuelve las regresiones.
+
+    Se considera regresión una caída del rendimiento o un aumento de la
+    latencia p99, del pico de memoria reservada por petición o del RSS
+    máximo de la ejecución (``peak_rss``) mayores que ``tolerance`` (fracción).
+    """
+    regressions = []
+    base_peak = baseline.get("peak_rss_mb")
+    if peak_rss is not None and base_peak and peak_rss > base_peak * (1 + tolerance):
+        regressions.append(f"RSS máximo {peak_rss} MB > línea base {base_peak} MB")
+    reference = {scenario["name"]: scenario for scenario in baseline.get("scenarios", [])}
+    for scenario in results:
+        base = reference.get(scenario["name"])
+        if not base:
+            continue
+        if scenario["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{scenario['name']}: rendimiento {scenario['throughput_rps']} req/s < línea base {base['throughput_rps']} req/s"
+            )
+        if scenario["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{scenario['name']}: p99 {scenario['p99_ms']} ms > línea base {base['p99_ms']} ms"
+            )
+        # Margen absoluto de 1 MB: los picos pequeños varían mucho en proporción
+        if "alloc_peak_mb" in base and scenario["alloc_peak_mb"] > base["alloc_peak_mb"] * (1 + tolerance) + 1:
+            regressions.append(
+                f"{scenario['name']}: pico de memoria {scenario['alloc_peak_mb']} MB > línea base {base['alloc_peak_mb']} MB"
+            )
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks de la API de Joy's Farm")
+    parser.add_argument("--sensors", type=int, default=20, help="Número de sensores de la granja sintética")
+    parser.add_argument("--actuators", type=int, default=4, help="Número de actuadores de la granja sintética")
+    parser.add_argument("--rate", type=float, default=1.0, help="Lecturas por sensor y minuto")
+    parser.add_argument("--retention-days", type=int, default=30, help="Días de historial de la granja")
+    parser.add_argument("--clients", type=int, default=64, help="Clientes simulados entre los que se reparten las peticiones")
+    parser.add_argument("--iterations", type=int, default=200, help="Iteraciones medidas por escenario")
+    parser.add_argument("--warmup", type=int, default=10, help="Iteraciones de calentamiento por escenario")
+    parser.add_argument("--scenarios", nargs="*", help="Escenarios a ejecutar (por defecto, todos)")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla para datos reproducibles")
+    parser.add_argument("--profile", default="default", help="Nombre del perfil de hardware de la línea base")
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda los resultados como línea base")
+    parser.add_argument("--check", action="store_true", help="Falla si hay regresiones respecto a la línea base")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Tolerancia relativa para regresiones")
+    parser.add_argument("--output", help="Fichero donde guardar el informe JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    # Se mide la configuración de despliegue (sin el historial sintético del
+    # modo de desarrollo, que se cargaría además de la granja)
+    os.environ.setdefault("ENVIRONMENT", "production")
+
+    # Importar la aplicación aquí para medir también su coste de carga
+    from main import app
+
+    # Con el gestor de contexto se ejecuta el ciclo de vida de la aplicación:
+    # calentamiento, sincronización del estado y segmentos, si están activos
+    with TestClient(SimulatedClients(app, args.clients)) as client:
+        wait_until_ready(client)
+        farm = SyntheticFarm(args.sensors, args.rate, args.retention_days, seed=args.seed)
+        farm.populate(client, max(1, args.actuators))
+
+        scenarios = build_scenarios(client, farm)
+        selected = args.scenarios or list(scenarios)
+        unknown = [name for name in selected if name not in scenarios]
+        if unknown:
+            print(f"Escenarios desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(scenarios)}", file=sys.stderr)
+            return 2
+
+        results = []
+        for name in selected:
+            result = run_scenario(name, scenarios[name], args.iterations, args.warmup)
+            results.append(result)
+            print(
+                f"{name:<20} {result['throughput_rps']:>10.2f} req/s  {result['items_per_s']:>12.2f} items/s  "
+                f"p50 {result['p50_ms']:>8.3f} ms  p99 {result['p99_ms']:>8.3f} ms  memoria {result['alloc_peak_mb']:>8.3f} MB"
+            )
+    peak_rss = round(peak_rss_mb(), 2)
+    print(f"RSS máximo de la ejecución: {peak_rss:.2f} MB")
+
+    report = {
+        "profile": args.profile,
+        "created_at": datetime.now().isoformat(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.machine(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "clients": args.clients,
+        "farm": {
+            "sensors": args.sensors,
+            "actuators": args.actuators,
+            "rate": args.rate,
+            "retention_days": args.retention_days,
+            "seed": args.seed,
+        },
+        "iterations": args.iterations,
+        "peak_rss_mb": peak_rss,
+        "scenarios": results,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.profile}.json")
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {baseline_path}")
+
+    if args.check:
+        if not os.path.exists(baseline_path):
+            print(f"No existe línea base para el perfil '{args.profile}' ({baseline_path})", file=sys.stderr)
+            return 2
+        with open(baseline_path, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if baseline.get("farm") != report["farm"]:
+            print("Advertencia: la granja sintética no coincide con la de la línea base", file=sys.stderr)
+        regressions = compare_with_baseline(results, baseline, args.tolerance, peak_rss)
+        if regressions:
+            print("Regresiones detectadas:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  - {regression}", file=sys.stderr)
+            return 1
+        print("Sin regresiones respecto a la línea base")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+Diario de estados de los actuadores.
+
+Cada comando recibido por un actuador se guarda como una entrada inmutable
+(instante, estado, valor y quién lo emitió) en listas ordenadas por tiempo.
+Junto a cada entrada se guardan sumas prefijas del tiempo encendido y del
+número de encendidos, de modo que el estado en un instante, el tiempo
+encendido en un rango y el ciclo de trabajo por día se calculan con búsqueda
+binaria en lugar de recorrer todo el historial.
+
+Las entradas de los comandos se guardan además en el estado compartido con
+un número de secuencia único (ver ``api/actuator_routes.py``); al arrancar,
+cada worker reconstruye su diario con ``ActuatorJournal.load`` y la secuencia
+evita aplicar dos veces una entrada que llega también como evento.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+
+class ActuatorLog:
+    """
+    Entradas de un actuador ordenadas por tiempo.
+
+    ``_on_before[i]`` es el tiempo encendido acumulado (en segundos) desde la
+    primera entrada hasta ``timestamps[i]`` y ``_activations_before[i]`` el
+    número de encendidos (paso de apagado a encendido) anteriores a la entrada i.
+    """
+
+    __slots__ = ("timestamps", "states", "values", "issuers", "_on_before", "_activations_before")
+
+    def __init__(self):
+        self.timestamps: List[float] = []
+        self.states: List[bool] = []
+        self.values: List[Optional[float]] = []
+        self.issuers: List[str] = []
+        self._on_before: List[float] = []
+        self._activations_before: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def append(self, timestamp: float, state: bool, value: Optional[float], issuer: str) -> int:
+        """
+        Añade una entrada y devuelve su posición. Las entradas atrasadas se
+        insertan en su sitio y se recalculan las sumas prefijas posteriores.
+        """
+        index = bisect_right(self.timestamps, timestamp)
+        if index == len(self.timestamps):
+            self.timestamps.append(timestamp)
+            self.states.append(state)
+            self.values.append(value)
+            self.issuers.append(issuer)
+            self._on_before.append(0.0)
+            self._activations_before.append(0)
+        else:
+            self.timestamps.insert(index, timestamp)
+            self.states.insert(index, state)
+            self.values.insert(index, value)
+            self.issuers.insert(index, issuer)
+            self._on_before.insert(index, 0.0)
+            self._activations_before.insert(index, 0)
+        self._rebuild_prefix(index)
+        return index
+
+    def extend(self, timestamps: Iterable[float], states: Iterable[bool], issuer: str):
+        """
+        Añade un bloque de entradas (por ejemplo, un historial importado).
+        """
+        self.merge([(timestamp, state, None, issuer) for timestamp, state in zip(map(float, timestamps), map(bool, states))])
+
+    def merge(self, entries: List[Tuple[float, bool, Optional[float], str]]):
+        """
+        Añade un bloque de entradas ``(instante, estado, valor, emisor)`` y
+        recalcula las sumas prefijas una sola vez.
+        """
+        entries = sorted(entries, key=lambda entry: entry[0])
+        if not entries:
+            return
+        start = len(self.timestamps)
+        if self.timestamps and entries[0][0] < self.timestamps[-1]:
+            merged = sorted(
+                list(zip(self.timestamps, self.states, self.values, self.issuers)) + entries,
+                key=lambda entry: entry[0],
+            )
+            self.timestamps = [entry[0] for entry in merged]
+            self.states = [entry[1] for entry in merged]
+            self.values = [entry[2] for entry in merged]
+            self.issuers = [entry[3] for entry in merged]
+            start = 0
+        else:
+            self.timestamps.extend(entry[0] for entry in entries)
+            self.states.extend(entry[1] for entry in entries)
+            self.values.extend(entry[2] for entry in entries)
+            self.issuers.extend(entry[3] for entry in entries)
+        size = len(self.timestamps)
+        self._on_before = self._on_before[:start] + [0.0] * (size - start)
+        self._activations_before = self._activations_before[:start] + [0] * (size - start)
+        self._rebuild_prefix(start)
+
+    def _rebuild_prefix(self, start: int):
+        timestamps, states = self.timestamps, self.states
+        on_before, activations_before = self._on_before, self._activations_before
+        if start == 0:
+            on_before[0] = 0.0
+            activations_before[0] = 0
+            start = 1
+        for i in range(start, len(timestamps)):
+            previous_on = states[i - 1]
+            on_before[i] = on_before[i - 1] + (timestamps[i] - timestamps[i - 1] if previous_on else 0.0)
+            activations_before[i] = activations_before[i - 1] + int(
+                previous_on and (i == 1 or not states[i - 2])
+            )
+
+    def is_activation(self, index: int) -> bool:
+        """
+        Indica si la entrada enciende el actuador (estaba apagado o no había estado previo).
+        """
+        return self.states[index] and (index == 0 or not self.states[index - 1])
+
+    def is_transition(self, index: int) -> bool:
+        """
+        Indica si la entrada cambia el estado respecto a la anterior.
+        """
+        return index == 0 or self.states[index] != self.states[index - 1]
+
+    def index_at(self, timestamp: float) -> int:
+        """
+        Posición de la última entrada con instante ``<= timestamp`` (-1 si no hay).
+        """
+        return bisect_right(self.timestamps, timestamp) - 1
+
+    def on_time_until(self, timestamp: float) -> float:
+        """
+        Segundos encendido desde la primera entrada hasta ``timestamp``.
+        """
+        index = self.index_at(timestamp)
+        if index < 0:
+            return 0.0
+        on_time = self._on_before[index]
+        if self.states[index]:
+            on_time += timestamp - self.timestamps[index]
+        return on_time
+
+    def activations_before(self, timestamp: float) -> int:
+        """
+        Número de encendidos con instante anterior a ``timestamp``.
+        """
+        index = bisect_left(self.timestamps, timestamp)
+        if index == 0:
+            return 0
+        if index == len(self.timestamps):
+            return self._activations_before[-1] + int(self.is_activation(index - 1))
+        return self._activations_before[index]
+
+
+class ActuatorJournal:
+    """
+    Diario de solo añadir de todos los actuadores, indexado por identificador.
+    """
+
+    def __init__(self):
+        self._logs: Dict[Hashable, ActuatorLog] = {}
+        # Secuencias de las entradas ya aplicadas (las guardadas en el estado compartido)
+        self._seqs: Set[int] = set()
+        self._lock = threading.RLock()
+
+    def _entry(self, actuator_id: Hashable, log: ActuatorLog, index: int) -> Dict[str, Any]:
+        return {
+            "actuator_id": actuator_id,
+            "timestamp": log.timestamps[index],
+            "state": log.states[index],
+            "value": log.values[index],
+            "issued_by": log.issuers[index],
+            "transition": log.is_transition(index),
+        }
+
+    def record(
+        self,
+        actuator_id: Hashable,
+        timestamp: float,
+        state: bool,
+        value: Optional[float] = None,
+        issuer: str = "api",
+        seq: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Registra un comando y devuelve la entrada creada, o None si la entrada
+        con secuencia ``seq`` ya estaba en el diario.
+        """
+        with self._lock:
+            if seq is not None:
+                if seq in self._seqs:
+                    return None
+                self._seqs.add(seq)
+            log = self._logs.get(actuator_id)
+            if log is None:
+                log = self._logs[actuator_id] = ActuatorLog()
+            index = log.append(float(timestamp), bool(state), value, issuer)
+            return self._entry(actuator_id, log, index)
+
+    def extend(self, actuator_id: Hashable, timestamps: Iterable[float], states: Iterable[bool], issuer: str = "import"):
+        """
+        Registra un bloque de cambios de estado de un actuador.
+        """
+        with self._lock:
+            log = self._logs.get(actuator_id)
+            if log is None:
+                log = self._logs[actuator_id] = ActuatorLog()
+            log.extend(timestamps, states, issuer)
+
+    def load(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Añade las entradas guardadas en el estado compartido que aún no están
+        en el diario. Devuelve cuántas se han añadido.
+        """
+        by_actuator: Dict[Hashable, List[Tuple[float, bool, Optional[float], str]]] = {}
+        with self._lock:
+            for record in records:
+                if record["seq"] in self._seqs:
+                    continue
+                self._seqs.add(record["seq"])
+                by_actuator.setdefault(record["actuator_id"], []).append(
+                    (float(record["timestamp"]), bool(record["state"]), record["value"], record["issued_by"])
+                )
+            for actuator_id, entries in by_actuator.items():
+                log = self._logs.get(actuator_id)
+                if log is None:
+                    log = self._logs[actuator_id] = ActuatorLog()
+                log.merge(entries)
+        return sum(len(entries) for entries in by_actuator.values())
+
+    def state_at(self, actuator_id: Hashable, timestamp: float) -> Optional[Dict[str, Any]]:
+        """
+        Última entrada vigente en ``timestamp``, o None si no hay ninguna anterior.
+        """
+        with self._lock:
+            log = self._logs.get(actuator_id)
+            if log is None:
+                return None
+            index = log.index_at(timestamp)
+            return None if index < 0 else self._entry(actuator_id, log, index)
+
+    def latest(self, actuator_id: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Entrada más reciente de un actuador, o None.
+        """
+        with self._lock:
+            log = self._logs.get(actuator_id)
+            if not log:
+                return None
+            return self._entry(actuator_id, log, len(log) - 1)
+
+    def entries(
+        self,
+        actuator_id: Hashable,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Entradas con ``start <= timestamp <= end``, de la más reciente a la más
+        antigua y como mucho ``limit``.
+        """
+        with self._lock:
+            log = self._logs.get(actuator_id)
+            if log is None:
+                return []
+            lo = 0 if start is None else bisect_left(log.timestamps, start)
+            hi = len(log) if end is None else bisect_right(log.timestamps, end)
+            if limit is not None:
+                lo = max(lo, hi - limit)
+            return [self._entry(actuator_id, log, index) for index in range(hi - 1, lo - 1, -1)]
+
+    def on_time(self, actuator_id: Hashable, start: float, end: float) -> float:
+        """
+        Segundos que el actuador estuvo encendido entre ``start`` y ``end``.
+        """
+        with self._lock:
+            log = self._logs.get(actuator_id)
+            if log is None or end <= start:
+                return 0.0
+            return log.on_time_until(end) - log.on_time_until(start)
+
+    def usage(self, actuator_id: Hashable, boundaries: List[float]) -> List[Tuple[float, int]]:
+        """
+        Tiempo encendido y número de encendidos entre cada par de límites
+        consecutivos (por ejemplo, las medianoches de un año para el uso diario).
+        """
+        with self._lock:
+            log = self._logs.get(actuator_id)
+            if log is None:
+                return [(0.0, 0) for _ in boundaries[1:]]
+            on_times = [log.on_time_until(boundary) for boundary in boundaries]
+            activations = [log.activations_before(boundary) for boundary in boundaries]
+        return [
+            (on_times[i + 1] - on_times[i], activations[i + 1] - activations[i])
+            for i in range(len(boundaries) - 1)
+        ]
+
+    def actuator_ids(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._logs)
+
+    def clear(self):
+        with self._lock:
+            self._logs.clear()
+            self._seqs.clear()
+
+
+# Diario compartido por todas las rutas del proceso
+actuator_journal = ActuatorJournal()
@@ -0,0 +1,390 @@
+"""
+Resúmenes de distribución de las lecturas por sensor y hora.
+
+Cada lectura se cuenta en un histograma log-lineal de bins fijos (como
+HdrHistogram o DDSketch): el bin guarda las tres primeras cifras
+significativas del valor, por ejemplo 6,83 para un pH o 1520 para una EC. El
+ancho de cada bin es como mucho el 1 % del valor, así que un percentil
+calculado con el punto medio del bin tiene un error relativo de como mucho
+el 0,5 %, y las bandas con límites de hasta tres cifras significativas
+(5,5, 6,0, 7,5, 1500...) se cuentan sin error para los valores no negativos.
+
+Los histogramas se guardan por sensor en cubetas de una hora y de un día,
+como filas ``(cubeta, bin, número de lecturas)`` junto con el número, la
+suma, el mínimo y el máximo de cada cubeta. Como los bins son los mismos en
+todas las cubetas, dos histogramas se combinan sumando sus recuentos: un
+percentil sobre un año es la combinación de unos 365 histogramas diarios y
+las horas sueltas de los extremos, no la ordenación de medio millón de
+lecturas. Los trozos de hora de los extremos del rango se leen en bruto del
+almacén de lecturas.
+"""
+import math
+import threading
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database.readings_store import reading_store
+
+# Duración de las cubetas de cada nivel (segundos), de la más fina a la más gruesa
+BUCKET_LEVELS = (3600, 86400)
+HOUR_SECONDS = 3600
+
+# Cifras significativas por bin: mantisas de 100 a 999, 900 bins por década
+SIGNIFICANT_DIGITS = 3
+MANTISSA_MIN = 10 ** (SIGNIFICANT_DIGITS - 1)
+MANTISSA_MAX = 10 ** SIGNIFICANT_DIGITS
+BINS_PER_DECADE = MANTISSA_MAX - MANTISSA_MIN
+
+# Décadas representables: valores absolutos entre 0,001 y 10⁷ (el resto se
+# acota al extremo más cercano y los menores que 0,001 cuentan como 0)
+MIN_EXPONENT = -3
+MAX_EXPONENT = 6
+MAX_KEY = (MAX_EXPONENT - MIN_EXPONENT + 1) * BINS_PER_DECADE
+KEY_SPAN = 2 * MAX_KEY + 1
+
+# Lecturas pendientes a partir de las cuales se consolidan los histogramas
+COMPACT_THRESHOLD = 65536
+
+# Resumen de una hora o de un rango: (número, suma, mínimo, máximo)
+Stats = Tuple[int, float, float, float]
+
+
+def value_keys(values: np.ndarray) -> np.ndarray:
+    """
+    Bin de cada valor. Los bins crecen con el valor: 0 para los valores
+    cercanos a cero, positivos para los valores positivos y negativos (en
+    espejo) para los negativos.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.clip(np.abs(values), 10.0 ** MIN_EXPONENT, 10.0 ** (MAX_EXPONENT + 1) * (1 - 1e-12))
+    exponent = np.floor(np.log10(magnitude)).astype(np.int64)
+    # El margen relativo evita que 6,0 caiga en el bin de 5,99 por redondeo
+    mantissa = np.floor(magnitude * 10.0 ** (SIGNIFICANT_DIGITS - 1 - exponent) * (1 + 1e-12)).astype(np.int64)
+    carry = mantissa >= MANTISSA_MAX
+    exponent = np.where(carry, exponent + 1, exponent)
+    mantissa = np.where(carry, mantissa // 10, mantissa)
+    keys = (exponent - MIN_EXPONENT) * BINS_PER_DECADE + (mantissa - MANTISSA_MIN) + 1
+    keys = np.where(np.abs(values) < 10.0 ** MIN_EXPONENT, 0, keys)
+    return np.where(values < 0, -keys, keys)
+
+
+def key_bounds(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Límites inferior y superior de cada bin.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    index = np.maximum(np.abs(keys) - 1, 0)
+    exponent = index // BINS_PER_DECADE + MIN_EXPONENT
+    mantissa = index % BINS_PER_DECADE + MANTISSA_MIN
+    scale = 10.0 ** (exponent - (SIGNIFICANT_DIGITS - 1))
+    low, high = mantissa * scale, (mantissa + 1) * scale
+    zero = 10.0 ** MIN_EXPONENT
+    lower = np.where(keys > 0, low, np.where(keys < 0, -high, -zero))
+    upper = np.where(keys > 0, high, np.where(keys < 0, -low, zero))
+    return lower, upper
+
+
+def key_values(keys: np.ndarray) -> np.ndarray:
+    """
+    Valor representativo (punto medio) de cada bin.
+    """
+    lower, upper = key_bounds(keys)
+    return np.where(np.asarray(keys) == 0, 0.0, (lower + upper) / 2)
+
+
+def merge_bins(keys: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Combina recuentos (u otros pesos) por bin: devuelve los bins no vacíos
+    ordenados y su total. Los bins son enteros acotados, así que basta con
+    un ``bincount`` en lugar de ordenar.
+    """
+    totals = np.bincount(keys + MAX_KEY, weights=weights, minlength=KEY_SPAN)
+    present = np.flatnonzero(totals)
+    return present - MAX_KEY, totals[present]
+
+
+def quantiles_from_bins(keys: np.ndarray, counts: np.ndarray, quantiles: Sequence[float]) -> List[float]:
+    """
+    Cuantiles de un histograma con los bins ordenados, con la definición del
+    rango más cercano (el menor valor con al menos ``q * n`` lecturas <= él).
+    """
+    cumulative = np.cumsum(counts)
+    ranks = np.maximum(np.ceil(np.asarray(quantiles, dtype=np.float64) * cumulative[-1]), 1)
+    positions = np.minimum(np.searchsorted(cumulative, ranks, side="left"), keys.size - 1)
+    return key_values(keys[positions]).tolist()
+
+
+class BucketTable:
+    """
+    Histogramas de un sensor en cubetas de ``size`` segundos.
+
+    ``buckets``, ``keys`` y ``counts`` son filas ordenadas por cubeta y bin;
+    las columnas ``stat_*`` guardan el resumen de cada cubeta con lecturas.
+    """
+
+    __slots__ = (
+        "size", "buckets", "keys", "counts",
+        "stat_buckets", "stat_count", "stat_sum", "stat_min", "stat_max",
+    )
+
+    def __init__(self, size: int):
+        self.size = size
+        self.buckets = np.empty(0, dtype=np.int32)
+        self.keys = np.empty(0, dtype=np.int32)
+        self.counts = np.empty(0, dtype=np.int32)
+        self.stat_buckets = np.empty(0, dtype=np.int32)
+        self.stat_count = np.empty(0, dtype=np.int64)
+        self.stat_sum = np.empty(0, dtype=np.float64)
+        self.stat_min = np.empty(0, dtype=np.float64)
+        self.stat_max = np.empty(0, dtype=np.float64)
+
+    def merge(self, timestamps: np.ndarray, keys: np.ndarray, values: np.ndarray):
+        """
+        Añade lecturas. Solo se reagrupan las filas desde la cubeta más
+        antigua de las lecturas nuevas, normalmente la última.
+        """
+        buckets = np.floor(timestamps / self.size).astype(np.int64)
+        first = int(buckets.min())
+
+        # Histogramas: agrupar por (cubeta, bin) las filas afectadas y las nuevas
+        position = int(np.searchsorted(self.buckets, first))
+        all_buckets = np.concatenate((self.buckets[position:], buckets))
+        all_keys = np.concatenate((self.keys[position:], keys))
+        all_counts = np.concatenate((self.counts[position:], np.ones(values.size, dtype=np.int32)))
+        codes = (all_buckets - first) * KEY_SPAN + (all_keys + MAX_KEY)
+        unique, inverse = np.unique(codes, return_inverse=True)
+        self.buckets = np.concatenate((self.buckets[:position], (unique // KEY_SPAN + first).astype(np.int32)))
+        self.keys = np.concatenate((self.keys[:position], (unique % KEY_SPAN - MAX_KEY).astype(np.int32)))
+        self.counts = np.concatenate((self.counts[:position], np.bincount(inverse, weights=all_counts).astype(np.int32)))
+
+        # Resumen por cubeta
+        position = int(np.searchsorted(self.stat_buckets, first))
+        stat_buckets = np.concatenate((self.stat_buckets[position:], buckets))
+        order = np.argsort(stat_buckets, kind="stable")
+        stat_buckets = stat_buckets[order]
+        count = np.concatenate((self.stat_count[position:], np.ones(values.size, dtype=np.int64)))[order]
+        total = np.concatenate((self.stat_sum[position:], values))[order]
+        minimum = np.concatenate((self.stat_min[position:], values))[order]
+        maximum = np.concatenate((self.stat_max[position:], values))[order]
+        starts = np.flatnonzero(np.concatenate(([True], stat_buckets[1:] != stat_buckets[:-1])))
+        self.stat_buckets = np.concatenate((self.stat_buckets[:position], stat_buckets[starts].astype(np.int32)))
+        self.stat_count = np.concatenate((self.stat_count[:position], np.add.reduceat(count, starts)))
+        self.stat_sum = np.concatenate((self.stat_sum[:position], np.add.reduceat(total, starts)))
+        self.stat_min = np.concatenate((self.stat_min[:position], np.minimum.reduceat(minimum, starts)))
+        self.stat_max = np.concatenate((self.stat_max[:position], np.maximum.reduceat(maximum, starts)))
+
+    def part(self, first: int, end: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Stats]:
+        """
+        Bins, recuentos y horas representadas por cada fila de las cubetas
+        ``[first, end)``, y el resumen de esas cubetas.
+        """
+        lo, hi = np.searchsorted(self.stat_buckets, [first, end])
+        if hi == lo:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0), (0, 0.0, math.inf, -math.inf)
+        row_lo, row_hi = np.searchsorted(self.buckets, [first, end])
+        keys, counts = self.keys[row_lo:row_hi], self.counts[row_lo:row_hi]
+        # Cada cubeta reparte sus horas entre sus filas según las lecturas
+        buckets = self.buckets[row_lo:row_hi]
+        runs = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1], [True])))
+        per_reading = (self.size / HOUR_SECONDS) / self.stat_count[lo:hi]
+        hours = counts * np.repeat(per_reading, np.diff(runs))
+        stats = (
+            int(self.stat_count[lo:hi].sum()), float(self.stat_sum[lo:hi].sum()),
+            float(self.stat_min[lo:hi].min()), float(self.stat_max[lo:hi].max()),
+        )
+        return keys.astype(np.int64), counts.astype(np.int64), hours, stats
+
+    def bucket_counts(self, buckets: np.ndarray) -> np.ndarray:
+        """
+        Número total de lecturas de cada cubeta indicada, 0 para las cubetas
+        sin histograma (lecturas guardadas antes de suscribirse al almacén).
+        """
+        if self.stat_buckets.size == 0:
+            return np.zeros(len(buckets), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.stat_buckets, buckets), self.stat_buckets.size - 1)
+        return np.where(self.stat_buckets[positions] == buckets, self.stat_count[positions], 0)
+
+
+class SensorSketches:
+    """
+    Histogramas de un sensor en cada nivel de cubetas. Las lecturas nuevas se
+    acumulan sin procesar y se consolidan en bloque.
+    """
+
+    __slots__ = ("levels", "_pending", "_pending_size")
+
+    def __init__(self):
+        self.levels = [BucketTable(size) for size in BUCKET_LEVELS]
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._pending_size = 0
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        self._pending.append((timestamps, values))
+        self._pending_size += timestamps.size
+        if self._pending_size >= COMPACT_THRESHOLD:
+            self.compact()
+
+    def compact(self):
+        """
+        Incorpora las lecturas pendientes a todos los niveles.
+        """
+        if not self._pending:
+            return
+        timestamps = np.concatenate([chunk[0] for chunk in self._pending])
+        values = np.concatenate([chunk[1] for chunk in self._pending])
+        self._pending = []
+        self._pending_size = 0
+        finite = np.isfinite(values)
+        if not finite.all():
+            timestamps, values = timestamps[finite], values[finite]
+        if values.size == 0:
+            return
+        keys = value_keys(values)
+        for table in self.levels:
+            table.merge(timestamps, keys, values)
+
+
+def plan_range(start: float, end: float, inclusive: bool = True, level: int = len(BUCKET_LEVELS) - 1) -> List[tuple]:
+    """
+    Descompone ``[start, end]`` en cubetas completas del nivel más grueso
+    posible y trozos en bruto: ``(nivel, primera, fin)`` para las cubetas y
+    ``(None, inicio, fin, incluye_fin)`` para las lecturas en bruto.
+    """
+    if level < 0:
+        return [(None, start, end, inclusive)] if end > start or (inclusive and end == start) else []
+    size = BUCKET_LEVELS[level]
+    first, last = math.ceil(start / size), math.floor(end / size)
+    if last <= first:
+        return plan_range(start, end, inclusive, level - 1)
+    return (
+        plan_range(start, first * size, False, level - 1)
+        + [(level, first, last)]
+        + plan_range(last * size, end, inclusive, level - 1)
+    )
+
+
+class Distribution:
+    """
+    Distribución de las lecturas de un sensor en un rango: recuentos por bin
+    de cada parte del rango, las horas que representa cada recuento y el
+    resumen exacto (número, suma, mínimo y máximo).
+    """
+
+    def __init__(self, keys: np.ndarray, counts: np.ndarray, hours: np.ndarray, stats: Stats):
+        self.keys = keys
+        self.counts = counts
+        self.hours = hours
+        self.count, self.sum, self.min, self.max = stats
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count
+
+    def quantiles(self, quantiles: Sequence[float]) -> List[float]:
+        """
+        Cuantiles aproximados (error relativo máximo del 0,5 %), acotados por
+        el mínimo y el máximo exactos.
+        """
+        keys, counts = merge_bins(self.keys, self.counts)
+        return [min(max(value, self.min), self.max) for value in quantiles_from_bins(keys, counts, quantiles)]
+
+    def histogram(self, edges: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Número de lecturas y horas en cada banda definida por ``edges``
+        (``len(edges) + 1`` bandas, la primera y la última abiertas).
+
+        Las horas reparten cada cubeta entre las bandas según la proporción de
+        sus lecturas en cada una, de modo que no dependen de la frecuencia de
+        muestreo de cada momento.
+        """
+        keys, counts = merge_bins(self.keys, self.counts)
+        _, hours = merge_bins(self.keys, self.hours)
+        bands = np.searchsorted(np.asarray(edges, dtype=np.float64), key_values(keys), side="right")
+        size = len(edges) + 1
+        return (
+            np.bincount(bands, weights=counts, minlength=size).astype(np.int64),
+            np.bincount(bands, weights=hours, minlength=size),
+        )
+
+
+class SketchStore:
+    """
+    Histogramas de todos los sensores, alimentados por el almacén de lecturas.
+    """
+
+    def __init__(self):
+        self._sketches: Dict[Hashable, SensorSketches] = {}
+        self._lock = threading.Lock()
+
+    def add(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray):
+        with self._lock:
+            sketches = self._sketches.get(sensor_id)
+            if sketches is None:
+                sketches = self._sketches[sensor_id] = SensorSketches()
+            sketches.add(timestamps, values)
+
+    def distribution(self, sensor_id: Hashable, start: float, end: float) -> Optional[Distribution]:
+        """
+        Distribución de las lecturas con ``start <= timestamp <= end``, o None
+        si no hay ninguna. Los días y las horas completos salen de los
+        histogramas y los trozos de hora de los extremos, de las lecturas en bruto.
+        """
+        parts = []
+        with self._lock:
+            sketches = self._sketches.get(sensor_id)
+            if sketches is None:
+                return None
+            sketches.compact()
+            hourly = sketches.levels[0]
+            for piece in plan_range(start, end):
+                if piece[0] is not None:
+                    parts.append(sketches.levels[piece[0]].part(piece[1], piece[2]))
+                    continue
+                _, piece_start, piece_end, inclusive = piece
+                timestamps, values = reading_store.range(sensor_id, piece_start, piece_end)
+                if not inclusive and timestamps.size and timestamps[-1] >= piece_end:
+                    keep = timestamps < piece_end
+                    timestamps, values = timestamps[keep], values[keep]
+                finite = np.isfinite(values)
+                timestamps, values = timestamps[finite], values[finite]
+                if values.size == 0:
+                    continue
+                # Cada lectura representa su parte de la hora en la que cae. Si
+                # el histograma de la hora falta o tiene menos lecturas que el
+                # trozo en bruto, se reparte entre las lecturas del trozo.
+                hours = np.floor(timestamps / HOUR_SECONDS).astype(np.int64)
+                _, inverse, local = np.unique(hours, return_inverse=True, return_counts=True)
+                hour_totals = np.maximum(hourly.bucket_counts(hours), local[inverse])
+                parts.append((
+                    value_keys(values), np.ones(values.size, dtype=np.int64), 1.0 / hour_totals,
+                    (int(values.size), float(values.sum()), float(values.min()), float(values.max())),
+                ))
+
+        count = sum(part[3][0] for part in parts)
+        if count == 0:
+            return None
+        return Distribution(
+            np.concatenate([part[0] for part in parts]),
+            np.concatenate([part[1] for part in parts]),
+            np.concatenate([part[2] for part in parts]),
+            (
+                count, sum(part[3][1] for part in parts),
+                min(part[3][2] for part in parts), max(part[3][3] for part in parts),
+            ),
+        )
+
+    def sensor_ids(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._sketches)
+
+    def clear(self):
+        with self._lock:
+            self._sketches.clear()
+
+
+# Histogramas compartidos por todas las rutas del proceso
+reading_sketches = SketchStore()
+
+reading_store.subscribe(reading_sketches.add, on_load=True)
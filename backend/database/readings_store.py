@@ -0,0 +1,409 @@
+"""
+Almacenamiento columnar en memoria de las lecturas de sensores.
+
+Cada sensor guarda sus lecturas en dos arrays de NumPy (marcas de tiempo en
+segundos epoch y valores) ordenados por tiempo, de modo que las consultas por
+rango se resuelven con búsqueda binaria y devuelven vistas sin copiar datos.
+
+Si los ficheros de segmentos están activos (``database/segment_files.py``),
+las lecturas antiguas de cada sensor están en segmentos sellados proyectados
+en memoria y en los arrays solo queda la cola reciente. Una consulta que cae
+dentro de un segmento o de la cola devuelve una vista; solo las que abarcan
+varios se copian al unirlas.
+"""
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Capacidad inicial de los arrays de cada sensor (crecen duplicándose)
+INITIAL_CAPACITY = 1024
+
+
+class SensorSeries:
+    """
+    Serie temporal de un sensor con arrays de capacidad creciente.
+
+    Las lecturas sueltas se acumulan en listas pendientes y se vuelcan a los
+    arrays en bloque al consultar, para que la ingesta lectura a lectura no
+    pague una operación de NumPy por cada valor.
+    """
+
+    __slots__ = ("_timestamps", "_values", "_size", "_pending_timestamps", "_pending_values", "segments")
+
+    def __init__(self):
+        self._timestamps = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self._values = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self._size = 0
+        self._pending_timestamps: List[float] = []
+        self._pending_values: List[float] = []
+        # Segmentos sellados del sensor, ordenados por su primera lectura
+        self.segments: List = []
+
+    def __len__(self) -> int:
+        return self._size + len(self._pending_timestamps) + sum(segment.count for segment in self.segments)
+
+    def append(self, timestamp: float, value: float):
+        self._pending_timestamps.append(timestamp)
+        self._pending_values.append(value)
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        self._flush()
+        self._write(np.asarray(timestamps, dtype=np.float64), np.asarray(values, dtype=np.float64))
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Devuelve vistas de los arrays de marcas de tiempo y valores.
+        """
+        self._flush()
+        return self._timestamps[:self._size], self._values[:self._size]
+
+    def pieces(self, start: Optional[float], end: Optional[float]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Vistas de las lecturas del rango en cada segmento y en la cola, sin unir.
+        """
+        result = [
+            segment.slice(start, end) for segment in self.segments
+            if (end is None or segment.first_ts <= end) and (start is None or segment.last_ts >= start)
+        ]
+        timestamps, values = self.arrays()
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = timestamps.size if end is None else int(np.searchsorted(timestamps, end, side="right"))
+        result.append((timestamps[lo:hi], values[lo:hi]))
+        return [piece for piece in result if piece[0].size]
+
+    def latest(self) -> Optional[Tuple[float, float]]:
+        timestamps, values = self.arrays()
+        best = (float(timestamps[-1]), float(values[-1])) if timestamps.size else None
+        for segment in self.segments:
+            if best is None or segment.last_ts > best[0]:
+                best = (segment.last_ts, float(segment.values[-1]))
+        return best
+
+    def drop_rows(self, timestamps: np.ndarray, values: np.ndarray) -> int:
+        """
+        Quita de la cola exactamente las lecturas indicadas (las selladas en
+        un segmento); las que lleguen atrasadas dentro del mismo rango se
+        conservan. Se copian a arrays nuevos para no alterar las vistas ya
+        entregadas. Devuelve el número de lecturas quitadas.
+        """
+        tail_timestamps, tail_values = self.arrays()
+        if tail_timestamps.size == 0 or timestamps.size == 0:
+            return 0
+        lo = int(np.searchsorted(tail_timestamps, timestamps[0], side="left"))
+        hi = int(np.searchsorted(tail_timestamps, timestamps[-1], side="right"))
+        drop = np.zeros(tail_timestamps.size, dtype=bool)
+        drop[lo:hi] = match_rows(tail_timestamps[lo:hi], tail_values[lo:hi], timestamps, values)
+        dropped = int(drop.sum())
+        if dropped == 0:
+            return 0
+        keep = ~drop
+        remaining = self._size - dropped
+        capacity = max(INITIAL_CAPACITY, remaining)
+        new_timestamps = np.empty(capacity, dtype=np.float64)
+        new_values = np.empty(capacity, dtype=np.float64)
+        new_timestamps[:remaining] = tail_timestamps[keep]
+        new_values[:remaining] = tail_values[keep]
+        self._timestamps = new_timestamps
+        self._values = new_values
+        self._size = remaining
+        return dropped
+
+    def missing(self, timestamps: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        Máscara de las lecturas indicadas (ordenadas) que no están ya en la
+        cola ni en los segmentos.
+        """
+        present = np.zeros(timestamps.size, dtype=bool)
+        if timestamps.size == 0:
+            return ~present
+        for piece_timestamps, piece_values in self.pieces(float(timestamps[0]), float(timestamps[-1])):
+            present |= match_rows(timestamps, values, piece_timestamps, piece_values)
+        return ~present
+
+    def _flush(self):
+        if not self._pending_timestamps:
+            return
+        timestamps = np.fromiter(self._pending_timestamps, dtype=np.float64, count=len(self._pending_timestamps))
+        values = np.fromiter(self._pending_values, dtype=np.float64, count=len(self._pending_values))
+        self._pending_timestamps = []
+        self._pending_values = []
+        self._write(timestamps, values)
+
+    def _write(self, timestamps: np.ndarray, values: np.ndarray):
+        if timestamps.size == 0:
+            return
+        # Ordenar el bloque entrante si no viene ordenado
+        if timestamps.size > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = values[order]
+
+        size = self._size
+        if size and timestamps[0] < self._timestamps[size - 1]:
+            # Lecturas atrasadas: fusionar en arrays nuevos para no alterar
+            # las vistas que ya se hayan entregado a los lectores
+            merged_timestamps = np.concatenate((self._timestamps[:size], timestamps))
+            merged_values = np.concatenate((self._values[:size], values))
+            order = np.argsort(merged_timestamps, kind="stable")
+            self._timestamps = merged_timestamps[order]
+            self._values = merged_values[order]
+            self._size = self._timestamps.size
+            return
+
+        required = size + timestamps.size
+        if required > self._timestamps.size:
+            capacity = max(required, self._timestamps.size * 2)
+            new_timestamps = np.empty(capacity, dtype=np.float64)
+            new_values = np.empty(capacity, dtype=np.float64)
+            new_timestamps[:size] = self._timestamps[:size]
+            new_values[:size] = self._values[:size]
+            self._timestamps = new_timestamps
+            self._values = new_values
+        self._timestamps[size:required] = timestamps
+        self._values[size:required] = values
+        self._size = required
+
+
+class ReadingStore:
+    """
+    Almacén de lecturas indexado por identificador de sensor.
+
+    Los identificadores pueden ser enteros (sensores registrados en la API) o
+    cadenas (sensores que llegan desde Mycodo).
+    """
+
+    def __init__(self):
+        self._series: Dict[Hashable, SensorSeries] = {}
+        self._lock = threading.RLock()
+        self._listeners: List[Callable[[Hashable, np.ndarray, np.ndarray], None]] = []
+        self._load_listeners: List[Callable[[Hashable, np.ndarray, np.ndarray], None]] = []
+
+    def subscribe(self, listener: Callable[[Hashable, np.ndarray, np.ndarray], None], on_load: bool = False):
+        """
+        Registra una función que se invoca tras cada escritura con
+        ``(sensor_id, timestamps, values)``. Con ``on_load`` también recibe
+        las lecturas de los segmentos cargados del disco al arrancar (los
+        índices derivados sí las necesitan; quien calcula lecturas nuevas a
+        partir de ellas, no).
+        """
+        self._listeners.append(listener)
+        if on_load:
+            self._load_listeners.append(listener)
+
+    def append(self, sensor_id: Hashable, timestamp: float, value: float):
+        """
+        Añade una lectura individual.
+        """
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                series = self._series[sensor_id] = SensorSeries()
+            series.append(float(timestamp), float(value))
+        if self._listeners:
+            self._notify(sensor_id, np.array([timestamp], dtype=np.float64), np.array([value], dtype=np.float64))
+
+    def extend(self, sensor_id: Hashable, timestamps: Iterable[float], values: Iterable[float]):
+        """
+        Añade un bloque de lecturas de un mismo sensor.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if timestamps.shape != values.shape:
+            raise ValueError("timestamps y values deben tener la misma longitud")
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                series = self._series[sensor_id] = SensorSeries()
+            series.extend(timestamps, values)
+        if self._listeners:
+            self._notify(sensor_id, timestamps, values)
+
+    def range(self, sensor_id: Hashable, start: Optional[float] = None, end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Devuelve las lecturas con ``start <= timestamp <= end`` como vistas
+        (una copia si el rango abarca varios segmentos).
+        """
+        return join_pieces(self.pieces(sensor_id, start, end))
+
+    def pieces(self, sensor_id: Hashable, start: Optional[float] = None, end: Optional[float] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Lecturas del rango como vistas por segmento y de la cola, sin unirlas.
+        """
+        with self._lock:
+            series = self._series.get(sensor_id)
+            return [] if series is None else series.pieces(start, end)
+
+    def count(self, sensor_id: Hashable, start: Optional[float] = None, end: Optional[float] = None) -> int:
+        """
+        Número de lecturas de un sensor en el rango indicado.
+        """
+        return sum(int(timestamps.size) for timestamps, _ in self.pieces(sensor_id, start, end))
+
+    def latest(self, sensor_id: Hashable) -> Optional[Tuple[float, float]]:
+        """
+        Última lectura ``(timestamp, value)`` de un sensor, o None.
+        """
+        with self._lock:
+            series = self._series.get(sensor_id)
+            return None if series is None else series.latest()
+
+    def resample(self, sensor_id: Hashable, start: float, end: float, step: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Agrega las lecturas del rango en cubetas de ``step`` segundos.
+
+        Devuelve el inicio de cada cubeta no vacía, la media de sus valores y
+        el número de lecturas que contiene.
+        """
+        timestamps, values = self.range(sensor_id, start, end)
+        if timestamps.size == 0:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty, np.empty(0, dtype=np.int64)
+        buckets = ((timestamps - start) // step).astype(np.int64)
+        counts = np.bincount(buckets)
+        sums = np.bincount(buckets, weights=values)
+        filled = np.nonzero(counts)[0]
+        return start + filled * step, sums[filled] / counts[filled], counts[filled]
+
+    def add_missing(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray, loaded: bool = False) -> int:
+        """
+        Añade las lecturas que no estén ya en el almacén: las recibidas de
+        otros workers, que pueden llegar también por el registro de la cola o
+        en un segmento, o (con ``loaded``) las recuperadas del registro al
+        arrancar, que solo se notifican a los suscriptores de ``on_load``.
+        Devuelve el número de lecturas añadidas.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if timestamps.size > 1:
+            order = np.lexsort((values, timestamps))
+            timestamps, values = timestamps[order], values[order]
+            # Sin duplicados dentro del propio lote
+            unique = np.concatenate(([True], (timestamps[1:] != timestamps[:-1]) | (values[1:] != values[:-1])))
+            timestamps, values = timestamps[unique], values[unique]
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                series = self._series[sensor_id] = SensorSeries()
+            new = series.missing(timestamps, values)
+            timestamps, values = timestamps[new], values[new]
+            series.extend(timestamps, values)
+        if timestamps.size:
+            for listener in (self._load_listeners if loaded else self._listeners):
+                listener(sensor_id, timestamps, values)
+        return int(timestamps.size)
+
+    def attach_segment(self, sensor_id: Hashable, segment, loaded: bool = False) -> bool:
+        """
+        Añade un segmento sellado y quita de la cola las lecturas que contiene.
+        ``loaded`` indica que se ha leído del disco al arrancar: sus lecturas
+        se notifican a los suscriptores de ``on_load``. Devuelve False si el
+        segmento ya estaba.
+        """
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                series = self._series[sensor_id] = SensorSeries()
+            if any(existing.path == segment.path for existing in series.segments):
+                return False
+            series.segments.append(segment)
+            series.segments.sort(key=lambda existing: existing.first_ts)
+            series.drop_rows(segment.timestamps, segment.values)
+        if loaded:
+            for listener in self._load_listeners:
+                listener(sensor_id, segment.timestamps, segment.values)
+        return True
+
+    def segments(self, sensor_id: Hashable) -> List:
+        with self._lock:
+            series = self._series.get(sensor_id)
+            return [] if series is None else list(series.segments)
+
+    def snapshot(self, sensor_id: Hashable) -> Tuple[List, np.ndarray, np.ndarray]:
+        """
+        Segmentos de un sensor y copia de su cola, tomados a la vez.
+        """
+        with self._lock:
+            timestamps, values = self.tail(sensor_id)
+            return self.segments(sensor_id), timestamps, values
+
+    def tail(self, sensor_id: Hashable, through: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Copia de las lecturas de la cola en memoria hasta ``through``.
+        """
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                empty = np.empty(0, dtype=np.float64)
+                return empty, empty
+            timestamps, values = series.arrays()
+            hi = timestamps.size if through is None else int(np.searchsorted(timestamps, through, side="right"))
+            return timestamps[:hi].copy(), values[:hi].copy()
+
+    def tail_sizes(self) -> Dict[Hashable, Tuple[int, float, float]]:
+        """
+        Número de lecturas en la cola de cada sensor, la más antigua y la más reciente.
+        """
+        with self._lock:
+            result = {}
+            for sensor_id, series in self._series.items():
+                timestamps, _ = series.arrays()
+                if timestamps.size:
+                    result[sensor_id] = (int(timestamps.size), float(timestamps[0]), float(timestamps[-1]))
+            return result
+
+    def sensor_ids(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._series)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def _notify(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray):
+        for listener in self._listeners:
+            listener(sensor_id, timestamps, values)
+
+
+def match_rows(timestamps: np.ndarray, values: np.ndarray, other_timestamps: np.ndarray, other_values: np.ndarray) -> np.ndarray:
+    """
+    Máscara de las lecturas ``(timestamps, values)`` que también están en
+    ``(other_timestamps, other_values)``, contando repeticiones: si una
+    lectura está dos veces en la primera y una en la segunda, solo se marca
+    una.
+    """
+    mask = np.zeros(timestamps.size, dtype=bool)
+    if timestamps.size == 0 or other_timestamps.size == 0:
+        return mask
+    # Un complejo por lectura: se ordena por marca de tiempo y luego por valor
+    keys = np.asarray(timestamps, dtype=np.float64) + 1j * np.asarray(values, dtype=np.float64)
+    other = np.sort(np.asarray(other_timestamps, dtype=np.float64) + 1j * np.asarray(other_values, dtype=np.float64))
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    # Posición de cada lectura entre las iguales a ella y cuántas hay en la otra serie
+    rank = np.arange(sorted_keys.size) - np.searchsorted(sorted_keys, sorted_keys, side="left")
+    available = np.searchsorted(other, sorted_keys, side="right") - np.searchsorted(other, sorted_keys, side="left")
+    mask[order] = rank < available
+    return mask
+
+
+def join_pieces(pieces: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Une las piezas de un rango. Con una sola pieza devuelve la propia vista;
+    si las piezas se solapan (lecturas atrasadas), ordena el resultado.
+    """
+    if not pieces:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty
+    if len(pieces) == 1:
+        return pieces[0]
+    timestamps = np.concatenate([piece[0] for piece in pieces])
+    values = np.concatenate([piece[1] for piece in pieces])
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], values[order]
+    return timestamps, values
+
+
+# Almacén compartido por todas las rutas del proceso
+reading_store = ReadingStore()
@@ -0,0 +1,528 @@
+"""
+Ficheros de segmentos de lecturas, de ancho fijo y proyectados en memoria.
+
+Las lecturas antiguas de cada sensor se sellan en ficheros inmutables con dos
+columnas de float64 (marcas de tiempo y valores) y un índice disperso. Los
+workers de uvicorn y los procesos de predicción los abren con ``np.memmap``:
+una consulta por rango es una búsqueda en el índice y un corte de la columna,
+sin copiar ni deserializar, y todos los procesos comparten la misma copia en
+la caché de páginas del sistema en lugar de tener cada uno la suya en RAM. En
+memoria solo queda la cola reciente de cada sensor.
+
+Formato de un segmento (little-endian):
+
+- cabecera de ``HEADER_SIZE`` bytes: firma, versión, paso del índice, número
+  de lecturas, primera y última marca de tiempo
+- columna de marcas de tiempo (float64 × n)
+- columna de valores (float64 × n)
+- índice disperso: la marca de tiempo de cada ``INDEX_STRIDE`` lecturas
+
+Un único proceso (elegido con un bloqueo de fichero) sella: cuando la cola
+de un sensor pasa de ``SEGMENT_ROWS`` lecturas, o su lectura más antigua de
+``SEGMENT_MAX_AGE`` segundos, escribe en un segmento las que tienen más de
+``SEGMENT_SEAL_LAG`` segundos y avisa al resto de workers, que lo abren y
+liberan de su cola exactamente esas lecturas. Al apagarse sella todas las
+colas.
+
+Ese proceso también lleva el registro de la cola (``tail.wal``): añade cada
+bloque de lecturas que recibe, lo sincroniza con el disco cada
+``SEGMENT_WAL_FLUSH`` segundos y, tras sellar, lo reescribe solo con las
+lecturas pendientes. Al arrancar, cada worker abre los segmentos del
+directorio y recupera la cola del registro, así que un corte de corriente o
+un ``SIGKILL`` pierde como mucho las lecturas del último volcado.
+
+Configuración (variables de entorno):
+
+- ``READING_SEGMENTS_DIR``: directorio de los segmentos (sin él no se usan,
+  salvo con varios workers, que usan ``./data/segments``)
+- ``SEGMENT_ROWS``: lecturas de la cola a partir de las que se sella (65536)
+- ``SEGMENT_SEAL_LAG``: antigüedad mínima de las lecturas selladas (3600 s)
+- ``SEGMENT_MAX_AGE``: antigüedad de la cola a partir de la que se sella (86400 s)
+- ``SEGMENT_SEAL_INTERVAL``: cada cuánto se comprueban las colas (60 s)
+- ``SEGMENT_WAL_FLUSH``: cada cuánto se sincroniza el registro de la cola (1 s)
+"""
+import asyncio
+import logging
+import os
+import secrets
+import struct
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from database.readings_store import ReadingStore, join_pieces, reading_store
+from database.shared_state import get_state_backend, state_sync
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"JFSEG\x00\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIqdd")
+HEADER_SIZE = 64
+# Una entrada del índice por página de 4 KiB de marcas de tiempo
+INDEX_STRIDE = 512
+SEGMENT_SUFFIX = ".seg"
+
+# Canal con el que el proceso que sella avisa al resto de workers
+SEGMENTS_CHANNEL = "segments"
+
+# Directorio de los segmentos con varios workers si no se indica otro
+DEFAULT_MULTIWORKER_DIR = "./data/segments"
+
+# Registro de la cola: bloques con la longitud de la clave del sensor, el
+# número de lecturas, la clave y las dos columnas
+WAL_NAME = "tail.wal"
+WAL_RECORD = struct.Struct("<HI")
+
+
+class Segment:
+    """
+    Segmento sellado de un sensor, abierto con ``np.memmap`` en solo lectura.
+    """
+
+    __slots__ = ("path", "count", "first_ts", "last_ts", "timestamps", "values", "index", "stride")
+
+    def __init__(self, path: str):
+        with open(path, "rb") as handle:
+            header = handle.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"Segmento truncado: {path}")
+        magic, version, stride, count, first_ts, last_ts = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION or count <= 0:
+            raise ValueError(f"Segmento no válido: {path}")
+        index_size = -(-count // stride)
+        if os.path.getsize(path) != HEADER_SIZE + 8 * (2 * count + index_size):
+            raise ValueError(f"Segmento con un tamaño inesperado: {path}")
+        self.path = path
+        self.count = count
+        self.stride = stride
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.timestamps = np.memmap(path, dtype="<f8", mode="r", offset=HEADER_SIZE, shape=(count,))
+        self.values = np.memmap(path, dtype="<f8", mode="r", offset=HEADER_SIZE + 8 * count, shape=(count,))
+        self.index = np.memmap(path, dtype="<f8", mode="r", offset=HEADER_SIZE + 16 * count, shape=(index_size,))
+
+    def _position(self, timestamp: float, side: str) -> int:
+        """
+        Posición de ``timestamp`` en la columna: el índice disperso acota la
+        búsqueda a un bloque de ``stride`` lecturas (una página).
+        """
+        block = int(np.searchsorted(self.index, timestamp, side=side))
+        lo = max(block - 1, 0) * self.stride
+        hi = min(block * self.stride, self.count)
+        return lo + int(np.searchsorted(self.timestamps[lo:hi], timestamp, side=side))
+
+    def slice(self, start: Optional[float], end: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vistas de las lecturas con ``start <= timestamp <= end``.
+        """
+        lo = 0 if start is None or start <= self.first_ts else self._position(start, "left")
+        hi = self.count if end is None or end >= self.last_ts else self._position(end, "right")
+        return self.timestamps[lo:hi], self.values[lo:hi]
+
+    @property
+    def nbytes(self) -> int:
+        return HEADER_SIZE + 8 * (2 * self.count + self.index.size)
+
+
+def write_segment(path: str, timestamps: np.ndarray, values: np.ndarray):
+    """
+    Escribe un segmento con lecturas ordenadas. Se escribe en un fichero
+    temporal y se renombra, así que los lectores nunca ven uno a medias.
+    """
+    timestamps = np.ascontiguousarray(timestamps, dtype="<f8")
+    values = np.ascontiguousarray(values, dtype="<f8")
+    header = HEADER.pack(MAGIC, VERSION, INDEX_STRIDE, timestamps.size, timestamps[0], timestamps[-1])
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(header.ljust(HEADER_SIZE, b"\x00"))
+        handle.write(timestamps.tobytes())
+        handle.write(values.tobytes())
+        handle.write(timestamps[::INDEX_STRIDE].tobytes())
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+
+def sensor_key(sensor_id: Hashable) -> str:
+    """
+    Nombre del directorio de un sensor: ``i<id>`` para los enteros y
+    ``s<id>`` (escapado) para los que llegan de Mycodo.
+    """
+    if isinstance(sensor_id, int):
+        return f"i{sensor_id}"
+    return "s" + quote(str(sensor_id), safe="")
+
+
+def parse_sensor_key(key: str) -> Hashable:
+    return int(key[1:]) if key.startswith("i") else unquote(key[1:])
+
+
+# Segmentos abiertos en este proceso (los procesos hijos del backtest los
+# abren una vez aunque reciban varias tareas del mismo sensor)
+_open_segments: Dict[str, Segment] = {}
+_open_segments_lock = threading.Lock()
+
+
+def open_segment(path: str) -> Segment:
+    with _open_segments_lock:
+        segment = _open_segments.get(path)
+        if segment is None:
+            segment = _open_segments[path] = Segment(path)
+        return segment
+
+
+def _wal_block(sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray) -> bytes:
+    key = sensor_key(sensor_id).encode("utf-8")
+    return (
+        WAL_RECORD.pack(len(key), timestamps.size)
+        + key
+        + np.ascontiguousarray(timestamps, dtype="<f8").tobytes()
+        + np.ascontiguousarray(values, dtype="<f8").tobytes()
+    )
+
+
+class TailLog:
+    """
+    Registro de solo añadir de las lecturas de la cola (aún sin sellar).
+
+    Los bloques se acumulan en memoria y ``flush`` los escribe y sincroniza
+    con el disco; ``rewrite`` lo sustituye por la cola actual del almacén.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer = bytearray()
+        # El bloqueo del búfer es el único que toma la ingesta; el del
+        # fichero ordena los volcados y las reescrituras
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+
+    def append(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray):
+        block = _wal_block(sensor_id, timestamps, values)
+        with self._lock:
+            self._buffer += block
+
+    def flush(self) -> int:
+        """
+        Escribe y sincroniza los bloques pendientes. Devuelve los bytes escritos.
+        """
+        with self._file_lock:
+            with self._lock:
+                data, self._buffer = bytes(self._buffer), bytearray()
+            if not data:
+                return 0
+            with open(self.path, "ab") as handle:
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())
+            return len(data)
+
+    def rewrite(self, store: ReadingStore):
+        """
+        Sustituye el registro por una copia de las colas del almacén.
+        """
+        with self._file_lock:
+            with self._lock:
+                # Lo que se añada a partir de aquí va al registro nuevo; una
+                # lectura puede quedar también en la copia, y se descarta al leerlo
+                self._buffer = bytearray()
+                tails = [(sensor_id, *store.tail(sensor_id)) for sensor_id in store.sensor_ids()]
+            temporary = self.path + ".tmp"
+            with open(temporary, "wb") as handle:
+                for sensor_id, timestamps, values in tails:
+                    if timestamps.size:
+                        handle.write(_wal_block(sensor_id, timestamps, values))
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(temporary, self.path)
+
+    @property
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+
+def read_tail_log(path: str) -> Dict[Hashable, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Lecturas de un registro de la cola por sensor. Un bloque final a medio
+    escribir (corte durante un volcado) se descarta.
+    """
+    try:
+        with open(path, "rb") as handle:
+            data = handle.read()
+    except FileNotFoundError:
+        return {}
+    pieces: Dict[Hashable, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    offset = 0
+    while offset + WAL_RECORD.size <= len(data):
+        key_size, count = WAL_RECORD.unpack_from(data, offset)
+        start = offset + WAL_RECORD.size + key_size
+        end = start + 16 * count
+        if end > len(data):
+            logger.warning("Bloque incompleto al final de %s: se descarta", path)
+            break
+        try:
+            sensor_id = parse_sensor_key(data[offset + WAL_RECORD.size:start].decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            logger.warning("Bloque no válido en %s: se descarta el resto", path)
+            break
+        timestamps = np.frombuffer(data, dtype="<f8", count=count, offset=start)
+        values = np.frombuffer(data, dtype="<f8", count=count, offset=start + 8 * count)
+        pieces.setdefault(sensor_id, []).append((timestamps, values))
+        offset = end
+    return {sensor_id: join_pieces(sensor_pieces) for sensor_id, sensor_pieces in pieces.items()}
+
+
+class SeriesSource:
+    """
+    Serie de un sensor que se envía a otro proceso sin sus datos: las rutas
+    de sus segmentos y la cola en memoria. El proceso que la recibe proyecta
+    los segmentos en lugar de recibir una copia de todo el historial.
+    """
+
+    def __init__(self, paths: List[str], tail_timestamps: np.ndarray, tail_values: np.ndarray):
+        self.paths = paths
+        self.tail_timestamps = tail_timestamps
+        self.tail_values = tail_values
+
+    @classmethod
+    def from_store(cls, sensor_id: Hashable, store: ReadingStore = reading_store) -> "SeriesSource":
+        segments, tail_timestamps, tail_values = store.snapshot(sensor_id)
+        return cls([segment.path for segment in segments], tail_timestamps, tail_values)
+
+    @property
+    def size(self) -> int:
+        return self.tail_timestamps.size + sum(open_segment(path).count for path in self.paths)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        pieces = [(open_segment(path).timestamps, open_segment(path).values) for path in self.paths]
+        if self.tail_timestamps.size:
+            pieces.append((self.tail_timestamps, self.tail_values))
+        return join_pieces(pieces)
+
+
+class SegmentStore:
+    """
+    Sellado y carga de los segmentos de un almacén de lecturas.
+    """
+
+    def __init__(self, store: ReadingStore = reading_store):
+        self.store = store
+        self.directory = os.getenv("READING_SEGMENTS_DIR") or None
+        if self.directory is None and int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+            # Con varios workers los segmentos y el registro de la cola son la
+            # fuente común de la que cada worker recupera las lecturas al arrancar
+            self.directory = DEFAULT_MULTIWORKER_DIR
+        self.segment_rows = int(os.getenv("SEGMENT_ROWS", 65536))
+        self.seal_lag = float(os.getenv("SEGMENT_SEAL_LAG", 3600))
+        self.max_age = float(os.getenv("SEGMENT_MAX_AGE", 86400))
+        self.interval = float(os.getenv("SEGMENT_SEAL_INTERVAL", 60))
+        self.flush_interval = float(os.getenv("SEGMENT_WAL_FLUSH", 1))
+        # Registro de la cola: solo lo tiene el proceso que sella
+        self.wal: Optional[TailLog] = None
+        self._loaded = False
+        self._lock_file = None
+        self._seal_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.sealed_rows = 0
+        self.restored_rows = 0
+        self.last_error: Optional[str] = None
+        if self.enabled:
+            store.subscribe(self._log)
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def _path(self, sensor_id: Hashable, name: str) -> str:
+        return os.path.join(self.directory, sensor_key(sensor_id), name)
+
+    def load(self) -> int:
+        """
+        Abre los segmentos del directorio, los añade al almacén y recupera la
+        cola del registro. Devuelve el número de segmentos abiertos.
+        """
+        if not self.enabled:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        attached = self._scan(loaded=True)
+        for sensor_id, (timestamps, values) in read_tail_log(os.path.join(self.directory, WAL_NAME)).items():
+            self.restored_rows += self.store.add_missing(sensor_id, timestamps, values, loaded=True)
+        self._loaded = True
+        self._become_writer()
+        return attached
+
+    def _log(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray):
+        wal = self.wal
+        if wal is not None:
+            wal.append(sensor_id, timestamps, values)
+
+    def _scan(self, loaded: bool) -> int:
+        """
+        Añade al almacén los segmentos del directorio que aún no tiene.
+        """
+        added = 0
+        for key in sorted(os.listdir(self.directory)):
+            sensor_dir = os.path.join(self.directory, key)
+            if not os.path.isdir(sensor_dir) or key[:1] not in ("i", "s"):
+                continue
+            sensor_id = parse_sensor_key(key)
+            for name in sorted(os.listdir(sensor_dir)):
+                if not name.endswith(SEGMENT_SUFFIX):
+                    continue
+                try:
+                    segment = open_segment(os.path.join(sensor_dir, name))
+                except (OSError, ValueError):
+                    logger.exception("No se puede abrir el segmento %s", name)
+                    continue
+                added += self.store.attach_segment(sensor_id, segment, loaded=loaded)
+        return added
+
+    def _acquire_writer(self) -> bool:
+        """
+        Solo un worker sella: el que obtiene el bloqueo del fichero.
+        """
+        if self._lock_file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:  # sin fcntl (Windows) hay un único proceso
+            self._lock_file = True
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(os.path.join(self.directory, "writer.lock"), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        return True
+
+    def _become_writer(self) -> bool:
+        """
+        Toma el papel del proceso que sella si está libre. El registro de la
+        cola se empieza con la cola de este proceso, que ya tiene la del
+        anterior (cargada al arrancar o recibida de los demás workers).
+        """
+        if self.wal is not None:
+            return True
+        if not self._loaded or not self._acquire_writer():
+            return False
+        wal = TailLog(os.path.join(self.directory, WAL_NAME))
+        wal.rewrite(self.store)
+        self.wal = wal
+        return True
+
+    def seal(self, force: bool = False) -> int:
+        """
+        Sella las colas que superan ``segment_rows`` lecturas o ``max_age``
+        segundos (todas con ``force``) y reescribe el registro de la cola.
+        Devuelve el número de lecturas selladas.
+        """
+        if not self.enabled or not self._become_writer():
+            return 0
+        sealed = 0
+        now = time.time()
+        with self._seal_lock:
+            # Segmentos de un worker anterior que este aún no hubiera abierto:
+            # sus lecturas no deben sellarse otra vez
+            self._scan(loaded=False)
+            for sensor_id, (size, oldest, newest) in self.store.tail_sizes().items():
+                if not force and size < self.segment_rows and oldest > now - self.max_age:
+                    continue
+                through = newest if force else newest - self.seal_lag
+                timestamps, values = self.store.tail(sensor_id, through)
+                if timestamps.size == 0:
+                    continue
+                name = f"{int(timestamps[0])}-{int(timestamps[-1])}-{secrets.token_hex(3)}{SEGMENT_SUFFIX}"
+                path = self._path(sensor_id, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_segment(path, timestamps, values)
+                self.store.attach_segment(sensor_id, open_segment(path))
+                get_state_backend().publish(SEGMENTS_CHANNEL, {"sensor": sensor_key(sensor_id), "name": name})
+                sealed += int(timestamps.size)
+            if sealed:
+                self.wal.rewrite(self.store)
+        self.sealed_rows += sealed
+        return sealed
+
+    def attach_remote(self, payload: Dict[str, Any]):
+        """
+        Otro worker ha sellado un segmento: abrirlo y liberar la cola.
+        """
+        if not self.enabled:
+            return
+        sensor_id = parse_sensor_key(payload["sensor"])
+        self.store.attach_segment(sensor_id, open_segment(self._path(sensor_id, payload["name"])))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_seal = time.monotonic() + self.interval
+        while True:
+            await asyncio.sleep(min(self.flush_interval, self.interval))
+            try:
+                if self.wal is not None:
+                    await loop.run_in_executor(None, self.wal.flush)
+                if time.monotonic() >= next_seal:
+                    next_seal = time.monotonic() + self.interval
+                    await loop.run_in_executor(None, self.seal)
+                self.last_error = None
+            except Exception as exc:
+                # Un error (disco, publicación del aviso...) no debe detener
+                # el sellado ni el volcado del registro de la cola
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                logger.exception("Error sellando segmentos de lecturas")
+
+    def start(self):
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Detiene el sellado periódico y sella todas las colas.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.seal, True)
+                if self.wal is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, self.wal.flush)
+            except OSError:
+                logger.exception("Error sellando segmentos de lecturas al apagar")
+
+    def status(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        segments = [segment for sensor_id in self.store.sensor_ids() for segment in self.store.segments(sensor_id)]
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "writer": self._lock_file is not None,
+            "segments": len(segments),
+            "segment_rows": sum(segment.count for segment in segments),
+            "mapped_bytes": sum(segment.nbytes for segment in segments),
+            "tail_rows": sum(size for size, _, _ in self.store.tail_sizes().values()),
+            "sealed_rows": self.sealed_rows,
+            "restored_rows": self.restored_rows,
+            "wal_bytes": self.wal.size if self.wal is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+# Segmentos del almacén del proceso, cargados y sellados desde el lifespan
+segment_store = SegmentStore()
+
+state_sync.subscribe(SEGMENTS_CHANNEL, segment_store.attach_remote)
@@ -0,0 +1,757 @@
+"""
+Estado compartido entre procesos de la API.
+
+Con varios workers de uvicorn cada proceso tiene su propia memoria, así que los
+registros (sensores, actuadores, predicciones), los últimos valores, la cola de
+trabajos y los eventos entre workers se guardan en un backend compartido:
+
+- ``MemoryStateBackend``: en el propio proceso; es el modo por defecto con un
+  solo worker y equivale al comportamiento anterior.
+- ``SqlStateBackend``: base de datos accesible por todos los workers a través
+  de SQLAlchemy (un fichero SQLite en modo WAL o PostgreSQL).
+
+Cada worker ejecuta un ``StateSync`` que consulta periódicamente la tabla de
+eventos (publicación/suscripción entre workers) y reclama trabajos de la cola.
+
+Configuración:
+- ``STATE_BACKEND_URL``: URL de SQLAlchemy del backend compartido
+- ``WEB_CONCURRENCY``: número de workers; si es mayor que 1 y no hay URL, se usa
+  ``sqlite:///./data/shared_state.db``
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre consultas de eventos y trabajos de cada worker
+POLL_INTERVAL = float(os.getenv("STATE_POLL_INTERVAL", 0.5))
+
+# Antigüedad máxima de los eventos antes de purgarlos
+EVENT_RETENTION_SECONDS = 3600
+
+# Un worker que arranca vuelve a procesar los eventos de estos últimos
+# segundos: cubren lo que el resto aún no había guardado en la fuente común
+# (segmentos, diario) cuando la leyó. Los manejadores ignoran lo repetido.
+EVENT_REPLAY_SECONDS = float(os.getenv("STATE_REPLAY_SECONDS", 5))
+
+# Identificador del proceso que publica cada evento
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _encode(value: Any) -> str:
+    """
+    Serializa a JSON conservando las fechas.
+    """
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {"$dt": obj.isoformat()}
+        raise TypeError(f"Tipo no serializable: {type(obj).__name__}")
+    return json.dumps(value, default=default, ensure_ascii=False)
+
+
+def _decode(text: Optional[str]) -> Any:
+    def object_hook(obj):
+        if len(obj) == 1 and "$dt" in obj:
+            return datetime.fromisoformat(obj["$dt"])
+        return obj
+    return None if text is None else json.loads(text, object_hook=object_hook)
+
+
+class StateBackend(ABC):
+    """
+    Interfaz del backend de estado compartido.
+    """
+
+    # Si lo publicado llega a otros procesos
+    shared = True
+
+    # Registros clave-valor por espacio de nombres
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def all(self, namespace: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, data: Dict[str, Any], sort_key: int = 0):
+        ...
+
+    @abstractmethod
+    def patch(self, namespace: str, key: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Sustituye los campos indicados de un registro (un None se guarda como
+        null, no borra el campo). Devuelve el registro o None si no existe.
+        """
+
+    @abstractmethod
+    def put_if_absent(self, namespace: str, key: str, data: Dict[str, Any], sort_key: int = 0) -> bool:
+        """
+        Inserta el registro solo si no existe; devuelve False si ya existía.
+        """
+
+    @abstractmethod
+    def next_id(self, namespace: str) -> int:
+        ...
+
+    # Contadores (identificadores y marcas de agua)
+    @abstractmethod
+    def get_counter(self, name: str) -> int:
+        ...
+
+    @abstractmethod
+    def advance_counter(self, name: str, expected: int, value: int) -> bool:
+        """
+        Cambia el contador de ``expected`` a ``value`` solo si vale ``expected``
+        (comparar e intercambiar). Devuelve False si otro worker lo cambió antes.
+        """
+
+    @abstractmethod
+    def seed(self, namespace: str, records: List[Dict[str, Any]]) -> bool:
+        """
+        Inserta los registros iniciales si el espacio de nombres no existe.
+        Devuelve False si otro worker ya lo había inicializado.
+        """
+
+    # Cola de trabajos
+    @abstractmethod
+    def enqueue(self, queue: str, payload: Dict[str, Any]) -> int:
+        ...
+
+    @abstractmethod
+    def claim(self, queue: str, worker_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    def finish(self, job_id: int, result: Any = None, error: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    # Publicación/suscripción
+    @abstractmethod
+    def publish(self, channel: str, payload: Any):
+        ...
+
+    @abstractmethod
+    def fetch_events(self, after_id: int, limit: int = 500) -> List[Tuple[int, str, str, Any]]:
+        ...
+
+    @abstractmethod
+    def last_event_id(self, before: Optional[float] = None) -> int:
+        """
+        Identificador del último evento (publicado antes de ``before``, si se indica).
+        """
+
+    @abstractmethod
+    def prune_events(self, older_than: float):
+        ...
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Backend en memoria para un único proceso.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._counters: Dict[str, int] = {}
+        self._jobs: Dict[int, Dict[str, Any]] = {}
+
+    def get(self, namespace, key):
+        with self._lock:
+            record = self._records.get(namespace, {}).get(key)
+            return dict(record) if record is not None else None
+
+    def all(self, namespace):
+        with self._lock:
+            return [dict(record) for record in self._records.get(namespace, {}).values()]
+
+    def put(self, namespace, key, data, sort_key=0):
+        with self._lock:
+            self._records.setdefault(namespace, {})[key] = dict(data)
+
+    def patch(self, namespace, key, fields):
+        with self._lock:
+            record = self._records.get(namespace, {}).get(key)
+            if record is None:
+                return None
+            record.update(fields)
+            return dict(record)
+
+    def put_if_absent(self, namespace, key, data, sort_key=0):
+        with self._lock:
+            records = self._records.setdefault(namespace, {})
+            if key in records:
+                return False
+            records[key] = dict(data)
+            return True
+
+    def next_id(self, namespace):
+        with self._lock:
+            self._counters[namespace] = self._counters.get(namespace, 0) + 1
+            return self._counters[namespace]
+
+    def get_counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def advance_counter(self, name, expected, value):
+        with self._lock:
+            if self._counters.get(name, 0) != expected:
+                return False
+            self._counters[name] = value
+            return True
+
+    def seed(self, namespace, records):
+        with self._lock:
+            if namespace in self._counters:
+                return False
+            self._records[namespace] = {str(record["id"]): dict(record) for record in records}
+            self._counters[namespace] = max((record["id"] for record in records), default=0)
+            return True
+
+    def enqueue(self, queue, payload):
+        with self._lock:
+            job_id = len(self._jobs) + 1
+            self._jobs[job_id] = {
+                "id": job_id, "queue": queue, "status": "pending", "payload": payload,
+                "result": None, "error": None, "claimed_by": None,
+                "created_at": time.time(), "updated_at": time.time(),
+            }
+            return job_id
+
+    def claim(self, queue, worker_id):
+        with self._lock:
+            for job in self._jobs.values():
+                if job["queue"] == queue and job["status"] == "pending":
+                    job.update(status="running", claimed_by=worker_id, updated_at=time.time())
+                    return job["id"], job["payload"]
+            return None
+
+    def finish(self, job_id, result=None, error=None):
+        with self._lock:
+            self._jobs[job_id].update(
+                status="failed" if error else "done", result=result, error=error, updated_at=time.time()
+            )
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    # Con un único proceso no hay otros workers a los que avisar: los eventos
+    # propios se ignoran siempre, así que no se guardan
+    def publish(self, channel, payload):
+        pass
+
+    def fetch_events(self, after_id, limit=500):
+        return []
+
+    def last_event_id(self, before=None):
+        return 0
+
+    def prune_events(self, older_than):
+        pass
+
+
+class SqlStateBackend(StateBackend):
+    """
+    Backend sobre una base de datos compartida (SQLite o PostgreSQL).
+    """
+
+    def __init__(self, url: str):
+        from sqlalchemy import (
+            Column, Float, Integer, MetaData, String, Table, Text, create_engine, event,
+        )
+
+        if url.startswith("sqlite:///"):
+            directory = os.path.dirname(url[len("sqlite:///"):])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        self._engine = create_engine(url, pool_pre_ping=True)
+        self._dialect = self._engine.dialect.name
+
+        if self._dialect == "sqlite":
+            @event.listens_for(self._engine, "connect")
+            def _configure_sqlite(dbapi_connection, _):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.close()
+
+        metadata = MetaData()
+        self._records = Table(
+            "shared_records", metadata,
+            Column("namespace", String(64), primary_key=True),
+            Column("key", String(128), primary_key=True),
+            Column("sort_key", Integer, nullable=False, default=0),
+            Column("data", Text, nullable=False),
+        )
+        self._counters = Table(
+            "shared_counters", metadata,
+            Column("namespace", String(64), primary_key=True),
+            Column("value", Integer, nullable=False),
+        )
+        self._jobs = Table(
+            "shared_jobs", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("queue", String(64), nullable=False, index=True),
+            Column("status", String(16), nullable=False, index=True),
+            Column("payload", Text, nullable=False),
+            Column("result", Text),
+            Column("error", Text),
+            Column("claimed_by", String(128)),
+            Column("created_at", Float, nullable=False),
+            Column("updated_at", Float, nullable=False),
+        )
+        self._events = Table(
+            "shared_events", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("channel", String(64), nullable=False),
+            Column("origin", String(128), nullable=False),
+            Column("payload", Text, nullable=False),
+            Column("created_at", Float, nullable=False, index=True),
+        )
+        from sqlalchemy.exc import OperationalError, ProgrammingError
+
+        try:
+            metadata.create_all(self._engine)
+        except (OperationalError, ProgrammingError):
+            # Los workers arrancan a la vez sobre una base de datos nueva y
+            # otro creó las tablas entre la comprobación y la creación
+            metadata.create_all(self._engine)
+
+    def get(self, namespace, key):
+        from sqlalchemy import select
+
+        with self._engine.connect() as conn:
+            data = conn.execute(
+                select(self._records.c.data)
+                .where(self._records.c.namespace == namespace, self._records.c.key == key)
+            ).scalar()
+        return _decode(data)
+
+    def all(self, namespace):
+        from sqlalchemy import select
+
+        with self._engine.connect() as conn:
+            rows = conn.execute(
+                select(self._records.c.data)
+                .where(self._records.c.namespace == namespace)
+                .order_by(self._records.c.sort_key, self._records.c.key)
+            ).scalars().all()
+        return [_decode(row) for row in rows]
+
+    def put(self, namespace, key, data, sort_key=0):
+        if self._dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        # Inserción o actualización en una sola sentencia: con borrar e
+        # insertar, dos workers que escriben la misma clave chocan
+        statement = insert(self._records).values(namespace=namespace, key=key, sort_key=sort_key, data=_encode(data))
+        statement = statement.on_conflict_do_update(
+            index_elements=[self._records.c.namespace, self._records.c.key],
+            set_={"sort_key": statement.excluded.sort_key, "data": statement.excluded.data},
+        )
+        with self._engine.begin() as conn:
+            conn.execute(statement)
+
+    def patch(self, namespace, key, fields):
+        from sqlalchemy import select, update
+
+        where = (self._records.c.namespace == namespace, self._records.c.key == key)
+        # La actualización sin cambios toma el bloqueo de escritura antes de
+        # leer, así que ningún worker escribe entre la lectura y la fusión. Se
+        # fusiona aquí y no con json_patch (que borra las claves con null) para
+        # que todos los backends guarden los None igual que el de memoria.
+        with self._engine.begin() as conn:
+            locked = conn.execute(update(self._records).where(*where).values(data=self._records.c.data))
+            if locked.rowcount == 0:
+                return None
+            record = _decode(conn.execute(select(self._records.c.data).where(*where)).scalar())
+            record.update(fields)
+            conn.execute(update(self._records).where(*where).values(data=_encode(record)))
+        return record
+
+    def put_if_absent(self, namespace, key, data, sort_key=0):
+        from sqlalchemy import insert
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(insert(self._records).values(
+                    namespace=namespace, key=key, sort_key=sort_key, data=_encode(data)
+                ))
+        except IntegrityError:
+            return False
+        return True
+
+    def get_counter(self, name):
+        from sqlalchemy import select
+
+        with self._engine.connect() as conn:
+            value = conn.execute(
+                select(self._counters.c.value).where(self._counters.c.namespace == name)
+            ).scalar()
+        return value or 0
+
+    def advance_counter(self, name, expected, value):
+        from sqlalchemy import insert, update
+        from sqlalchemy.exc import IntegrityError
+
+        with self._engine.begin() as conn:
+            result = conn.execute(
+                update(self._counters)
+                .where(self._counters.c.namespace == name, self._counters.c.value == expected)
+                .values(value=value)
+            )
+            if result.rowcount:
+                return True
+        if expected != 0:
+            return False
+        # El contador aún no existe: crearlo con el nuevo valor
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(insert(self._counters).values(namespace=name, value=value))
+        except IntegrityError:
+            return False
+        return True
+
+    def next_id(self, namespace):
+        from sqlalchemy import insert, update
+        from sqlalchemy.exc import IntegrityError
+
+        with self._engine.begin() as conn:
+            value = conn.execute(
+                update(self._counters)
+                .where(self._counters.c.namespace == namespace)
+                .values(value=self._counters.c.value + 1)
+                .returning(self._counters.c.value)
+            ).scalar()
+            if value is not None:
+                return value
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(insert(self._counters).values(namespace=namespace, value=1))
+            return 1
+        except IntegrityError:
+            # Otro worker creó el contador a la vez
+            return self.next_id(namespace)
+
+    def seed(self, namespace, records):
+        from sqlalchemy import insert
+        from sqlalchemy.exc import IntegrityError
+
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(insert(self._counters).values(
+                    namespace=namespace, value=max((record["id"] for record in records), default=0)
+                ))
+                if records:
+                    conn.execute(insert(self._records), [
+                        {"namespace": namespace, "key": str(record["id"]), "sort_key": record["id"], "data": _encode(record)}
+                        for record in records
+                    ])
+            return True
+        except IntegrityError:
+            return False
+
+    def enqueue(self, queue, payload):
+        from sqlalchemy import insert
+
+        now = time.time()
+        with self._engine.begin() as conn:
+            return conn.execute(insert(self._jobs).values(
+                queue=queue, status="pending", payload=_encode(payload), created_at=now, updated_at=now
+            ).returning(self._jobs.c.id)).scalar()
+
+    def claim(self, queue, worker_id):
+        from sqlalchemy import select, update
+
+        pending = (
+            select(self._jobs.c.id)
+            .where(self._jobs.c.queue == queue, self._jobs.c.status == "pending")
+            .order_by(self._jobs.c.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        with self._engine.begin() as conn:
+            # La condición sobre el estado garantiza que solo un worker reclama cada trabajo
+            row = conn.execute(
+                update(self._jobs)
+                .where(self._jobs.c.id == pending, self._jobs.c.status == "pending")
+                .values(status="running", claimed_by=worker_id, updated_at=time.time())
+                .returning(self._jobs.c.id, self._jobs.c.payload)
+            ).first()
+        if row is None:
+            return None
+        return row[0], _decode(row[1])
+
+    def finish(self, job_id, result=None, error=None):
+        from sqlalchemy import update
+
+        with self._engine.begin() as conn:
+            conn.execute(
+                update(self._jobs).where(self._jobs.c.id == job_id).values(
+                    status="failed" if error else "done",
+                    result=_encode(result), error=error, updated_at=time.time(),
+                )
+            )
+
+    def get_job(self, job_id):
+        from sqlalchemy import select
+
+        with self._engine.connect() as conn:
+            row = conn.execute(select(self._jobs).where(self._jobs.c.id == job_id)).mappings().first()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = _decode(job["payload"])
+        job["result"] = _decode(job["result"])
+        return job
+
+    def publish(self, channel, payload):
+        from sqlalchemy import insert
+
+        with self._engine.begin() as conn:
+            conn.execute(insert(self._events).values(
+                channel=channel, origin=WORKER_ID, payload=_encode(payload), created_at=time.time()
+            ))
+
+    def fetch_events(self, after_id, limit=500):
+        from sqlalchemy import select
+
+        with self._engine.connect() as conn:
+            rows = conn.execute(
+                select(self._events.c.id, self._events.c.channel, self._events.c.origin, self._events.c.payload)
+                .where(self._events.c.id > after_id)
+                .order_by(self._events.c.id)
+                .limit(limit)
+            ).all()
+        return [(row[0], row[1], row[2], _decode(row[3])) for row in rows]
+
+    def last_event_id(self, before=None):
+        from sqlalchemy import func, select
+
+        query = select(func.coalesce(func.max(self._events.c.id), 0))
+        if before is not None:
+            query = query.where(self._events.c.created_at < before)
+        with self._engine.connect() as conn:
+            return conn.execute(query).scalar()
+
+    def prune_events(self, older_than):
+        from sqlalchemy import delete
+
+        with self._engine.begin() as conn:
+            conn.execute(delete(self._events).where(self._events.c.created_at < older_than))
+
+
+class Registry:
+    """
+    Colección de registros con identificador entero (sensores, actuadores...)
+    guardada en el backend compartido.
+
+    Los registros iniciales se insertan la primera vez que se accede a la
+    colección, no al importar, para no tocar la base de datos durante el arranque.
+    """
+
+    def __init__(self, namespace: str, seed: Optional[List[Dict[str, Any]]] = None):
+        self.namespace = namespace
+        self._seed = seed or []
+        self._seeded_backend: Optional[StateBackend] = None
+
+    def _backend(self) -> StateBackend:
+        backend = get_state_backend()
+        if self._seeded_backend is not backend:
+            backend.seed(self.namespace, self._seed)
+            self._seeded_backend = backend
+        return backend
+
+    def all(self) -> List[Dict[str, Any]]:
+        return self._backend().all(self.namespace)
+
+    def get(self, record_id: int) -> Optional[Dict[str, Any]]:
+        return self._backend().get(self.namespace, str(record_id))
+
+    def reserve_id(self) -> int:
+        """
+        Reserva un identificador único para un registro que se creará después.
+        """
+        return self._backend().next_id(self.namespace)
+
+    def create(self, fields: Dict[str, Any], record_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Crea un registro con un identificador único entre todos los workers
+        (o con el identificador reservado antes con ``reserve_id``).
+        """
+        backend = self._backend()
+        record = {"id": record_id if record_id is not None else backend.next_id(self.namespace), **fields}
+        backend.put(self.namespace, str(record["id"]), record, sort_key=record["id"])
+        return record
+
+    def update(self, record_id: int, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Actualiza campos de un registro; devuelve None si no existe.
+        """
+        return self._backend().patch(self.namespace, str(record_id), fields)
+
+
+class StateSync:
+    """
+    Bucle de cada worker que reparte los eventos publicados por otros workers
+    y ejecuta los trabajos de la cola compartida.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[Any], None]]] = {}
+        self._job_handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._flushers: List[Callable[[], None]] = []
+        self._cursor: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+
+    def subscribe(self, channel: str, handler: Callable[[Any], None]):
+        """
+        Registra una función para los eventos de un canal publicados por otros workers.
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def add_flusher(self, flusher: Callable[[], None]):
+        """
+        Registra una función que publica lo acumulado por el worker; se llama
+        en cada ciclo y al detenerse.
+        """
+        self._flushers.append(flusher)
+
+    def flush(self):
+        for flusher in self._flushers:
+            try:
+                flusher()
+            except Exception:
+                logger.exception("Error publicando eventos pendientes")
+
+    def register_job(self, queue: str, handler: Callable[[Dict[str, Any]], Any]):
+        """
+        Registra la función que ejecuta los trabajos de una cola.
+        """
+        self._job_handlers[queue] = handler
+
+    def start(self):
+        # Interesan los eventos posteriores al arranque del worker (y los de
+        # los últimos segundos); el cursor se toma antes de que el
+        # calentamiento cargue el estado guardado, para no perder lo que se
+        # publique entre medias
+        self._cursor = get_state_backend().last_event_id(before=time.time() - EVENT_REPLAY_SECONDS)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.poll_once)
+            except Exception:
+                logger.exception("Error sincronizando el estado compartido")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def poll_once(self):
+        """
+        Procesa los eventos nuevos y, como mucho, un trabajo de cada cola.
+        """
+        self.flush()
+        backend = get_state_backend()
+        if self._cursor is None:
+            self._cursor = backend.last_event_id()
+        for event_id, channel, origin, payload in backend.fetch_events(self._cursor):
+            self._cursor = event_id
+            if origin == WORKER_ID:
+                continue
+            for handler in self._handlers.get(channel, []):
+                try:
+                    handler(payload)
+                except Exception:
+                    logger.exception("Error procesando evento del canal %s", channel)
+
+        for queue, handler in self._job_handlers.items():
+            claimed = backend.claim(queue, WORKER_ID)
+            if claimed is None:
+                continue
+            job_id, payload = claimed
+            try:
+                backend.finish(job_id, result=handler(payload))
+            except Exception as exc:
+                logger.exception("Error ejecutando el trabajo %s de la cola %s", job_id, queue)
+                backend.finish(job_id, error=str(exc))
+
+        now = time.time()
+        if now - self._last_prune > 60:
+            backend.prune_events(now - EVENT_RETENTION_SECONDS)
+            self._last_prune = now
+
+
+def create_state_backend() -> StateBackend:
+    """
+    Crea el backend según ``STATE_BACKEND_URL`` y ``WEB_CONCURRENCY``.
+    """
+    url = os.getenv("STATE_BACKEND_URL")
+    if not url and int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        url = "sqlite:///./data/shared_state.db"
+    if url:
+        return SqlStateBackend(url)
+    return MemoryStateBackend()
+
+
+_state_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_state_backend() -> StateBackend:
+    """
+    Backend compartido del proceso, creado al primer uso.
+    """
+    global _state_backend
+    if _state_backend is None:
+        with _backend_lock:
+            if _state_backend is None:
+                _state_backend = create_state_backend()
+    return _state_backend
+
+
+def set_state_backend(backend: StateBackend):
+    """
+    Sustituye el backend del proceso (por ejemplo, en benchmarks).
+    """
+    global _state_backend
+    _state_backend = backend
+
+
+# Sincronizador del proceso, arrancado desde el lifespan de la aplicación
+state_sync = StateSync()
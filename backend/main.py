@@ -1,25 +1,121 @@
+from utils.startup import readiness, run_warmup, startup_profile, warmup_forecasting
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-import uvicorn
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import asyncio
 import os
 from dotenv import load_dotenv
 
-# Importar routers
-from api import sensor_routes, prediction_routes, actuator_routes, mycodo_routes, history_routes
-
-# Cargar variables de entorno
+# Cargar variables de entorno antes de importar los routers, que crean el
+# backend de estado compartido a partir de ellas
 load_dotenv()
 
+# Importar routers. Los routers solo cargan FastAPI, Pydantic y NumPy: las
+# librerías de IA y de dataframes (scikit-learn, Prophet, pandas) se importan
+# al ajustar el primer modelo que las necesita o durante el calentamiento.
+with startup_profile.phase("routers"):
+    from api import sensor_routes, prediction_routes, actuator_routes, mycodo_routes, history_routes, replication_routes, auth_routes, location_routes
+from database.actuator_journal import actuator_journal
+from database.readings_store import reading_store
+from database.segment_files import segment_store
+from database.shared_state import state_sync
+from utils import synthetic_data
+from utils.admission import AdmissionError, AdmissionMiddleware, admission
+from utils.auth import AuthMiddleware, auth_service
+from utils.compression import CompressionMiddleware, response_compressor
+from utils.replication import replication_shipper
+from utils.virtual_sensors import virtual_sensor_graph
+
+# Días de historial sintético con los que se puebla el modo de desarrollo
+DEV_HISTORY_DAYS = int(os.getenv("DEV_HISTORY_DAYS", 30))
+
+def _seed_development_data():
+    """
+    Puebla el almacén con historial sintético de los sensores de ejemplo y el
+    diario con la programación sintética de los actuadores. Los sensores que ya
+    tienen lecturas (cargadas de los segmentos) no se vuelven a poblar.
+    """
+    end = datetime.now()
+    start = end - timedelta(days=DEV_HISTORY_DAYS)
+    synthetic_data.bulk_load(
+        reading_store,
+        [sensor for sensor in sensor_routes.sensor_registry.all() if reading_store.latest(sensor["id"]) is None],
+        start,
+        end,
+        gap_rate=0.01,
+        anomaly_rate=0.002,
+    )
+    for actuator in actuator_routes.actuator_registry.all():
+        timestamps, states = synthetic_data.generate_actuator_schedule(
+            actuator["type"], start, end, seed=synthetic_data.sensor_seed(0, f"actuator_{actuator['id']}")
+        )
+        actuator_journal.extend(actuator["id"], timestamps, states, issuer="schedule")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El calentamiento se ejecuta en segundo plano para que la API responda
+    # a /health mientras tanto; /ready indica cuándo ha terminado
+    # Primero los segmentos de lecturas guardados en disco, si los hay
+    warmup_tasks = [("segments", segment_store.load)]
+    # Comandos de los actuadores guardados en el estado compartido
+    warmup_tasks.append(("actuator_journal", actuator_routes.load_journal))
+    if os.getenv("ENVIRONMENT", "development") == "development":
+        warmup_tasks.append(("dev_data", _seed_development_data))
+    # Después de los datos de desarrollo, para calcular su historial
+    warmup_tasks.append((
+        "virtual_sensors", lambda: virtual_sensor_graph.load(sensor_routes.sensor_registry.all())
+    ))
+    warmup_tasks.append(("ai_module", warmup_forecasting))
+    # Administrador inicial (bcrypt, por eso fuera del bucle de eventos)
+    warmup_tasks.append(("auth", auth_service.ensure_admin))
+    for name, _ in warmup_tasks:
+        readiness.register(name)
+
+    startup_profile.phases["app_ready_ms"] = startup_profile.elapsed_ms()
+    # Eventos entre workers y cola de trabajos compartida (antes del
+    # calentamiento, que carga el estado guardado)
+    state_sync.start()
+    warmup = asyncio.create_task(run_in_threadpool(run_warmup, warmup_tasks))
+    # Envío de datos al servidor central (solo si REPLICATION_UPSTREAM_URL está definido)
+    replication_shipper.start(describe=replication_routes.describe_sources)
+    # Sellado de las lecturas antiguas en segmentos (solo si READING_SEGMENTS_DIR está definido)
+    segment_store.start()
+    yield
+    await replication_shipper.stop()
+    await segment_store.stop()
+    await state_sync.stop()
+    warmup.cancel()
+
 # Crear la aplicación FastAPI
 app = FastAPI(
     title="Joy's Farm Agent API",
     description="API para el agente autónomo de Joy's Farm",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
-# Configurar CORS
+# Control de admisión: la ingesta y el control de actuadores tienen prioridad
+# sobre las consultas analíticas (ver utils/admission.py)
+app.add_middleware(AdmissionMiddleware)
+
+@app.exception_handler(AdmissionError)
+async def admission_error_handler(request, exc: AdmissionError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers())
+
+# Autenticación (si AUTH_ENABLED): se añade después de la admisión para
+# ejecutarse antes y que esta cuente las peticiones por usuario o clave
+app.add_middleware(AuthMiddleware)
+
+# Compresión de las respuestas (gzip, brotli o zstd según Accept-Encoding):
+# se añade tras los demás para ver la respuesta final
+app.add_middleware(CompressionMiddleware)
+
+# Configurar CORS: se añade el último para ser el más externo, de modo que
+# responda a las peticiones preflight sin credenciales y añada sus cabeceras
+# también a los 401, 403 y 429 de la autenticación y la admisión
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # En producción, especificar los orígenes permitidos
@@ -34,6 +130,9 @@ app.include_router(prediction_routes.router)
 app.include_router(actuator_routes.router)
 app.include_router(mycodo_routes.router)
 app.include_router(history_routes.router)
+app.include_router(replication_routes.router)
+app.include_router(auth_routes.router)
+app.include_router(location_routes.router)
 
 # Ruta básica
 @app.get("/")
@@ -44,7 +143,7 @@ async def root():
         "version": "0.1.0"
     }
 
-# Ruta de estado de salud
+# Ruta de estado de salud (liveness): responde en cuanto el proceso atiende peticiones
 @app.get("/health")
 async def health_check():
     return {
@@ -52,11 +151,36 @@ async def health_check():
         "services": {
             "api": "online",
             "database": "pending",
-            "ai_module": "pending"
-        }
+            "ai_module": readiness.status("ai_module")
+        },
+        "admission": admission.status(),
+        "auth": auth_service.status(),
+        "segments": segment_store.status(),
+        "compression": response_compressor.status()
     }
 
+# Ruta de preparación (readiness): 503 hasta que termina el calentamiento
+@app.get("/ready")
+async def readiness_check():
+    ready = readiness.is_ready()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if ready else "warming_up",
+            **readiness.as_dict(),
+            "startup": startup_profile.as_dict(),
+        }
+    )
+
 # Punto de entrada para ejecutar la aplicación directamente
 if __name__ == "__main__":
+    import uvicorn
+
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        # La recarga automática no es compatible con varios workers
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        reload = os.getenv("ENVIRONMENT", "development") == "development"
+        uvicorn.run("main:app", host="0.0.0.0", port=port, reload=reload)
@@ -0,0 +1,33 @@
+"""
+Fixtures comunes de las pruebas del backend.
+"""
+import pytest
+
+from database import shared_state
+from database.shared_state import MemoryStateBackend
+
+
+@pytest.fixture
+def state_backend():
+    """
+    Backend de estado en memoria y vacío para una prueba.
+    """
+    previous = shared_state._state_backend
+    backend = MemoryStateBackend()
+    shared_state.set_state_backend(backend)
+    yield backend
+    shared_state.set_state_backend(previous)
+
+
+@pytest.fixture
+def sql_state_backend(tmp_path):
+    """
+    Backend de estado sobre un fichero SQLite, como el que comparten los workers.
+    """
+    from database.shared_state import SqlStateBackend
+
+    previous = shared_state._state_backend
+    backend = SqlStateBackend(f"sqlite:///{tmp_path / 'shared_state.db'}")
+    shared_state.set_state_backend(backend)
+    yield backend
+    shared_state.set_state_backend(previous)
@@ -0,0 +1,64 @@
+"""
+Pruebas del diario de comandos de los actuadores.
+"""
+from datetime import datetime
+
+import pytest
+
+from database.actuator_journal import ActuatorJournal, actuator_journal
+
+
+def test_on_time_and_activations_use_prefix_sums():
+    journal = ActuatorJournal()
+    for timestamp, state in [(0, True), (10, False), (20, True), (25, True), (40, False)]:
+        journal.record(1, timestamp, state)
+    assert journal.on_time(1, 0, 40) == 30
+    assert journal.on_time(1, 5, 22) == 7
+    assert journal.usage(1, [0, 15, 50]) == [(10.0, 1), (20.0, 1)]
+    assert journal.state_at(1, 24)["state"] is True
+    assert journal.state_at(1, -1) is None
+
+
+def test_late_entry_rebuilds_prefix_sums():
+    journal = ActuatorJournal()
+    journal.record(1, 0, True)
+    journal.record(1, 30, False)
+    journal.record(1, 10, False)
+    assert journal.on_time(1, 0, 30) == 10
+    assert [entry["timestamp"] for entry in journal.entries(1)] == [30, 10, 0]
+
+
+def test_load_skips_entries_already_applied():
+    journal = ActuatorJournal()
+    records = [
+        {"seq": seq, "actuator_id": 1, "timestamp": float(seq * 10), "state": seq % 2 == 1, "value": None, "issued_by": "api"}
+        for seq in range(1, 5)
+    ]
+    assert journal.record(1, records[0]["timestamp"], True, seq=1) is not None
+    assert journal.load(records) == 3
+    assert journal.load(records) == 0
+    assert journal.record(1, 99.0, True, seq=4) is None
+    assert len(journal.entries(1)) == 4
+    assert journal.on_time(1, 0, 40) == 20
+
+
+def test_commands_survive_restart(sql_state_backend):
+    from api import actuator_routes
+
+    actuator_journal.clear()
+    for minute, state in [(0, True), (10, False), (30, True), (45, False)]:
+        actuator_routes.record_command(1, datetime(2025, 1, 1, 12, minute), state, issued_by="test")
+    usage_before = actuator_journal.usage(1, [datetime(2025, 1, 1, 12).timestamp(), datetime(2025, 1, 1, 13).timestamp()])
+
+    # Un worker nuevo (o el mismo tras reiniciar) parte de un diario vacío
+    actuator_journal.clear()
+    assert actuator_routes.load_journal() == 4
+    assert actuator_journal.usage(1, [datetime(2025, 1, 1, 12).timestamp(), datetime(2025, 1, 1, 13).timestamp()]) == usage_before
+    assert usage_before == [(25 * 60.0, 2)]
+    assert actuator_journal.latest(1)["issued_by"] == "test"
+
+    # El evento de un comando ya cargado no lo duplica
+    stored = sql_state_backend.all(actuator_routes.JOURNAL_NAMESPACE)[-1]
+    actuator_routes._apply_remote_journal_entry(stored)
+    assert len(actuator_journal.entries(1)) == 4
+    actuator_journal.clear()
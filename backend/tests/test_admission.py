@@ -0,0 +1,77 @@
+"""
+Pruebas de la estimación de coste de las consultas de historial.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from api.history_routes import INTERVAL_SECONDS
+from database.readings_store import reading_store
+from utils.admission import AdmissionError, admission, estimate_rows, plan_query
+
+START = datetime(2025, 1, 1)
+END = START + timedelta(hours=5)
+
+
+@pytest.fixture
+def readings(monkeypatch):
+    """
+    Dos sensores con una lectura por minuto durante cinco horas y un límite
+    de 100 filas por consulta.
+    """
+    monkeypatch.setattr(admission, "enabled", True)
+    monkeypatch.setattr(admission, "max_rows", 100)
+    reading_store.clear()
+    timestamps = START.timestamp() + 60.0 * np.arange(300)
+    for sensor_id in (1, 2):
+        reading_store.extend(sensor_id, timestamps, np.ones(300))
+    yield [1, 2]
+    reading_store.clear()
+
+
+def test_estimate_counts_readings_or_buckets(readings):
+    assert estimate_rows(readings, START.timestamp(), END.timestamp()) == 600
+    assert estimate_rows(readings, START.timestamp(), END.timestamp(), 3600) == 12
+    assert estimate_rows(readings, START.timestamp(), START.timestamp() + 600, 3600) == 4
+
+
+def test_small_query_keeps_interval(readings):
+    assert plan_query([1], START.timestamp(), START.timestamp() + 3000, "raw", INTERVAL_SECONDS) == ("raw", 51)
+
+
+def test_large_query_is_promoted(readings):
+    assert plan_query(readings, START.timestamp(), END.timestamp(), "raw", INTERVAL_SECONDS) == ("hourly", 12)
+
+
+def test_large_query_without_promotion_is_rejected(readings):
+    rejected = admission.rejected["cost"]
+    with pytest.raises(AdmissionError) as error:
+        plan_query(readings, START.timestamp(), END.timestamp(), "raw", INTERVAL_SECONDS, allow_promotion=False)
+    assert error.value.status_code == 413
+    assert error.value.detail["estimated_rows"] == 600
+    assert admission.rejected["cost"] == rejected + 1
+
+
+def test_query_too_large_for_any_interval_is_rejected(readings, monkeypatch):
+    monkeypatch.setattr(admission, "max_rows", 1)
+    with pytest.raises(AdmissionError) as error:
+        plan_query(readings, START.timestamp(), END.timestamp(), "hourly", INTERVAL_SECONDS)
+    assert error.value.status_code == 413
+
+
+def test_history_query_reports_plan(readings, state_backend):
+    import main
+
+    client = TestClient(main.app)
+    body = {"sensor_ids": readings, "start_date": START.isoformat(), "end_date": END.isoformat()}
+    response = client.post("/history/query", json=body)
+    assert response.status_code == 200
+    assert response.headers["X-Query-Interval"] == "hourly"
+    assert response.headers["X-Estimated-Rows"] == "12"
+    assert len(response.json()["1"]) == 5
+
+    response = client.post("/history/query", json={**body, "allow_promotion": False})
+    assert response.status_code == 413
+    assert response.json()["detail"]["max_rows"] == 100
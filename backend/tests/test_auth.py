@@ -0,0 +1,104 @@
+"""
+Pruebas de la autenticación: cachés de credenciales, revocación de claves y
+orden de los middlewares.
+"""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from utils.auth import AUTH_CHANNEL, INGEST_ROLE, AuthService, TTLCache
+
+
+@pytest.fixture
+def service(state_backend):
+    service = AuthService()
+    service.rounds = 4
+    return service
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(size=2)
+    cache.put("a", 1, time.time() + 60)
+    cache.put("b", 2, time.time() - 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    cache.put("c", 3, time.time() + 60)
+    cache.put("d", 4, time.time() + 60)
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 2
+
+
+def test_token_is_verified_once(service):
+    token, _ = service.create_access_token({"username": "ana", "role": "user"})
+    assert service.verify_token(token) == {"kind": "user", "sub": "ana", "role": "user"}
+    assert service.verify_token(token)["sub"] == "ana"
+    assert service.tokens.stats()["hits"] == 1
+    assert service.verify_token(token + "x") is None
+
+
+def test_revoked_api_key_is_rejected(service, state_backend, monkeypatch):
+    published = []
+    monkeypatch.setattr(state_backend, "publish", lambda channel, payload: published.append((channel, payload)))
+    key, record = service.create_api_key("mycodo")
+    principal = service.authenticate_headers({"x-api-key": key})
+    assert principal["role"] == INGEST_ROLE
+    assert service.authenticate_headers({"authorization": f"Bearer {key}"}) == principal
+
+    service.revoke_api_key(record["id"])
+    assert service.verify_api_key(key) is None
+    # Los demás workers reciben el aviso para vaciar su caché
+    assert published == [(AUTH_CHANNEL, {"revoked_key": record["id"]})]
+
+
+def test_api_key_with_wrong_secret_is_rejected(service):
+    key, _ = service.create_api_key("mycodo")
+    assert service.verify_api_key(key[:-2] + "zz") is None
+
+
+def test_password_hash_round_trip(service):
+    password_hash = service.hash_password_sync("secreta")
+    assert service.verify_password_sync("secreta", password_hash)
+    assert not service.verify_password_sync("otra", password_hash)
+    assert not service.verify_password_sync("secreta", None)
+
+
+@pytest.fixture
+def auth_client(monkeypatch, state_backend):
+    import main
+
+    # El middleware lee AUTH_ENABLED al construirse la pila
+    monkeypatch.setenv("AUTH_ENABLED", "1")
+    main.app.middleware_stack = None
+    yield TestClient(main.app)
+    main.app.middleware_stack = None
+
+
+def test_cors_preflight_is_not_authenticated(auth_client):
+    response = auth_client.options("/sensors/", headers={
+        "Origin": "http://localhost:3000",
+        "Access-Control-Request-Method": "GET",
+        "Access-Control-Request-Headers": "authorization",
+    })
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+
+
+def test_auth_errors_have_cors_headers(auth_client):
+    response = auth_client.get("/sensors/", headers={"Origin": "http://localhost:3000"})
+    assert response.status_code == 401
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
+
+
+def test_replication_requires_auth_without_replication_token(auth_client, monkeypatch):
+    monkeypatch.delenv("REPLICATION_TOKEN", raising=False)
+    assert auth_client.post("/replication/segments", content=b"").status_code == 401
+    assert auth_client.get("/replication/nodes").status_code == 401
+
+
+def test_replication_token_replaces_auth(auth_client, monkeypatch):
+    monkeypatch.setenv("REPLICATION_TOKEN", "secreto")
+    assert auth_client.get("/replication/nodes", headers={"X-Replication-Token": "secreto"}).status_code == 200
+    response = auth_client.get("/replication/nodes", headers={"X-Replication-Token": "otro"})
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token de replicación no válido"
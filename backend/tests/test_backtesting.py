@@ -0,0 +1,78 @@
+"""
+Pruebas del backtesting de los modelos y de la creación de predicciones.
+"""
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from ai import backtesting
+from ai.forecasting import SECONDS_PER_DAY
+from database.readings_store import reading_store
+
+
+@pytest.fixture
+def series():
+    """
+    Dos sensores con once días de lecturas cada diez minutos.
+    """
+    timestamps = 1.7e9 + 600.0 * np.arange(int(11 * SECONDS_PER_DAY / 600))
+    values = 20 + 5 * np.sin(2 * np.pi * timestamps / SECONDS_PER_DAY)
+    return {1: ("temperature", timestamps, values), 2: ("humidity", timestamps, values * 3)}
+
+
+def test_rolling_origins_leave_training_window_and_horizon(series):
+    _, timestamps, _ = series[1]
+    origins = backtesting.rolling_origins(timestamps, "24h", 3)
+    assert len(origins) == 3
+    assert origins == sorted(origins, reverse=True)
+    assert origins[0] == timestamps[-1] - SECONDS_PER_DAY
+    assert origins[-1] >= timestamps[0] + 7 * SECONDS_PER_DAY
+
+
+def test_backtest_covers_every_combination(series):
+    results = backtesting.run_backtest(
+        series, ["1h", "24h"], ["naive", "harmonic"], origins=2, max_workers=1, measure_memory=False,
+    )
+    assert sorted((r["sensor_id"], r["time_horizon"], r["model"]) for r in results) == [
+        (sensor_id, horizon, model)
+        for sensor_id in (1, 2) for horizon in ("1h", "24h") for model in ("harmonic", "naive")
+    ]
+    assert all(r["origins"] == 2 and "error" not in r for r in results)
+    assert {r["prediction_type"] for r in results if r["sensor_id"] == 2} == {"humidity"}
+
+    # El armónico reproduce el ciclo diario: es el modelo elegido a 24 h
+    selection = backtesting.select_models(results)
+    assert selection[(1, "24h")]["model"] == "harmonic"
+    assert selection[(1, "24h")]["meets_accuracy"]
+
+
+def test_backtest_rejects_unavailable_models_up_front(series):
+    with pytest.raises(ValueError, match="random_forest"):
+        backtesting.run_backtest(series, models=["naive", "random_forest"], max_workers=1)
+
+
+def test_cli_rejects_unavailable_models(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        backtesting.main(["--models", "naive", "random_forest"])
+    assert exit_info.value.code == 2
+    assert "random_forest" in capsys.readouterr().err
+
+
+def test_prediction_checks_sensor(state_backend):
+    import main
+
+    reading_store.clear()
+    timestamps = 1.7e9 + 600.0 * np.arange(500)
+    reading_store.extend(1, timestamps, 20 + np.sin(timestamps / 3600))
+    client = TestClient(main.app)
+    body = {"sensor_id": 1, "prediction_type": "temperature", "time_horizon": "1h"}
+    try:
+        response = client.post("/predictions/", json=body)
+        assert response.status_code == 200
+        assert len(response.json()["predicted_values"]) == 12
+
+        # El sensor 1 de los datos de ejemplo mide temperatura
+        assert client.post("/predictions/", json={**body, "prediction_type": "ph"}).status_code == 400
+        assert client.post("/predictions/", json={**body, "sensor_id": 999}).status_code == 404
+    finally:
+        reading_store.clear()
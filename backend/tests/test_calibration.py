@@ -0,0 +1,59 @@
+"""
+Pruebas de la calibración y la compensación por temperatura.
+"""
+import numpy as np
+import pytest
+
+from utils.calibration import calibrate_batch, calibration_table, oxygen_solubility
+
+
+@pytest.fixture
+def table(state_backend):
+    calibration_table.invalidate()
+    yield calibration_table
+    calibration_table.invalidate()
+
+
+def _batch(sensor_value):
+    return {
+        "rtd": ([1000.0, 2000.0], [35.0, 35.0]),
+        "probe": ([1010.0, 1990.0], [sensor_value, sensor_value]),
+    }
+
+
+def test_ec_is_referred_to_25_degrees(table):
+    result, compensated = calibrate_batch(_batch(1.2), {"rtd": "rtd", "probe": "ec"}, {"rtd": "A", "probe": "A"})
+    assert compensated == 2
+    assert result["probe"][1] == pytest.approx([1.0, 1.0])
+    assert result["rtd"][1].tolist() == [35.0, 35.0]
+
+
+def test_ph_uses_nernst_slope(table):
+    result, _ = calibrate_batch(_batch(9.0), {"rtd": "rtd", "probe": "ph"}, {"rtd": "A", "probe": "A"})
+    assert result["probe"][1] == pytest.approx([7 + 2 * 298.15 / 308.15] * 2)
+
+
+def test_oxygen_solubility_matches_tables():
+    # Tablas de solubilidad en agua dulce a 1 atm (APHA 4500-O)
+    assert oxygen_solubility(np.array([0.0, 20.0, 25.0, 35.0])) == pytest.approx([14.621, 9.092, 8.263, 6.949], abs=1e-3)
+
+
+def test_dissolved_oxygen_uses_solubility_at_probe_temperature(table):
+    result, compensated = calibrate_batch(_batch(8.0), {"rtd": "rtd", "probe": "do"}, {"rtd": "A", "probe": "A"})
+    assert compensated == 2
+    # El circuito convirtió la saturación con la solubilidad a 20 °C
+    assert result["probe"][1] == pytest.approx([8.0 * 6.9493 / 9.0924] * 2, rel=1e-4)
+
+
+def test_dissolved_oxygen_compensation_can_be_disabled(table):
+    # Mycodo ya envía la temperatura al circuito (comando T)
+    table.set_config("probe", {"temperature_coefficient": 0.0, "reference_temperature": None})
+    result, _ = calibrate_batch(_batch(8.0), {"rtd": "rtd", "probe": "do"}, {"rtd": "A", "probe": "A"})
+    assert result["probe"][1] == pytest.approx([8.0, 8.0])
+
+
+def test_slope_and_offset_are_applied(table):
+    table.set_config("probe", {"slope": 2.0, "offset": -1.0})
+    result, compensated = calibrate_batch(_batch(8.0), {"rtd": "rtd", "probe": "do"}, {"rtd": "A", "probe": "B"})
+    assert compensated == 0
+    assert result["probe"][1].tolist() == [15.0, 15.0]
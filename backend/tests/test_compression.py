@@ -0,0 +1,82 @@
+"""
+Pruebas de la negociación de la compresión y de los ETag.
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils.compression import CompressionMiddleware, _gzip, negotiate, response_compressor
+
+ENCODINGS = {"zstd": None, "br": None, "gzip": _gzip}
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate, br, zstd", "zstd"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0, gzip;q=0.1", "gzip"),
+    ("*", "zstd"),
+    ("*;q=0.5, zstd;q=0", "br"),
+    ("identity", None),
+    ("", None),
+])
+def test_negotiate_follows_q_values(accept_encoding, expected):
+    assert negotiate(accept_encoding, ENCODINGS) == expected
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(response_compressor, "encodings", {"gzip": _gzip})
+    app = FastAPI()
+
+    @app.get("/history/test")
+    async def history():
+        return {"points": [{"value": index % 7} for index in range(500)]}
+
+    @app.get("/sensors/test")
+    async def sensors():
+        return {"points": [{"value": index % 7} for index in range(500)]}
+
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_each_encoding_has_its_own_etag(client):
+    plain = client.get("/history/test", headers={"Accept-Encoding": "identity"})
+    compressed = client.get("/history/test", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in plain.headers
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+    assert compressed.json() == plain.json()
+    assert "Accept-Encoding" in compressed.headers["vary"]
+
+
+def test_matching_etag_gets_304(client):
+    etag = client.get("/history/test", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    response = client.get("/history/test", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    weak = client.get("/history/test", headers={"Accept-Encoding": "gzip", "If-None-Match": f"W/{etag}"})
+    assert weak.status_code == 304
+
+
+def test_etag_of_other_encoding_does_not_match(client):
+    etag = client.get("/history/test", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    response = client.get("/history/test", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_compressed_body_is_cached(client):
+    hits = response_compressor.cache.hits
+    first = client.get("/history/test", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/history/test", headers={"Accept-Encoding": "gzip"})
+    assert response_compressor.cache.hits > hits
+    assert second.json() == first.json()
+
+
+def test_other_routes_are_compressed_without_etag(client):
+    response = client.get("/sensors/test", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "etag" not in response.headers
@@ -0,0 +1,52 @@
+"""
+Pruebas de los modelos de predicción.
+"""
+import importlib.util
+
+import numpy as np
+import pytest
+
+from ai.forecasting import SECONDS_PER_DAY, ForecastModel, available_models, create_model
+
+# Modelos que solo dependen de NumPy
+NUMPY_MODELS = ["naive", "seasonal_naive", "harmonic", "holt"]
+
+
+def _daily_cycle(days=4, step=600.0, noise=0.2):
+    """
+    Temperatura con ciclo diario de ±5 °C alrededor de 20 °C y algo de ruido.
+    """
+    timestamps = 1.7e9 + step * np.arange(int(days * SECONDS_PER_DAY / step))
+    values = 20 + 5 * np.sin(2 * np.pi * timestamps / SECONDS_PER_DAY)
+    return timestamps, values + np.random.default_rng(0).normal(0, noise, timestamps.size)
+
+
+@pytest.mark.parametrize("name", NUMPY_MODELS)
+def test_forecast_shape_and_interval(name):
+    timestamps, values = _daily_cycle()
+    future = timestamps[-1] + 600.0 * np.arange(1, 13)
+    prediction, lower, upper = create_model(name).fit(timestamps, values).predict(future)
+    assert prediction.shape == lower.shape == upper.shape == future.shape
+    assert np.all(lower <= prediction) and np.all(prediction <= upper)
+    assert np.all(np.isfinite(prediction))
+
+
+@pytest.mark.parametrize("name", ["seasonal_naive", "harmonic"])
+def test_seasonal_models_follow_daily_cycle(name):
+    timestamps, values = _daily_cycle()
+    future = timestamps[-1] + 3600.0 * np.arange(1, 25)
+    expected = 20 + 5 * np.sin(2 * np.pi * future / SECONDS_PER_DAY)
+    prediction, _, _ = create_model(name).fit(timestamps, values).predict(future)
+    assert np.abs(prediction - expected).mean() < 0.5
+
+
+def test_model_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ForecastModel()
+
+
+def test_models_with_missing_dependencies_are_not_available(monkeypatch):
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+    assert list(available_models()) == NUMPY_MODELS
+    with pytest.raises(ValueError, match="random_forest"):
+        create_model("random_forest")
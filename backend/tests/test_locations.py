@@ -0,0 +1,87 @@
+"""
+Pruebas de los agregados horarios por ubicación.
+"""
+import numpy as np
+
+from utils.locations import HOUR_SECONDS, HourlySeries, LocationAggregates, location_keys
+
+
+def _buckets(timestamps, values):
+    hours, inverse = np.unique((timestamps // HOUR_SECONDS).astype(np.int64), return_inverse=True)
+    mins = np.full(hours.size, np.inf)
+    maxs = np.full(hours.size, -np.inf)
+    np.minimum.at(mins, inverse, values)
+    np.maximum.at(maxs, inverse, values)
+    return hours, np.bincount(inverse), np.bincount(inverse, weights=values), mins, maxs
+
+
+def test_location_keys_include_ancestors():
+    assert location_keys("Invernadero 1 / Zona A") == ["", "Invernadero 1", "Invernadero 1/Zona A"]
+    assert location_keys(None) == [""]
+
+
+def test_out_of_order_batches_merge_like_one_batch():
+    rng = np.random.default_rng(7)
+    timestamps = np.sort(rng.uniform(0, 500 * HOUR_SECONDS, 5000))
+    values = rng.normal(20, 5, timestamps.size)
+
+    series = HourlySeries()
+    batches = np.array_split(np.arange(timestamps.size), 40)
+    # Lotes recientes primero, luego atrasados y alguno que cae en horas ya vistas
+    for index in rng.permutation(len(batches)):
+        series.add(*_buckets(timestamps[batches[index]], values[batches[index]]))
+
+    expected = _buckets(timestamps, values)
+    merged = series.range(0, 500)
+    np.testing.assert_array_equal(merged[0], expected[0])
+    np.testing.assert_array_equal(merged[1], expected[1])
+    np.testing.assert_allclose(merged[2], expected[2])
+    np.testing.assert_array_equal(merged[3], expected[3])
+    np.testing.assert_array_equal(merged[4], expected[4])
+
+
+def test_series_keeps_growing_after_merge():
+    series = HourlySeries()
+    series.add(*_buckets(np.array([10.0, 20.0]) * HOUR_SECONDS, np.array([1.0, 2.0])))
+    series.add(*_buckets(np.array([5.0]) * HOUR_SECONDS, np.array([3.0])))
+    series.add(*_buckets(np.array([20.5, 30.0]) * HOUR_SECONDS, np.array([4.0, 5.0])))
+    hours, counts, sums, mins, maxs = series.range(0, 100)
+    assert hours.tolist() == [5, 10, 20, 30]
+    assert counts.tolist() == [1, 1, 2, 1]
+    assert sums.tolist() == [3.0, 1.0, 6.0, 5.0]
+    assert (mins[2], maxs[2]) == (2.0, 4.0)
+
+
+def test_late_reading_does_not_replace_current_value():
+    aggregates = LocationAggregates()
+    aggregates.bind(lambda sensor_id: {"type": "temperature", "unit": "°C", "location": "Invernadero 1"})
+    aggregates.add(1, np.array([7200.0]), np.array([25.0]))
+    aggregates.add(1, np.array([3600.0, 3700.0]), np.array([10.0, 12.0]))
+
+    row = next(row for row in aggregates.status() if row["location"] == "Invernadero 1")
+    assert row["current_avg"] == 25.0
+    assert row["last_reading_time"] == 7200.0
+    hours, counts, sums, _, _ = aggregates.hourly(row["location"], "temperature", 0, 3 * HOUR_SECONDS)
+    assert hours.tolist() == [1, 2]
+    assert counts.tolist() == [2, 1]
+    assert sums.tolist() == [22.0, 25.0]
+
+
+def test_sensor_registered_after_its_first_readings():
+    """
+    Lecturas de un sensor que aún no está en el registro (en desarrollo, las
+    de los segmentos cargados antes de registrar los sensores): se ignoran
+    hasta que se registra, y a partir de entonces se cuentan.
+    """
+    registry = {}
+    aggregates = LocationAggregates()
+    aggregates.bind(registry.get)
+    aggregates.add(1, np.array([3600.0]), np.array([10.0]))
+    assert aggregates.status() == []
+
+    registry[1] = {"type": "temperature", "unit": "°C", "location": "Invernadero 1"}
+    aggregates.add(1, np.array([7200.0]), np.array([25.0]))
+    row = next(row for row in aggregates.status() if row["location"] == "Invernadero 1")
+    assert row["current_avg"] == 25.0
+    _, counts, _, _, _ = aggregates.hourly("Invernadero 1", "temperature", 0, 3 * HOUR_SECONDS)
+    assert counts.tolist() == [1]
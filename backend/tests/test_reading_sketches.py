@@ -0,0 +1,119 @@
+"""
+Pruebas de los histogramas de lecturas y de los percentiles y bandas del historial.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from database.reading_sketches import reading_sketches
+from database.readings_store import reading_store
+
+# Sensor de pH de los datos de ejemplo
+SENSOR_ID = 3
+START = datetime(2025, 1, 1)
+EDGES = [5.5, 6.0, 7.5, 8.0]
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+@pytest.fixture
+def readings():
+    """
+    Tres días de pH con una lectura por minuto, guardados en bloques
+    desordenados (las lecturas atrasadas llegan después de las recientes).
+    """
+    reading_store.clear()
+    reading_sketches.clear()
+    rng = np.random.default_rng(7)
+    timestamps = START.timestamp() + 60.0 * np.arange(3 * 1440)
+    values = np.round(rng.normal(6.8, 0.6, timestamps.size), 3)
+    for chunk in rng.permutation(np.array_split(np.arange(timestamps.size), 12)):
+        reading_store.extend(SENSOR_ID, timestamps[chunk][::-1], values[chunk][::-1])
+    yield timestamps, values
+    reading_store.clear()
+    reading_sketches.clear()
+
+
+def _between(timestamps, values, start, end):
+    return values[(timestamps >= start) & (timestamps <= end)]
+
+
+def test_quantiles_match_numpy(readings):
+    timestamps, values = readings
+    # Rango con días y horas completos y trozos de hora en los dos extremos
+    start, end = timestamps[0] + 1810.0, timestamps[-1] - 2450.0
+    expected = _between(timestamps, values, start, end)
+
+    distribution = reading_sketches.distribution(SENSOR_ID, start, end)
+    assert distribution.count == expected.size
+    assert distribution.min == expected.min() and distribution.max == expected.max()
+    assert distribution.mean == pytest.approx(expected.mean())
+    exact = np.quantile(expected, QUANTILES, method="inverted_cdf")
+    np.testing.assert_allclose(distribution.quantiles(QUANTILES), exact, rtol=0.005)
+
+
+def test_histogram_counts_match_numpy(readings):
+    timestamps, values = readings
+    start, end = timestamps[0] + 1810.0, timestamps[-1] - 2450.0
+    expected = _between(timestamps, values, start, end)
+
+    counts, hours = reading_sketches.distribution(SENSOR_ID, start, end).histogram(EDGES)
+    bands = np.searchsorted(EDGES, expected, side="right")
+    assert counts.tolist() == np.bincount(bands, minlength=len(EDGES) + 1).tolist()
+    # Con una lectura por minuto, cada lectura representa un minuto
+    np.testing.assert_allclose(hours, counts / 60.0)
+
+
+def test_readings_without_hourly_sketch(readings):
+    """
+    Lecturas guardadas sin pasar por los histogramas (por ejemplo, antes de
+    suscribirse al almacén) en una hora sin histograma y en otra con parte.
+    """
+    timestamps, _ = readings
+    later = timestamps[-1] + 7200.0
+    listeners = reading_store._listeners
+    reading_store._listeners = []
+    try:
+        reading_store.extend(SENSOR_ID, later + np.array([60.0, 120.0]), np.array([6.1, 6.2]))
+        reading_store.extend(SENSOR_ID, timestamps[-1] + np.array([10.0, 20.0]), np.array([7.0, 7.1]))
+    finally:
+        reading_store._listeners = listeners
+
+    distribution = reading_sketches.distribution(SENSOR_ID, later, later + 600.0)
+    counts, hours = distribution.histogram(EDGES)
+    assert distribution.count == 2
+    assert counts.sum() == 2 and hours.sum() == pytest.approx(1.0)
+
+    # La hora de la última lectura tiene histograma, pero sin las dos nuevas
+    distribution = reading_sketches.distribution(SENSOR_ID, timestamps[-1] - 60.0, timestamps[-1] + 60.0)
+    assert distribution.count == 4
+    assert distribution.histogram(EDGES)[1].sum() <= 1.0
+
+
+def test_summary_and_histogram_routes(readings, state_backend):
+    import main
+
+    timestamps, values = readings
+    start, end = START + timedelta(minutes=30), START + timedelta(days=2, hours=5, minutes=15)
+    expected = _between(timestamps, values, start.timestamp(), end.timestamp())
+    client = TestClient(main.app)
+    params = {"start_date": start.isoformat(), "end_date": end.isoformat()}
+
+    response = client.request("GET", "/history/summary", params=params, json=[SENSOR_ID])
+    assert response.status_code == 200
+    summary = response.json()[0]
+    assert summary["count"] == expected.size
+    for key, quantile in (("p5", 0.05), ("p50", 0.5), ("p95", 0.95)):
+        assert summary[key] == pytest.approx(np.quantile(expected, quantile, method="inverted_cdf"), rel=0.005, abs=0.01)
+
+    # Sin límites, las bandas son los umbrales de estado del pH
+    response = client.get("/history/histogram", params={**params, "sensor_id": SENSOR_ID})
+    assert response.status_code == 200
+    bins = response.json()["bins"]
+    assert [item["upper"] for item in bins] == EDGES + [None]
+    bands = np.searchsorted(EDGES, expected, side="right")
+    assert [item["count"] for item in bins] == np.bincount(bands, minlength=len(EDGES) + 1).tolist()
+
+    response = client.get("/history/histogram", params={**params, "sensor_id": SENSOR_ID, "edges": [7.0, 6.0]})
+    assert response.status_code == 400
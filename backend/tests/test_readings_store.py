@@ -0,0 +1,50 @@
+"""
+Pruebas del almacén columnar de lecturas.
+"""
+import numpy as np
+
+from database.readings_store import ReadingStore
+
+
+def test_range_is_inclusive_and_sorted():
+    store = ReadingStore()
+    store.extend(1, [30.0, 10.0, 20.0], [3.0, 1.0, 2.0])
+    store.append(1, 40.0, 4.0)
+    # Lectura atrasada después de las recientes
+    store.extend(1, [15.0], [1.5])
+
+    timestamps, values = store.range(1)
+    assert timestamps.tolist() == [10.0, 15.0, 20.0, 30.0, 40.0]
+    assert values.tolist() == [1.0, 1.5, 2.0, 3.0, 4.0]
+    assert store.range(1, 15.0, 30.0)[0].tolist() == [15.0, 20.0, 30.0]
+    assert store.range(1, 31.0, 39.0)[0].size == 0
+    assert store.range("otro")[0].size == 0
+    assert store.count(1, 11.0) == 4
+    assert store.latest(1) == (40.0, 4.0)
+
+
+def test_add_missing_skips_stored_and_repeated_readings():
+    store = ReadingStore()
+    notified = []
+    store.subscribe(lambda sensor_id, timestamps, values: notified.append(timestamps.tolist()))
+    store.extend(1, [10.0, 20.0], [1.0, 2.0])
+
+    # Repetida, con el mismo instante pero otro valor, duplicada en el lote y nueva
+    added = store.add_missing(1, np.array([20.0, 20.0, 30.0, 30.0, 5.0]), np.array([2.0, 2.5, 3.0, 3.0, 0.5]))
+    assert added == 3
+    timestamps, values = store.range(1)
+    assert timestamps.tolist() == [5.0, 10.0, 20.0, 20.0, 30.0]
+    assert values.tolist() == [0.5, 1.0, 2.0, 2.5, 3.0]
+    assert notified[-1] == [5.0, 20.0, 30.0]
+
+    assert store.add_missing(1, np.array([10.0, 30.0]), np.array([1.0, 3.0])) == 0
+    assert len(notified) == 2
+
+
+def test_loaded_readings_only_reach_load_listeners():
+    store = ReadingStore()
+    live, derived = [], []
+    store.subscribe(lambda *args: live.append(args[0]))
+    store.subscribe(lambda *args: derived.append(args[0]), on_load=True)
+    assert store.add_missing(1, np.array([1.0]), np.array([1.0]), loaded=True) == 1
+    assert (live, derived) == ([], [1])
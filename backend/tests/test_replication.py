@@ -0,0 +1,199 @@
+"""
+Pruebas de la replicación de un nodo al servidor central.
+"""
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from api import replication_routes
+from database.actuator_journal import actuator_journal
+from database.readings_store import reading_store
+from utils.replication import ReplicationShipper, encode_segment
+
+
+@pytest.fixture
+def node_id():
+    # Identificador nuevo en cada prueba: la correspondencia de
+    # identificadores locales se guarda en una caché del módulo. Con un
+    # estado compartido nuevo los identificadores locales se repiten, así
+    # que se vacían también el almacén y el diario.
+    reading_store.clear()
+    actuator_journal.clear()
+    return f"nodo-{uuid.uuid4().hex[:8]}"
+
+
+def _readings_segment(node_id, first_seq=1, count=3):
+    return {
+        "node_id": node_id,
+        "stream": "readings",
+        "records": [
+            {"seq": first_seq + index, "sensor_id": 1, "timestamps": [1000.0 + first_seq + index], "values": [float(index)]}
+            for index in range(count)
+        ],
+    }
+
+
+def _crash(name, expected, value):
+    raise RuntimeError("corte antes de avanzar el cursor")
+
+
+def _local_sensor(node_id):
+    return replication_routes._local_id(node_id, "sensor", 1, None)
+
+
+def test_resent_segment_is_not_applied_twice(state_backend, node_id):
+    segment = _readings_segment(node_id)
+    assert replication_routes._apply_segment(segment)["applied"] == 3
+    assert replication_routes._apply_segment(segment) == {"node_id": node_id, "stream": "readings", "acked_seq": 3, "applied": 0}
+    assert reading_store.count(_local_sensor(node_id)) == 3
+
+
+def test_interrupted_apply_is_retried_without_duplicates(state_backend, node_id, monkeypatch):
+    segment = _readings_segment(node_id)
+
+    # Aplicado, pero el cursor no llega a avanzar: el nodo lo reenviará
+    with monkeypatch.context() as patch:
+        patch.setattr(state_backend, "advance_counter", _crash)
+        with pytest.raises(RuntimeError):
+            replication_routes._apply_segment(segment)
+    assert state_backend.get_counter(replication_routes._cursor_name(node_id, "readings")) == 0
+
+    assert replication_routes._apply_segment(segment)["acked_seq"] == 3
+    assert reading_store.count(_local_sensor(node_id)) == 3
+
+
+def test_interrupted_commands_are_not_duplicated(state_backend, node_id, monkeypatch):
+    segment = {
+        "node_id": node_id,
+        "stream": "actuator_events",
+        "records": [
+            {"seq": 1, "actuator_id": 1, "timestamp": 1000.0, "state": True, "value": None, "issued_by": "api"},
+            {"seq": 2, "actuator_id": 1, "timestamp": 1600.0, "state": False, "value": None, "issued_by": "api"},
+        ],
+    }
+    with monkeypatch.context() as patch:
+        patch.setattr(state_backend, "advance_counter", _crash)
+        with pytest.raises(RuntimeError):
+            replication_routes._apply_segment(segment)
+
+    assert replication_routes._apply_segment(segment)["acked_seq"] == 2
+    actuator_id = replication_routes._local_id(node_id, "actuator", 1, None)
+    assert len(actuator_journal.entries(actuator_id)) == 2
+    assert actuator_journal.on_time(actuator_id, 0, 2000) == 600
+
+
+@pytest.mark.parametrize("record", [
+    {"sensor_id": 1, "timestamps": [1.0], "values": [1.0]},
+    {"seq": 2, "sensor_id": 1, "timestamps": [1.0, 2.0], "values": [1.0]},
+    {"seq": 2, "sensor_id": 1, "timestamps": ["a"], "values": [1.0]},
+    {"seq": 2, "timestamps": [1.0], "values": [1.0]},
+])
+def test_malformed_record_does_not_advance_cursor(state_backend, node_id, record):
+    segment = _readings_segment(node_id, count=1)
+    segment["records"].append(record)
+    with pytest.raises(HTTPException) as error:
+        replication_routes._apply_segment(segment)
+    assert error.value.status_code == 400
+    assert state_backend.get_counter(replication_routes._cursor_name(node_id, "readings")) == 0
+
+
+def test_gap_is_reported_with_server_cursor(state_backend, node_id):
+    replication_routes._apply_segment(_readings_segment(node_id))
+    with pytest.raises(HTTPException) as error:
+        replication_routes._apply_segment(_readings_segment(node_id, first_seq=6))
+    assert error.value.status_code == 409
+    assert error.value.detail["acked_seq"] == 3
+
+
+def test_node_ships_to_central_instance(state_backend, node_id, tmp_path, monkeypatch):
+    """
+    Un nodo y un servidor central: el nodo envía por HTTP (a través del
+    cliente de pruebas), pierde la confirmación de un segmento y continúa
+    desde el cursor del servidor sin duplicar nada.
+    """
+    import main
+
+    monkeypatch.setenv("REPLICATION_UPSTREAM_URL", "http://central")
+    monkeypatch.setenv("REPLICATION_NODE_ID", node_id)
+    monkeypatch.setenv("REPLICATION_OUTBOX", str(tmp_path / "outbox.db"))
+    central = TestClient(main.app)
+    node = ReplicationShipper()
+
+    def request(method, path, body=None, headers=None):
+        response = central.request(method, path, content=body, headers=headers)
+        return response.status_code, response.json()
+
+    node._request = request
+    node.capture_readings({1: ([1000.0, 1001.0], [1.0, 2.0])})
+    node.capture_readings({1: ([1002.0], [3.0])})
+    assert node.ship_stream("readings") == 2
+
+    # El servidor aplicó el segmento pero la respuesta no llegó al nodo
+    node.capture_readings({1: ([1003.0], [4.0])})
+    segment = node._build_segment("readings", 2)
+    body, checksum = encode_segment(segment)
+    assert request("POST", "/replication/segments", body, {"X-Segment-Checksum": checksum})[0] == 200
+
+    assert node.ship_stream("readings") == 1
+    node.sync_cursors()
+    assert node.outbox.status()["readings"]["acked_seq"] == 3
+    assert reading_store.count(_local_sensor(node_id)) == 4
+
+
+def test_rollups_do_not_mix_with_raw_readings(state_backend, node_id):
+    import asyncio
+
+    hour = 3600.0 * 500000
+    replication_routes._apply_segment({
+        "node_id": node_id,
+        "stream": "readings",
+        "records": [{"seq": 1, "sensor_id": 1, "timestamps": [hour + 30, hour + 90], "values": [10.0, 20.0]}],
+    })
+    rollup = {"seq": 1, "sensor_id": 1, "hour": hour, "mean": 15.0, "min": 10.0, "max": 20.0, "count": 2}
+    segment = {"node_id": node_id, "stream": "rollups", "records": [rollup]}
+    assert replication_routes._apply_segment(segment)["applied"] == 1
+
+    sensor_id = _local_sensor(node_id)
+    timestamps, values = reading_store.range(sensor_id)
+    assert timestamps.tolist() == [hour + 30, hour + 90]
+    assert values.tolist() == [10.0, 20.0]
+
+    # Reenviado tras un corte: el resumen se sustituye, no se duplica
+    state_backend.advance_counter(replication_routes._cursor_name(node_id, "rollups"), 1, 0)
+    replication_routes._apply_segment(segment)
+    rollups = asyncio.run(replication_routes.get_sensor_rollups(sensor_id))
+    assert [(item["mean"], item["count"]) for item in rollups] == [(15.0, 2)]
+
+
+def test_shipper_keeps_running_after_unexpected_errors(tmp_path, monkeypatch):
+    import asyncio
+    import sqlite3
+
+    from utils import replication
+
+    monkeypatch.setattr(replication, "SHIP_INTERVAL", 0.01)
+    monkeypatch.setenv("REPLICATION_UPSTREAM_URL", "http://central")
+    monkeypatch.setenv("REPLICATION_OUTBOX", str(tmp_path / "outbox.db"))
+    node = ReplicationShipper()
+    errors = [KeyError("cursors"), sqlite3.OperationalError("database is locked")]
+    shipped = []
+
+    def sync_cursors():
+        if errors:
+            raise errors.pop(0)
+
+    monkeypatch.setattr(node, "_acquire_leadership", lambda: True)
+    monkeypatch.setattr(node, "sync_cursors", sync_cursors)
+    monkeypatch.setattr(node, "ship_once", lambda: shipped.append(True))
+
+    async def run():
+        task = asyncio.create_task(node._run())
+        while not shipped:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert errors == []
+    assert node.last_error is None
@@ -0,0 +1,157 @@
+"""
+Pruebas de los segmentos de lecturas y del registro de la cola.
+"""
+import numpy as np
+import pytest
+
+from database.readings_store import ReadingStore, match_rows
+from database.segment_files import SegmentStore, read_tail_log
+
+
+@pytest.fixture
+def segments_env(tmp_path, monkeypatch, state_backend):
+    monkeypatch.setenv("READING_SEGMENTS_DIR", str(tmp_path))
+    monkeypatch.setenv("SEGMENT_ROWS", "100")
+    monkeypatch.setenv("SEGMENT_SEAL_LAG", "0")
+    return tmp_path
+
+
+def _open(store: ReadingStore) -> SegmentStore:
+    segments = SegmentStore(store)
+    segments.load()
+    return segments
+
+
+def _crash(segments: SegmentStore):
+    # Al morir el proceso se libera el bloqueo sin sellar ni volcar nada más
+    segments._lock_file.close()
+
+
+def test_match_rows_counts_repetitions():
+    timestamps = np.array([1.0, 1.0, 2.0, 3.0])
+    values = np.array([5.0, 5.0, 6.0, 7.0])
+    mask = match_rows(timestamps, values, np.array([1.0, 2.0, 3.0]), np.array([5.0, 6.0, 8.0]))
+    assert mask.tolist() == [True, False, True, False]
+
+
+def test_seal_and_reload_round_trip(segments_env):
+    store = ReadingStore()
+    segments = _open(store)
+    timestamps = np.arange(250, dtype=np.float64)
+    store.extend(1, timestamps, timestamps * 2)
+    store.extend("mycodo/ph", timestamps[:10], timestamps[:10])
+    # El sensor 1 supera SEGMENT_ROWS y el de Mycodo, SEGMENT_MAX_AGE
+    assert segments.seal() == 260
+    assert len(store.segments(1)) == 1
+    store.extend(1, timestamps + 250, timestamps)
+    segments.wal.flush()
+    _crash(segments)
+
+    reloaded = ReadingStore()
+    _open(reloaded)
+    restored_timestamps, restored_values = reloaded.range(1)
+    np.testing.assert_array_equal(restored_timestamps, np.arange(500, dtype=np.float64))
+    np.testing.assert_array_equal(restored_values, np.concatenate((timestamps * 2, timestamps)))
+    assert reloaded.count("mycodo/ph") == 10
+
+
+def test_late_rows_are_not_dropped_by_seal(segments_env):
+    store = ReadingStore()
+    segments = _open(store)
+    store.extend(1, np.arange(0, 200, 2, dtype=np.float64), np.zeros(100))
+    tail = store.tail
+    late = [(51.0, 1.0)]
+
+    def tail_then_late_reading(sensor_id, through=None):
+        copy = tail(sensor_id, through)
+        # Lectura atrasada que llega mientras se escribe el segmento
+        if late:
+            store.append(sensor_id, *late.pop())
+        return copy
+
+    store.tail = tail_then_late_reading
+    assert segments.seal() == 100
+    del store.tail
+    assert store.count(1) == 101
+    assert store.tail(1)[0].tolist() == [51.0]
+
+
+def test_remote_attach_keeps_rows_missing_from_segment(segments_env):
+    writer = ReadingStore()
+    segments = _open(writer)
+    reader = ReadingStore()
+    timestamps = np.arange(100, dtype=np.float64)
+    writer.extend(1, timestamps, timestamps)
+    reader.extend(1, timestamps, timestamps)
+    # Lectura que el otro worker recibió antes de que llegara al que sella
+    reader.append(1, 10.5, 3.0)
+    segments.seal()
+    assert reader.attach_segment(1, writer.segments(1)[0])
+    assert reader.tail(1)[0].tolist() == [10.5]
+    assert reader.count(1) == 101
+
+
+def test_tail_survives_crash(segments_env):
+    store = ReadingStore()
+    segments = _open(store)
+    store.extend(1, np.arange(50, dtype=np.float64), np.ones(50))
+    segments.wal.flush()
+    _crash(segments)
+
+    recovered = ReadingStore()
+    recovered_segments = _open(recovered)
+    assert recovered.count(1) == 50
+    assert recovered_segments.restored_rows == 50
+    # El nuevo proceso que sella empieza su registro con la cola recuperada
+    assert read_tail_log(recovered_segments.wal.path)[1][0].size == 50
+
+
+def test_crash_between_seal_and_log_rewrite_does_not_duplicate(segments_env):
+    store = ReadingStore()
+    segments = _open(store)
+    store.extend(1, np.arange(150, dtype=np.float64), np.ones(150))
+    segments.wal.flush()
+    segments.wal.rewrite = lambda store: None
+    segments.seal()
+    _crash(segments)
+
+    recovered = ReadingStore()
+    _open(recovered)
+    assert recovered.count(1) == 150
+
+
+def test_old_tail_is_sealed_by_age(segments_env, monkeypatch):
+    monkeypatch.setenv("SEGMENT_MAX_AGE", "3600")
+    store = ReadingStore()
+    segments = _open(store)
+    store.extend(1, np.array([1000.0, 1001.0]), np.array([1.0, 2.0]))
+    assert segments.seal() == 2
+    assert store.tail_sizes() == {}
+
+
+def test_seal_loop_survives_errors(segments_env, monkeypatch):
+    import asyncio
+
+    store = ReadingStore()
+    segments = _open(store)
+    segments.interval = segments.flush_interval = 0.01
+    store.extend(1, np.arange(150, dtype=np.float64), np.ones(150))
+    seal = segments.seal
+    failures = [RuntimeError("aviso no publicado")]
+
+    def flaky_seal():
+        if failures:
+            raise failures.pop()
+        return seal()
+
+    monkeypatch.setattr(segments, "seal", flaky_seal)
+
+    async def run():
+        task = asyncio.create_task(segments._run())
+        while not store.segments(1):
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert failures == []
+    assert segments.last_error is None
@@ -0,0 +1,134 @@
+"""
+Pruebas del estado compartido entre workers.
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from database import shared_state
+from database.readings_store import ReadingStore, reading_store
+from database.segment_files import DEFAULT_MULTIWORKER_DIR, SegmentStore
+from database.shared_state import StateSync
+from utils import ingest
+
+
+def test_put_replaces_record(sql_state_backend):
+    sql_state_backend.put("test", "1", {"value": 1}, sort_key=1)
+    sql_state_backend.put("test", "1", {"value": 2}, sort_key=2)
+    assert sql_state_backend.get("test", "1") == {"value": 2}
+    assert len(sql_state_backend.all("test")) == 1
+
+
+@pytest.mark.parametrize("backend", ["state_backend", "sql_state_backend"])
+def test_patch_keeps_null_fields(request, backend):
+    backend = request.getfixturevalue(backend)
+    backend.put("test", "1", {"value": 1, "note": "a", "nested": {"x": 1}})
+    expected = {"value": 2, "note": None, "nested": {"y": 2}}
+    assert backend.patch("test", "1", {"value": 2, "note": None, "nested": {"y": 2}}) == expected
+    assert backend.get("test", "1") == expected
+    assert backend.patch("test", "missing", {"value": 1}) is None
+
+
+def test_concurrent_patches_keep_every_field(sql_state_backend):
+    sql_state_backend.put("test", "shared", {})
+    errors = []
+
+    def writer(worker):
+        try:
+            for index in range(10):
+                sql_state_backend.patch("test", "shared", {f"worker_{worker}": index})
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sql_state_backend.get("test", "shared") == {f"worker_{worker}": 9 for worker in range(4)}
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        shared_state.StateBackend()
+
+
+def test_concurrent_puts_do_not_conflict(sql_state_backend):
+    errors = []
+
+    def writer(worker):
+        try:
+            for index in range(25):
+                sql_state_backend.put("test", "shared", {"worker": worker, "index": index})
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sql_state_backend.get("test", "shared")["index"] == 24
+
+
+def test_last_event_id_before(sql_state_backend):
+    sql_state_backend.publish("test", 1)
+    first = sql_state_backend.last_event_id()
+    time.sleep(0.01)
+    cutoff = time.time()
+    sql_state_backend.publish("test", 2)
+    assert sql_state_backend.last_event_id(before=cutoff) == first
+    assert sql_state_backend.last_event_id() > first
+
+
+def test_readings_are_published_in_one_event(sql_state_backend, monkeypatch):
+    sensor_id = "test-shared-readings"
+    for second in range(3):
+        ingest.ingest_readings({sensor_id: ([1000.0 + second], [float(second)])})
+    assert sql_state_backend.fetch_events(0) == []
+
+    ingest.publish_pending_readings()
+    events = sql_state_backend.fetch_events(0)
+    assert [(channel, payload) for _, channel, _, payload in events] == [
+        ("readings", [[sensor_id, [1000.0, 1001.0, 1002.0], [0.0, 1.0, 2.0]]])
+    ]
+
+    # Visto desde otro worker que ya tenía esas lecturas (las recuperó al
+    # arrancar): repasar el evento no las duplica
+    monkeypatch.setattr(shared_state, "WORKER_ID", "other-worker")
+    sync = StateSync()
+    sync.subscribe("readings", ingest._apply_remote_readings)
+    sync._cursor = 0
+    sync.poll_once()
+    assert reading_store.count(sensor_id) == 3
+
+
+def test_new_worker_rebuilds_readings_from_segments(tmp_path, monkeypatch, state_backend):
+    monkeypatch.setenv("READING_SEGMENTS_DIR", str(tmp_path))
+    monkeypatch.setenv("SEGMENT_ROWS", "100")
+    monkeypatch.setenv("SEGMENT_SEAL_LAG", "0")
+    writer = ReadingStore()
+    writer_segments = SegmentStore(writer)
+    writer_segments.load()
+    timestamps = np.arange(150, dtype=np.float64)
+    writer.extend(1, timestamps, timestamps)
+    writer_segments.seal()
+    writer.extend(1, np.array([200.0]), np.array([1.0]))
+    writer_segments.wal.flush()
+
+    # Un worker que arranca después carga los segmentos y la cola del registro
+    worker = ReadingStore()
+    SegmentStore(worker).load()
+    assert worker.count(1) == 151
+    assert worker.add_missing(1, np.array([199.0, 200.0]), np.array([1.0, 1.0])) == 1
+    assert worker.count(1) == 152
+
+
+def test_multiple_workers_default_to_segments(monkeypatch):
+    monkeypatch.delenv("READING_SEGMENTS_DIR", raising=False)
+    monkeypatch.setenv("WEB_CONCURRENCY", "2")
+    assert SegmentStore(ReadingStore()).directory == DEFAULT_MULTIWORKER_DIR
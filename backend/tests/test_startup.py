@@ -0,0 +1,37 @@
+"""
+Pruebas del coste de arranque de la aplicación.
+"""
+import json
+import os
+import subprocess
+import sys
+
+# Módulos que no deben cargarse al importar la aplicación
+HEAVY_MODULES = ("pandas", "sklearn", "prophet", "ai.backtesting")
+
+# Se registra cualquier intento de importarlos, estén instalados o no
+IMPORT_SCRIPT = """
+import json, sys
+
+attempted = []
+
+class Recorder:
+    def find_spec(self, name, path=None, target=None):
+        if name in HEAVY or name.split(".")[0] in HEAVY:
+            attempted.append(name)
+        return None
+
+HEAVY = set(json.loads(sys.argv[1]))
+sys.meta_path.insert(0, Recorder())
+import main
+print(json.dumps(sorted(set(attempted) | {name for name in HEAVY if name in sys.modules})))
+"""
+
+
+def test_importing_main_does_not_load_heavy_modules():
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, json.dumps(HEAVY_MODULES)],
+        cwd=backend, capture_output=True, text=True, check=True, timeout=120,
+    ).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == []
@@ -0,0 +1,52 @@
+"""
+Pruebas de las expresiones de los sensores virtuales.
+"""
+import numpy as np
+import pytest
+
+from utils.virtual_sensors import MAX_EXPRESSION_LENGTH, Expression
+
+
+def test_expression_evaluates_functions_and_constants():
+    expression = Expression("vpd(t, rh) + 2**3 - pi", ["t", "rh", "unused"])
+    assert expression.variables == ["t", "rh"]
+    values = expression.evaluate({"t": np.array([25.0]), "rh": np.array([60.0])})
+    assert values[0] == pytest.approx(1.2671 + 8 - np.pi, abs=1e-3)
+
+
+@pytest.mark.parametrize("source", [
+    "__import__('os')",
+    "t.real",
+    "t[0]",
+    "[t]",
+    "lambda: t",
+    "'texto'",
+    "t if t else 0",
+    "open('x')",
+    "x + 1",
+])
+def test_expression_rejects_non_whitelisted_elements(source):
+    with pytest.raises(ValueError):
+        Expression(source, ["t"])
+
+
+def test_huge_powers_are_floating_point():
+    # Con enteros de Python estas expresiones no terminarían
+    for source in ["t + 9**9**9", "t + 10**400000", "pi**pi**pi**pi**pi + t"]:
+        values = Expression(source, ["t"]).evaluate({"t": np.ones(2)})
+        assert np.isinf(values).all()
+
+
+@pytest.mark.parametrize("source", [
+    "t" + "+t" * MAX_EXPRESSION_LENGTH,
+    "-" * 150 + "t",
+    "abs(" * 30 + "t" + ")" * 30,
+])
+def test_expression_size_is_limited(source):
+    with pytest.raises(ValueError):
+        Expression(source, ["t"])
+
+
+def test_constant_prefix_is_reserved():
+    with pytest.raises(ValueError):
+        Expression("__const_0", ["__const_0"])
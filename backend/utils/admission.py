@@ -0,0 +1,393 @@
+"""
+Control de admisión para que las consultas analíticas no dejen sin CPU a la
+ingesta en la Raspberry Pi.
+
+Cada petición se clasifica en una de tres clases:
+
+- ``critical``: ingesta de lecturas, control de actuadores, replicación y
+  sondas de salud. Nunca se limitan ni esperan.
+- ``analytics``: historial, predicciones y uso de actuadores. Cada cliente
+  (por dirección IP) tiene un cubo de fichas y un máximo de peticiones
+  simultáneas; en total solo se ejecutan ``ADMISSION_ANALYTICS_CONCURRENCY``
+  a la vez (el resto espera su turno) y su cálculo se hace en un pool de
+  hilos propio, de modo que el bucle de eventos y los núcleos restantes
+  quedan libres para la ingesta.
+- ``default``: el resto (catálogos de sensores y actuadores, configuración).
+
+Las consultas de historial estiman además su coste (lecturas × sensores)
+antes de ejecutarse: las consultas en bruto demasiado grandes se pasan a un
+intervalo más grueso o se rechazan indicando cómo reducirlas, y el coste se
+cobra en fichas del cliente.
+
+Configuración (variables de entorno):
+
+- ``ADMISSION_ENABLED``: 0 para desactivar los límites (por defecto, activos)
+- ``ADMISSION_RATE`` / ``ADMISSION_BURST``: fichas por segundo y capacidad del cubo de cada cliente
+- ``ADMISSION_CLIENT_CONCURRENCY``: peticiones analíticas simultáneas por cliente
+- ``ADMISSION_ANALYTICS_CONCURRENCY``: peticiones analíticas simultáneas en total
+- ``ADMISSION_QUEUE_TIMEOUT``: segundos máximos de espera de turno
+- ``ADMISSION_MAX_ROWS``: filas máximas de una consulta de historial
+
+Los límites son por proceso: con varios workers se aplican en cada uno.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Pattern, Tuple
+
+from database.readings_store import reading_store
+
+# Clases de petición
+CRITICAL = "critical"
+ANALYTICS = "analytics"
+DEFAULT = "default"
+
+# Rutas de cada clase: (método o None para cualquiera, patrón de la ruta)
+CRITICAL_ROUTES: List[Tuple[Optional[str], Pattern]] = [
+    ("POST", re.compile(r"^/sensors/[^/]+/readings/?$")),
+    ("POST", re.compile(r"^/mycodo/readings/?$")),
+    ("POST", re.compile(r"^/actuators/[^/]+/control/?$")),
+    ("POST", re.compile(r"^/replication/segments/?$")),
+    (None, re.compile(r"^/(health|ready)/?$")),
+]
+ANALYTICS_ROUTES: List[Tuple[Optional[str], Pattern]] = [
+    (None, re.compile(r"^/history(/|$)")),
+    (None, re.compile(r"^/predictions(/|$)")),
+    ("GET", re.compile(r"^/actuators/[^/]+/(history|usage)/?$")),
+    ("POST", re.compile(r"^/auth/token/?$")),
+]
+
+# Fichas que cuesta cada petición analítica (1 si no aparece aquí)
+ROUTE_TOKENS: List[Tuple[Optional[str], Pattern, float]] = [
+    ("POST", re.compile(r"^/predictions/backtest(/jobs)?/?$"), 10.0),
+    ("POST", re.compile(r"^/predictions/?$"), 2.0),
+    # bcrypt: además limita los intentos de contraseña por cliente
+    ("POST", re.compile(r"^/auth/token/?$"), 5.0),
+]
+
+# Filas de historial que cuestan una ficha
+ROWS_PER_TOKEN = 10000
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def classify(method: str, path: str) -> str:
+    """
+    Clase de una petición según su método y su ruta.
+    """
+    for route_method, pattern in CRITICAL_ROUTES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return CRITICAL
+    for route_method, pattern in ANALYTICS_ROUTES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return ANALYTICS
+    return DEFAULT
+
+
+def route_tokens(method: str, path: str) -> float:
+    for route_method, pattern, tokens in ROUTE_TOKENS:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return tokens
+    return 1.0
+
+
+class AdmissionError(Exception):
+    """
+    Petición rechazada: ``status_code`` HTTP, mensaje y, si tiene sentido
+    reintentar, los segundos de espera recomendados.
+    """
+
+    def __init__(self, status_code: int, detail: Any, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))} if self.retry_after is not None else {}
+
+
+class ClientBucket:
+    """
+    Cubo de fichas de un cliente: solo se consumen si hay suficientes.
+    """
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, rate: float, capacity: float):
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class AdmissionController:
+    """
+    Estado de la admisión del proceso: cubos y peticiones en curso por
+    cliente, turnos de las peticiones analíticas y pool de cálculo.
+    """
+
+    # Clientes sin actividad que se olvidan al superar este número
+    MAX_CLIENTS = 10000
+
+    def __init__(self):
+        cpus = os.cpu_count() or 1
+        self.enabled = _env_flag("ADMISSION_ENABLED", True)
+        self.rate = float(os.getenv("ADMISSION_RATE", 5))
+        self.burst = float(os.getenv("ADMISSION_BURST", 30))
+        self.client_concurrency = int(os.getenv("ADMISSION_CLIENT_CONCURRENCY", 2))
+        # Se deja al menos un núcleo para la ingesta
+        self.analytics_concurrency = int(os.getenv("ADMISSION_ANALYTICS_CONCURRENCY", max(1, cpus - 1)))
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))
+        self.max_rows = int(os.getenv("ADMISSION_MAX_ROWS", 200000))
+        self._buckets: Dict[Hashable, ClientBucket] = {}
+        self._in_flight: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.critical_in_flight = 0
+        self.rejected = {"rate": 0, "concurrency": 0, "queue": 0, "cost": 0}
+
+    # Fichas y concurrencia por cliente
+    def _bucket(self, client: Hashable) -> ClientBucket:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_CLIENTS:
+                self._forget_idle()
+            bucket = self._buckets[client] = ClientBucket(self.burst)
+        bucket.refill(self.rate, self.burst)
+        return bucket
+
+    def _forget_idle(self):
+        # Un cliente con el cubo lleno y sin peticiones en curso no aporta estado
+        for client, bucket in list(self._buckets.items()):
+            bucket.refill(self.rate, self.burst)
+            if bucket.tokens >= self.burst and not self._in_flight.get(client):
+                del self._buckets[client]
+
+    def _take(self, client: Hashable, tokens: float, reason: str):
+        tokens = min(tokens, self.burst)
+        bucket = self._bucket(client)
+        if bucket.tokens < tokens:
+            self.rejected[reason] += 1
+            raise AdmissionError(
+                429,
+                "Demasiadas consultas analíticas; espera antes de reintentar",
+                retry_after=(tokens - bucket.tokens) / self.rate if self.rate > 0 else None,
+            )
+        bucket.tokens -= tokens
+
+    def charge(self, client: Hashable, tokens: float, reason: str = "cost"):
+        """
+        Consume fichas del cliente o lanza AdmissionError (429) con el tiempo
+        de espera hasta tenerlas.
+        """
+        if not self.enabled or tokens <= 0:
+            return
+        with self._lock:
+            self._take(client, tokens, reason)
+
+    def enter(self, client: Hashable, tokens: float = 1.0):
+        """
+        Admite una petición analítica del cliente: cobra sus fichas y cuenta
+        la petición en curso. Hay que llamar a ``leave`` al terminar.
+        """
+        with self._lock:
+            if self._in_flight.get(client, 0) >= self.client_concurrency:
+                self.rejected["concurrency"] += 1
+                raise AdmissionError(
+                    429,
+                    f"Como mucho {self.client_concurrency} consultas analíticas simultáneas por cliente",
+                    retry_after=1,
+                )
+            self._take(client, tokens, "rate")
+            self._in_flight[client] = self._in_flight.get(client, 0) + 1
+
+    def leave(self, client: Hashable):
+        with self._lock:
+            remaining = self._in_flight.get(client, 0) - 1
+            if remaining > 0:
+                self._in_flight[client] = remaining
+            else:
+                self._in_flight.pop(client, None)
+
+    # Turnos de las peticiones analíticas
+    async def acquire_slot(self):
+        """
+        Espera turno para ejecutar una petición analítica. Mientras haya
+        peticiones críticas en curso se les cede el bucle de eventos.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.analytics_concurrency)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected["queue"] += 1
+            raise AdmissionError(503, "Servidor ocupado con otras consultas analíticas", retry_after=self.queue_timeout)
+        deadline = time.monotonic() + 0.05
+        while self.critical_in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.001)
+
+    def release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    # Cálculo analítico fuera del bucle de eventos
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.analytics_concurrency, thread_name_prefix="analytics"
+                    )
+        return self._pool
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "clients": len(self._buckets),
+                "analytics_in_flight": sum(self._in_flight.values()),
+                "critical_in_flight": self.critical_in_flight,
+                "analytics_concurrency": self.analytics_concurrency,
+                "rejected": dict(self.rejected),
+            }
+
+
+async def run_analytics(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Ejecuta un cálculo analítico en el pool acotado de analítica.
+    """
+    return await asyncio.get_running_loop().run_in_executor(admission.pool, func, *args)
+
+
+def estimate_rows(sensor_ids: List[Hashable], start: float, end: float, step: Optional[float] = None) -> int:
+    """
+    Filas que devolvería una consulta de historial: las lecturas del rango
+    (búsqueda binaria, sin leerlas) o, agregando en cubetas de ``step``
+    segundos, como mucho una fila por cubeta.
+    """
+    buckets = math.ceil((end - start) / step) + 1 if step else None
+    rows = 0
+    for sensor_id in sensor_ids:
+        count = reading_store.count(sensor_id, start, end)
+        rows += count if buckets is None else min(count, buckets)
+    return rows
+
+
+def plan_query(
+    sensor_ids: List[Hashable],
+    start: float,
+    end: float,
+    interval: str,
+    intervals: Dict[str, int],
+    allow_promotion: bool = True,
+) -> Tuple[str, int]:
+    """
+    Elige el intervalo de una consulta de historial: el pedido si su coste
+    cabe en el límite y, si no, el más fino de los más gruesos que quepa.
+    Devuelve ``(intervalo, filas estimadas)`` o lanza AdmissionError (413).
+    """
+    rows = estimate_rows(sensor_ids, start, end, intervals.get(interval))
+    if not admission.enabled or rows <= admission.max_rows:
+        return interval, rows
+    if allow_promotion:
+        current = intervals.get(interval, 0)
+        for name, step in sorted(intervals.items(), key=lambda item: item[1]):
+            if step <= current:
+                continue
+            promoted_rows = estimate_rows(sensor_ids, start, end, step)
+            if promoted_rows <= admission.max_rows:
+                return name, promoted_rows
+    admission.rejected["cost"] += 1
+    per_sensor = max(1, rows // max(1, len(sensor_ids)))
+    raise AdmissionError(413, {
+        "message": "La consulta es demasiado grande",
+        "estimated_rows": rows,
+        "max_rows": admission.max_rows,
+        "suggestion": (
+            "Usa un intervalo más grueso, un rango de fechas más corto o menos sensores "
+            f"(unas {per_sensor} filas por sensor; caben {max(1, admission.max_rows // per_sensor)} sensores)"
+        ),
+    })
+
+
+def client_id(scope: Dict[str, Any]) -> str:
+    """
+    Identificador del cliente de una petición: el usuario o la clave de API
+    autenticados si los hay, y si no su dirección IP.
+    """
+    principal = scope.get("state", {}).get("principal")
+    if principal:
+        return f"{principal['kind']}:{principal['sub']}"
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI que aplica la admisión a cada petición HTTP.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not admission.enabled:
+            await self.app(scope, receive, send)
+            return
+        method, path = scope["method"], scope["path"]
+        kind = classify(method, path)
+        if kind == CRITICAL:
+            admission.critical_in_flight += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                admission.critical_in_flight -= 1
+            return
+        if kind != ANALYTICS:
+            await self.app(scope, receive, send)
+            return
+
+        client = client_id(scope)
+        try:
+            admission.enter(client, route_tokens(method, path))
+        except AdmissionError as exc:
+            await _reject(send, exc)
+            return
+        try:
+            try:
+                await admission.acquire_slot()
+            except AdmissionError as exc:
+                await _reject(send, exc)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                admission.release_slot()
+        finally:
+            admission.leave(client)
+
+
+async def _reject(send, error: AdmissionError):
+    body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    headers += [(key.lower().encode(), value.encode()) for key, value in error.headers().items()]
+    await send({"type": "http.response.start", "status": error.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# Control de admisión del proceso
+admission = AdmissionController()
@@ -0,0 +1,365 @@
+"""
+Autenticación de la API: usuarios con contraseña (bcrypt) y tokens JWT, y
+claves de API para clientes máquina como la ingesta de Mycodo.
+
+En una Raspberry Pi bcrypt tarda del orden de un cuarto de segundo por
+contraseña, así que el hash y la verificación se hacen en un pool de hilos
+acotado y nunca en el bucle de eventos. Los tokens JWT validados se guardan en
+una caché LRU pequeña con su caducidad: las peticiones siguientes con el mismo
+token no vuelven a comprobar la firma. Las claves de API son aleatorias y se
+guardan como su SHA-256, de modo que validarlas cuesta un hash rápido (y
+normalmente ni eso, porque también se cachean); al revocar una clave se avisa
+a los demás workers para que la olviden.
+
+Configuración (variables de entorno):
+
+- ``AUTH_ENABLED``: 1 para exigir autenticación (por defecto, desactivada)
+- ``SECRET_KEY``: clave para firmar los JWT (la misma en todos los workers)
+- ``ACCESS_TOKEN_EXPIRE_MINUTES``: validez de los tokens (60 por defecto)
+- ``AUTH_ADMIN_USER`` / ``AUTH_ADMIN_PASSWORD``: administrador inicial
+- ``AUTH_HASH_WORKERS``: hilos para bcrypt (2 por defecto)
+- ``AUTH_BCRYPT_ROUNDS``: coste de bcrypt (12 por defecto)
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from database.shared_state import get_state_backend, state_sync
+
+logger = logging.getLogger(__name__)
+
+# Espacios de nombres del estado compartido y canal de invalidación entre workers
+USERS_NAMESPACE = "users"
+API_KEYS_NAMESPACE = "api_keys"
+AUTH_CHANNEL = "auth"
+
+# Roles: los administradores gestionan usuarios y claves; las claves de
+# ingesta solo pueden usar las rutas de ingesta y control
+ADMIN_ROLE = "admin"
+USER_ROLE = "user"
+INGEST_ROLE = "ingest"
+ROLES = (ADMIN_ROLE, USER_ROLE, INGEST_ROLE)
+
+JWT_ALGORITHM = "HS256"
+
+# Rutas accesibles sin autenticación
+PUBLIC_PATHS = ("/", "/health", "/ready", "/docs", "/redoc", "/openapi.json", "/auth/token")
+PUBLIC_PREFIXES = ("/docs/",)
+
+# Rutas del servidor central que usan su propio token (REPLICATION_TOKEN). Sin
+# ese token exigen las credenciales normales: los segmentos crean sensores,
+# actuadores y comandos
+REPLICATION_PREFIXES = ("/replication/segments", "/replication/nodes", "/replication/sensors/")
+
+# Tamaño de las cachés de credenciales validadas y tiempo máximo que una
+# entrada sigue siendo válida sin volver a consultarla
+CACHE_SIZE = 1024
+CACHE_TTL = 300.0
+
+# Prefijo de las claves de API (facilita reconocerlas en logs y ficheros)
+API_KEY_PREFIX = "jf"
+
+
+def auth_enabled() -> bool:
+    return os.getenv("AUTH_ENABLED", "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+def is_public(path: str) -> bool:
+    if path in PUBLIC_PATHS or path.startswith(PUBLIC_PREFIXES):
+        return True
+    return path.startswith(REPLICATION_PREFIXES) and bool(os.getenv("REPLICATION_TOKEN"))
+
+
+class TTLCache:
+    """
+    Caché LRU con caducidad por entrada.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class AuthService:
+    """
+    Usuarios, contraseñas, tokens y claves de API del proceso.
+    """
+
+    def __init__(self):
+        self.secret_key = os.getenv("SECRET_KEY")
+        if not self.secret_key:
+            # Sin clave compartida cada proceso firma con la suya: los tokens
+            # no sirven entre workers ni tras reiniciar
+            self.secret_key = secrets.token_urlsafe(32)
+            if auth_enabled():
+                logger.warning("SECRET_KEY no está definido: se usa una clave aleatoria para firmar los tokens")
+        self.token_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+        self.rounds = int(os.getenv("AUTH_BCRYPT_ROUNDS", 12))
+        self._hash_workers = int(os.getenv("AUTH_HASH_WORKERS", 2))
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._dummy_hash: Optional[bytes] = None
+        self.tokens = TTLCache()
+        self.api_keys = TTLCache()
+
+    # Contraseñas (bcrypt en el pool acotado)
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._hash_workers, thread_name_prefix="auth-hash")
+        return self._pool
+
+    @staticmethod
+    def _encode(password: str) -> bytes:
+        # bcrypt solo usa los primeros 72 bytes
+        return password.encode("utf-8")[:72]
+
+    def hash_password_sync(self, password: str) -> str:
+        import bcrypt
+
+        return bcrypt.hashpw(self._encode(password), bcrypt.gensalt(self.rounds)).decode("ascii")
+
+    def verify_password_sync(self, password: str, password_hash: Optional[str]) -> bool:
+        import bcrypt
+
+        if password_hash is None:
+            # Usuario inexistente: verificar igualmente para no revelarlo por el tiempo de respuesta
+            if self._dummy_hash is None:
+                self._dummy_hash = bcrypt.hashpw(b"", bcrypt.gensalt(self.rounds))
+            bcrypt.checkpw(self._encode(password), self._dummy_hash)
+            return False
+        return bcrypt.checkpw(self._encode(password), password_hash.encode("ascii"))
+
+    async def hash_password(self, password: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self.hash_password_sync, password)
+
+    async def verify_password(self, password: str, password_hash: Optional[str]) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, self.verify_password_sync, password, password_hash
+        )
+
+    # Usuarios
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return get_state_backend().get(USERS_NAMESPACE, username)
+
+    def all_users(self) -> List[Dict[str, Any]]:
+        return get_state_backend().all(USERS_NAMESPACE)
+
+    def save_user(self, username: str, password_hash: str, role: str = USER_ROLE, disabled: bool = False) -> Dict[str, Any]:
+        record = {
+            "username": username,
+            "password_hash": password_hash,
+            "role": role,
+            "disabled": disabled,
+            "created_at": datetime.now(),
+        }
+        get_state_backend().put(USERS_NAMESPACE, username, record)
+        return record
+
+    def ensure_admin(self):
+        """
+        Crea el administrador inicial de ``AUTH_ADMIN_USER`` si aún no existe.
+        """
+        username, password = os.getenv("AUTH_ADMIN_USER"), os.getenv("AUTH_ADMIN_PASSWORD")
+        if username and password and self.get_user(username) is None:
+            self.save_user(username, self.hash_password_sync(password), ADMIN_ROLE)
+
+    async def authenticate_user(self, username: str, password: str) -> Optional[Dict[str, Any]]:
+        user = self.get_user(username)
+        valid = await self.verify_password(password, user["password_hash"] if user else None)
+        if not valid or user.get("disabled"):
+            return None
+        return user
+
+    # Tokens JWT
+    def create_access_token(self, user: Dict[str, Any]) -> Tuple[str, int]:
+        """
+        Token firmado para un usuario; devuelve el token y sus segundos de validez.
+        """
+        from jose import jwt
+
+        now = int(time.time())
+        expires_in = self.token_minutes * 60
+        claims = {"sub": user["username"], "role": user["role"], "iat": now, "exp": now + expires_in}
+        return jwt.encode(claims, self.secret_key, algorithm=JWT_ALGORITHM), expires_in
+
+    def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Principal de un token JWT válido, o None. Los tokens ya validados se
+        sirven desde la caché hasta su caducidad (o ``CACHE_TTL`` segundos).
+        """
+        principal = self.tokens.get(token)
+        if principal is not None:
+            return principal
+        from jose import JWTError, jwt
+
+        try:
+            claims = jwt.decode(token, self.secret_key, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            return None
+        if claims.get("role") not in ROLES or not claims.get("sub"):
+            return None
+        principal = {"kind": "user", "sub": claims["sub"], "role": claims["role"]}
+        self.tokens.put(token, principal, min(float(claims["exp"]), time.time() + CACHE_TTL))
+        return principal
+
+    # Claves de API
+    @staticmethod
+    def _key_hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def create_api_key(self, name: str, role: str = INGEST_ROLE) -> Tuple[str, Dict[str, Any]]:
+        """
+        Genera una clave nueva. La clave en claro solo se devuelve aquí; se
+        guarda su SHA-256.
+        """
+        key_id = secrets.token_hex(4)
+        key = f"{API_KEY_PREFIX}_{key_id}_{secrets.token_urlsafe(24)}"
+        record = {
+            "id": key_id,
+            "name": name,
+            "role": role,
+            "key_hash": self._key_hash(key),
+            "revoked": False,
+            "created_at": datetime.now(),
+        }
+        get_state_backend().put(API_KEYS_NAMESPACE, key_id, record)
+        return key, record
+
+    def all_api_keys(self) -> List[Dict[str, Any]]:
+        return get_state_backend().all(API_KEYS_NAMESPACE)
+
+    def revoke_api_key(self, key_id: str) -> Optional[Dict[str, Any]]:
+        backend = get_state_backend()
+        record = backend.patch(API_KEYS_NAMESPACE, key_id, {"revoked": True})
+        if record is not None:
+            self.api_keys.clear()
+            backend.publish(AUTH_CHANNEL, {"revoked_key": key_id})
+        return record
+
+    def verify_api_key(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Principal de una clave de API válida, o None.
+        """
+        principal = self.api_keys.get(key)
+        if principal is not None:
+            return principal
+        parts = key.split("_", 2)
+        if len(parts) != 3 or parts[0] != API_KEY_PREFIX:
+            return None
+        record = get_state_backend().get(API_KEYS_NAMESPACE, parts[1])
+        if record is None or record.get("revoked") or not hmac.compare_digest(record["key_hash"], self._key_hash(key)):
+            return None
+        principal = {"kind": "api_key", "sub": record["name"], "role": record["role"], "key_id": record["id"]}
+        self.api_keys.put(key, principal, time.time() + CACHE_TTL)
+        return principal
+
+    def authenticate_headers(self, headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """
+        Principal de una petición a partir de ``Authorization: Bearer`` o ``X-API-Key``.
+        """
+        api_key = headers.get("x-api-key")
+        if api_key:
+            return self.verify_api_key(api_key)
+        authorization = headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token:
+            # Se aceptan también claves de API como token Bearer
+            if token.startswith(API_KEY_PREFIX + "_"):
+                return self.verify_api_key(token)
+            return self.verify_token(token)
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        return {"enabled": auth_enabled(), "token_cache": self.tokens.stats(), "api_key_cache": self.api_keys.stats()}
+
+
+class AuthMiddleware:
+    """
+    Middleware ASGI que exige credenciales en todas las rutas no públicas
+    cuando ``AUTH_ENABLED`` está activo y guarda el principal en
+    ``request.state.principal``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = auth_enabled()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled or is_public(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        principal = auth_service.authenticate_headers(headers)
+        if principal is None:
+            await _deny(send, 401, "No autenticado", {"www-authenticate": "Bearer"})
+            return
+        if principal["role"] == INGEST_ROLE:
+            # Las claves de ingesta solo sirven para la ingesta y el control
+            from utils.admission import CRITICAL, classify
+
+            if classify(scope["method"], scope["path"]) != CRITICAL and scope["path"] != "/auth/me":
+                await _deny(send, 403, "La clave de API no permite esta operación")
+                return
+        scope.setdefault("state", {})["principal"] = principal
+        await self.app(scope, receive, send)
+
+
+async def _deny(send, status_code: int, detail: str, extra_headers: Optional[Dict[str, str]] = None):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    headers += [(key.encode(), value.encode()) for key, value in (extra_headers or {}).items()]
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _invalidate_remote(payload: Dict[str, Any]):
+    auth_service.api_keys.clear()
+
+
+# Servicio de autenticación del proceso
+auth_service = AuthService()
+
+state_sync.subscribe(AUTH_CHANNEL, _invalidate_remote)
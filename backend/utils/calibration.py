@@ -0,0 +1,314 @@
+"""
+Calibración y compensación por temperatura de las lecturas Atlas Scientific.
+
+Las lecturas de Mycodo pasan por esta etapa antes de guardarse:
+
+1. Calibración de cada sonda: ``valor * slope + offset``.
+2. Compensación por temperatura con la sonda RTD emparejada:
+
+   - EC: referida a 25 °C con un coeficiente lineal (2 %/°C por defecto),
+     ``EC25 = EC / (1 + α (T - 25))``
+   - pH: corrección de la pendiente de Nernst respecto al punto isopotencial
+     (pH 7), ``pH = 7 + (pH_25 - 7) * 298.15 / (T + 273.15)``
+
+   - DO: el circuito EZO-DO convierte la saturación medida en mg/L con la
+     solubilidad del oxígeno a la temperatura que tiene configurada (20 °C
+     si no se le envía con el comando ``T``). Se corrige con la solubilidad a
+     la temperatura real, ``DO = DO_ref * (Cs(T) / Cs(T_ref)) ** k``, donde
+     ``Cs`` es la ecuación de Benson y Krause para agua dulce a 1 atm y ``k``
+     el coeficiente de la sonda: 1 por defecto y 0 si Mycodo ya envía la
+     temperatura al circuito.
+
+Los coeficientes de cada sonda se precalculan y se cachean; el lote completo
+se corrige con NumPy y cada lectura se une con la lectura de temperatura más
+cercana en el tiempo mediante búsqueda binaria vectorizada.
+"""
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from database.readings_store import reading_store
+from database.shared_state import get_state_backend, state_sync
+
+# Espacio de nombres del estado compartido y canal de invalidación entre workers
+CALIBRATION_NAMESPACE = "calibration"
+CALIBRATION_CHANNEL = "calibration"
+
+# Tipo de las sondas de temperatura
+TEMPERATURE_TYPE = "rtd"
+
+# Diferencia máxima (segundos) entre una lectura y la temperatura usada para compensarla
+MAX_TEMPERATURE_GAP = 15 * 60
+
+# Temperatura de referencia de las sondas
+REFERENCE_TEMPERATURE = 25.0
+
+# Temperatura de referencia de los tipos que no usan 25 °C: la de
+# compensación por defecto del circuito EZO-DO
+TYPE_REFERENCE_TEMPERATURE: Dict[str, float] = {
+    "do": 20.0,
+}
+
+# Modos de compensación
+NO_COMPENSATION = 0
+LINEAR_COMPENSATION = 1
+NERNST_COMPENSATION = 2
+SATURATION_COMPENSATION = 3
+
+# Compensación por tipo de sensor: (modo, coeficiente de temperatura por °C,
+# o exponente de la corrección de solubilidad en el caso del DO)
+TYPE_COMPENSATION: Dict[str, Tuple[int, float]] = {
+    "ec": (LINEAR_COMPENSATION, 0.02),
+    "ph": (NERNST_COMPENSATION, 0.0),
+    "do": (SATURATION_COMPENSATION, 1.0),
+}
+
+# Punto isopotencial del pH y cero absoluto en °C
+PH_ISOPOTENTIAL = 7.0
+KELVIN_OFFSET = 273.15
+
+# Coeficientes de ln Cs (mg/L) en potencias de 1/T (K) para agua dulce a
+# 1 atm (Benson y Krause, 1984; APHA Standard Methods 4500-O)
+OXYGEN_SOLUBILITY = (-139.34411, 1.575701e5, -6.642308e7, 1.243800e10, -8.621949e11)
+
+Coefficients = Tuple[float, float, int, float, float]
+
+ReadingArrays = Dict[Hashable, Tuple[np.ndarray, np.ndarray]]
+
+
+def default_calibration(sensor_type: str) -> Dict[str, Any]:
+    """
+    Calibración de una sonda sin configuración propia.
+    """
+    return {
+        "slope": 1.0,
+        "offset": 0.0,
+        "temperature_sensor": None,
+        "temperature_coefficient": TYPE_COMPENSATION.get(sensor_type, (NO_COMPENSATION, 0.0))[1],
+        "reference_temperature": TYPE_REFERENCE_TEMPERATURE.get(sensor_type, REFERENCE_TEMPERATURE),
+    }
+
+
+def oxygen_solubility(temperature: np.ndarray) -> np.ndarray:
+    """
+    Oxígeno disuelto en saturación (mg/L) en agua dulce a 1 atm para cada
+    temperatura en °C.
+    """
+    inverse = 1.0 / (np.asarray(temperature, dtype=np.float64) + KELVIN_OFFSET)
+    return np.exp(np.polyval(OXYGEN_SOLUBILITY[::-1], inverse))
+
+
+class CalibrationTable:
+    """
+    Coeficientes precalculados por sonda a partir de la configuración guardada
+    en el estado compartido.
+    """
+
+    def __init__(self):
+        self._coefficients: Dict[Tuple[Hashable, str], Coefficients] = {}
+        self._pairs: Dict[Hashable, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def get_config(self, sensor_id: Hashable) -> Optional[Dict[str, Any]]:
+        return get_state_backend().get(CALIBRATION_NAMESPACE, str(sensor_id))
+
+    def all_configs(self) -> List[Dict[str, Any]]:
+        return get_state_backend().all(CALIBRATION_NAMESPACE)
+
+    def set_config(self, sensor_id: Hashable, config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Guarda la calibración de una sonda y la propaga a los demás workers.
+        """
+        record = {"sensor_id": str(sensor_id), **config}
+        backend = get_state_backend()
+        backend.put(CALIBRATION_NAMESPACE, str(sensor_id), record)
+        backend.publish(CALIBRATION_CHANNEL, str(sensor_id))
+        self.invalidate()
+        return record
+
+    def invalidate(self):
+        """
+        Descarta los coeficientes precalculados (las calibraciones cambian rara vez).
+        """
+        with self._lock:
+            self._coefficients.clear()
+            self._pairs.clear()
+
+    def _load(self, sensor_id: Hashable, sensor_type: str) -> Tuple[Coefficients, Optional[str]]:
+        config = {**default_calibration(sensor_type), **(self.get_config(sensor_id) or {})}
+        mode = TYPE_COMPENSATION.get(sensor_type, (NO_COMPENSATION, 0.0))[0]
+        defaults = default_calibration(sensor_type)
+        coefficient = config["temperature_coefficient"]
+        if coefficient is None:
+            coefficient = defaults["temperature_coefficient"]
+        reference = config["reference_temperature"]
+        if reference is None:
+            reference = defaults["reference_temperature"]
+        coefficients = (
+            float(config["slope"]), float(config["offset"]), mode,
+            float(coefficient), float(reference),
+        )
+        return coefficients, config["temperature_sensor"]
+
+    def coefficients(self, sensor_id: Hashable, sensor_type: str) -> Tuple[Coefficients, Optional[str]]:
+        """
+        Coeficientes ``(slope, offset, modo, coeficiente, T_ref)`` de una sonda
+        y su sonda de temperatura configurada.
+        """
+        key = (sensor_id, sensor_type)
+        with self._lock:
+            if key in self._coefficients:
+                return self._coefficients[key], self._pairs.get(sensor_id)
+        coefficients, pair = self._load(sensor_id, sensor_type)
+        with self._lock:
+            self._coefficients[key] = coefficients
+            self._pairs[sensor_id] = pair
+        return coefficients, pair
+
+
+def nearest_temperature(
+    timestamps: np.ndarray,
+    temperature_timestamps: np.ndarray,
+    temperatures: np.ndarray,
+    max_gap: float = MAX_TEMPERATURE_GAP,
+) -> np.ndarray:
+    """
+    Temperatura más cercana en el tiempo a cada marca de ``timestamps`` (NaN si
+    la más cercana está a más de ``max_gap`` segundos). Las temperaturas deben
+    estar ordenadas por tiempo.
+    """
+    result = np.full(timestamps.size, np.nan)
+    if temperature_timestamps.size == 0 or timestamps.size == 0:
+        return result
+    if temperature_timestamps.size == 1:
+        nearest = np.zeros(timestamps.size, dtype=np.intp)
+    else:
+        right = np.clip(np.searchsorted(temperature_timestamps, timestamps), 1, temperature_timestamps.size - 1)
+        left = right - 1
+        use_left = timestamps - temperature_timestamps[left] <= temperature_timestamps[right] - timestamps
+        nearest = np.where(use_left, left, right)
+    close = np.abs(temperature_timestamps[nearest] - timestamps) <= max_gap
+    result[close] = temperatures[nearest[close]]
+    return result
+
+
+def _temperature_series(
+    sensor_id: Hashable,
+    batch: ReadingArrays,
+    start: float,
+    end: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Temperaturas de una sonda RTD en ``[start, end]``: las ya guardadas más las
+    que llegan en el mismo lote (ya calibradas).
+    """
+    stored_timestamps, stored_values = reading_store.range(sensor_id, start, end)
+    if sensor_id not in batch:
+        return stored_timestamps, stored_values
+    batch_timestamps, batch_values = batch[sensor_id]
+    timestamps = np.concatenate((stored_timestamps, batch_timestamps))
+    values = np.concatenate((stored_values, batch_values))
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], values[order]
+
+
+def calibrate_batch(
+    batch: Dict[Hashable, Tuple[List[float], List[float]]],
+    sensor_types: Dict[Hashable, str],
+    locations: Optional[Dict[Hashable, Optional[str]]] = None,
+) -> Tuple[ReadingArrays, int]:
+    """
+    Calibra y compensa un lote de lecturas agrupado por sensor.
+
+    ``sensor_types`` indica el tipo Atlas de cada sensor y ``locations`` su
+    ubicación: las sondas sin sonda de temperatura configurada se emparejan
+    con la sonda RTD del lote en la misma ubicación. Devuelve las lecturas
+    corregidas y el número de lecturas compensadas por temperatura.
+    """
+    locations = locations or {}
+    sensor_ids = list(batch)
+    if not sensor_ids:
+        return {}, 0
+
+    # Aplanar el lote: un índice de sensor por lectura
+    sizes = np.array([len(batch[sensor_id][0]) for sensor_id in sensor_ids], dtype=np.intp)
+    codes = np.repeat(np.arange(len(sensor_ids)), sizes)
+    timestamps = np.concatenate([np.asarray(batch[sensor_id][0], dtype=np.float64) for sensor_id in sensor_ids])
+    values = np.concatenate([np.asarray(batch[sensor_id][1], dtype=np.float64) for sensor_id in sensor_ids])
+
+    # Tabla de coeficientes de los sensores del lote
+    table = np.empty((len(sensor_ids), 5), dtype=np.float64)
+    pairs: List[Optional[Hashable]] = []
+    rtd_by_location = {
+        locations.get(sensor_id): sensor_id
+        for sensor_id in sensor_ids
+        if sensor_types.get(sensor_id) == TEMPERATURE_TYPE and locations.get(sensor_id)
+    }
+    for index, sensor_id in enumerate(sensor_ids):
+        sensor_type = sensor_types.get(sensor_id, "")
+        coefficients, pair = calibration_table.coefficients(sensor_id, sensor_type)
+        table[index] = coefficients
+        if coefficients[2] != NO_COMPENSATION and pair is None:
+            pair = rtd_by_location.get(locations.get(sensor_id))
+        pairs.append(pair if coefficients[2] != NO_COMPENSATION else None)
+
+    # 1. Calibración de todas las lecturas a la vez
+    values = values * table[codes, 0] + table[codes, 1]
+
+    # Lecturas calibradas por sensor (las RTD se usan después para compensar)
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    calibrated: ReadingArrays = {
+        sensor_id: (timestamps[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]])
+        for i, sensor_id in enumerate(sensor_ids)
+    }
+
+    # 2. Temperatura de cada lectura, uniendo por tiempo con su sonda RTD
+    temperature = np.full(values.size, np.nan)
+    paired_sensors: Dict[Hashable, List[int]] = {}
+    for index, pair in enumerate(pairs):
+        if pair is not None:
+            paired_sensors.setdefault(pair, []).append(index)
+    for pair, indices in paired_sensors.items():
+        mask = np.isin(codes, indices)
+        reading_timestamps = timestamps[mask]
+        temperature_timestamps, temperatures = _temperature_series(
+            pair, calibrated,
+            float(reading_timestamps.min()) - MAX_TEMPERATURE_GAP,
+            float(reading_timestamps.max()) + MAX_TEMPERATURE_GAP,
+        )
+        temperature[mask] = nearest_temperature(reading_timestamps, temperature_timestamps, temperatures)
+
+    # 3. Compensación vectorizada según el modo de cada sensor
+    modes = table[codes, 2]
+    compensable = ~np.isnan(temperature)
+    delta = np.where(compensable, temperature - table[codes, 4], 0.0)
+    linear = compensable & (modes == LINEAR_COMPENSATION)
+    nernst = compensable & (modes == NERNST_COMPENSATION)
+    values = np.where(linear, values / (1 + table[codes, 3] * delta), values)
+    kelvin = np.where(nernst, temperature + KELVIN_OFFSET, 1.0)
+    values = np.where(
+        nernst,
+        PH_ISOPOTENTIAL + (values - PH_ISOPOTENTIAL) * (table[codes, 4] + KELVIN_OFFSET) / kelvin,
+        values,
+    )
+    saturation = compensable & (modes == SATURATION_COMPENSATION)
+    if saturation.any():
+        ratio = oxygen_solubility(temperature[saturation]) / oxygen_solubility(table[codes[saturation], 4])
+        values[saturation] *= ratio ** table[codes[saturation], 3]
+
+    result = {
+        sensor_id: (timestamps[bounds[i]:bounds[i + 1]], values[bounds[i]:bounds[i + 1]])
+        for i, sensor_id in enumerate(sensor_ids)
+    }
+    return result, int(np.count_nonzero(linear | nernst | saturation))
+
+
+def _invalidate_remote(sensor_id: str):
+    calibration_table.invalidate()
+
+
+# Coeficientes compartidos por todas las rutas del proceso
+calibration_table = CalibrationTable()
+
+state_sync.subscribe(CALIBRATION_CHANNEL, _invalidate_remote)
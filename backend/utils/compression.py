@@ -0,0 +1,318 @@
+"""
+Compresión de las respuestas negociada con ``Accept-Encoding``.
+
+Las respuestas de historial y predicciones son JSON grandes y repetitivos que
+viajan al frontend y a paneles remotos por enlaces lentos. El middleware
+comprime con zstd, brotli o gzip (los dos primeros solo si ``zstandard`` o
+``brotli`` están instalados) según lo que acepte el cliente, y solo cuando
+la respuesta supera ``COMPRESSION_MIN_SIZE`` bytes. Los cuerpos grandes se
+comprimen en un pool de hilos propio para no bloquear el bucle de eventos.
+
+Las respuestas de las rutas cacheables (``CACHEABLE_ROUTES``) llevan un
+``ETag`` calculado sobre el cuerpo sin comprimir y con la codificación como
+sufijo (``"<hash>-gzip"``), porque cada codificación es una representación
+distinta: un ``If-None-Match`` que coincide con la que se enviaría recibe 304
+sin cuerpo. Los bytes comprimidos se guardan en una caché LRU por hash y
+codificación, así que repetir una consulta no vuelve a comprimirla.
+
+Configuración (variables de entorno):
+
+- ``COMPRESSION_ENABLED``: 0 para desactivarla
+- ``COMPRESSION_MIN_SIZE``: tamaño mínimo a comprimir (1024 bytes)
+- ``COMPRESSION_OFFLOAD_SIZE``: a partir de aquí se comprime en el pool (64 KiB)
+- ``COMPRESSION_WORKERS``: hilos del pool (2)
+- ``COMPRESSION_CACHE_MB``: tamaño de la caché de respuestas comprimidas (32 MB)
+"""
+import asyncio
+import gzip
+import hashlib
+import importlib.util
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# Niveles de compresión: equilibrio entre tamaño y CPU de una Raspberry Pi
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# Tipos de contenido que merece la pena comprimir
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+# Rutas cuyas respuestas llevan ETag y se guardan comprimidas
+CACHEABLE_ROUTES: List[Tuple[Optional[str], Pattern]] = [
+    (None, re.compile(r"^/history(/|$)")),
+    ("GET", re.compile(r"^/predictions(/|$)")),
+    ("GET", re.compile(r"^/locations(/|$)")),
+]
+
+
+def _gzip(data: bytes) -> bytes:
+    # mtime=0: la misma entrada produce los mismos bytes
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _brotli(data: bytes) -> bytes:
+    import brotli
+
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+def _zstd(data: bytes) -> bytes:
+    import zstandard
+
+    # Los compresores de zstandard no se pueden compartir entre hilos
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def available_encodings() -> Dict[str, Callable[[bytes], bytes]]:
+    """
+    Codificaciones con sus dependencias instaladas, en orden de preferencia.
+    """
+    encodings = {}
+    if importlib.util.find_spec("zstandard") is not None:
+        encodings["zstd"] = _zstd
+    if importlib.util.find_spec("brotli") is not None:
+        encodings["br"] = _brotli
+    encodings["gzip"] = _gzip
+    return encodings
+
+
+def negotiate(accept_encoding: str, encodings: Dict[str, Callable[[bytes], bytes]]) -> Optional[str]:
+    """
+    Codificación con mayor ``q`` de las que acepta el cliente; a igualdad, la
+    preferida por el servidor. None si no acepta ninguna.
+    """
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def is_cacheable(method: str, path: str) -> bool:
+    for route_method, pattern in CACHEABLE_ROUTES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return True
+    return False
+
+
+def representation_etag(digest: str, encoding: Optional[str]) -> str:
+    """
+    ETag de la representación con la codificación ``encoding`` (None sin comprimir).
+    """
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+class CompressedCache:
+    """
+    Caché LRU de cuerpos comprimidos por ``(hash, codificación)``, limitada
+    por el total de bytes guardados.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: Tuple[str, str], body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+class ResponseCompressor:
+    """
+    Configuración, pool, caché y estadísticas de la compresión del proceso.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("COMPRESSION_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+        self.min_size = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+        self.offload_size = int(os.getenv("COMPRESSION_OFFLOAD_SIZE", 64 * 1024))
+        self.workers = int(os.getenv("COMPRESSION_WORKERS", 2))
+        self.encodings = available_encodings()
+        self.cache = CompressedCache(int(float(os.getenv("COMPRESSION_CACHE_MB", 32)) * 1024 * 1024))
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"compressed": 0, "offloaded": 0, "not_modified": 0, "bytes_in": 0, "bytes_out": 0}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compression")
+        return self._pool
+
+    async def compress(self, body: bytes, encoding: str, digest: Optional[str]) -> bytes:
+        """
+        Cuerpo comprimido, desde la caché si la respuesta tiene ETag (``digest``
+        es el hash del cuerpo sin comprimir).
+        """
+        if digest is not None:
+            cached = self.cache.get((digest, encoding))
+            if cached is not None:
+                return cached
+        compress = self.encodings[encoding]
+        if len(body) >= self.offload_size:
+            compressed = await asyncio.get_running_loop().run_in_executor(self.pool, compress, body)
+            self.stats["offloaded"] += 1
+        else:
+            compressed = compress(body)
+        if digest is not None:
+            self.cache.put((digest, encoding), compressed)
+        return compressed
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "encodings": list(self.encodings),
+            **self.stats,
+            "cache": self.cache.stats(),
+        }
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI que añade ETag a las rutas cacheables y comprime las
+    respuestas de un solo bloque (las respuestas en streaming pasan sin tocar).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not response_compressor.enabled:
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encoding = negotiate(request_headers.get("accept-encoding", ""), response_compressor.encodings)
+        cacheable = is_cacheable(scope["method"], scope["path"])
+        if encoding is None and not cacheable:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, streaming
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if streaming:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                # Respuesta en streaming: se envía tal cual
+                streaming = True
+                MutableHeaders(scope=start_message).add_vary_header("Accept-Encoding")
+                await send(start_message)
+                await send(message)
+                return
+            await self._finish(start_message, message.get("body", b""), encoding, cacheable, request_headers, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _finish(self, start_message, body: bytes, encoding: Optional[str], cacheable: bool, request_headers: Headers, send):
+        headers = MutableHeaders(scope=start_message)
+        compressible = (
+            start_message["status"] == 200
+            and "content-encoding" not in headers
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+        )
+        if not compressible:
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        if encoding is not None and len(body) < response_compressor.min_size:
+            encoding = None
+        digest = None
+        if cacheable:
+            digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+            etag = representation_etag(digest, encoding)
+            headers["etag"] = etag
+            if_none_match = request_headers.get("if-none-match")
+            if if_none_match and _etag_matches(if_none_match, etag):
+                response_compressor.stats["not_modified"] += 1
+                del headers["content-length"]
+                headers.add_vary_header("Accept-Encoding")
+                start_message["status"] = 304
+                await send(start_message)
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        headers.add_vary_header("Accept-Encoding")
+        if encoding is not None:
+            compressed = await response_compressor.compress(body, encoding, digest)
+            if len(compressed) < len(body):
+                response_compressor.stats["compressed"] += 1
+                response_compressor.stats["bytes_in"] += len(body)
+                response_compressor.stats["bytes_out"] += len(compressed)
+                headers["content-encoding"] = encoding
+                body = compressed
+            elif digest is not None:
+                # Comprimida no ocupa menos: se envía sin comprimir, con su ETag
+                headers["etag"] = representation_etag(digest, None)
+        headers["content-length"] = str(len(body))
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
+
+
+# Compresión de las respuestas del proceso
+response_compressor = ResponseCompressor()
@@ -0,0 +1,109 @@
+"""
+Ingesta de lecturas de sensores.
+
+Todas las rutas que reciben lecturas pasan por ``ingest_readings``, que las
+guarda en el almacén del proceso, las publica para que el resto de workers
+actualicen su copia y, si el nodo replica a un servidor central, las añade al
+registro de replicación.
+
+Con varios workers las lecturas se acumulan y se publican en un único evento
+por ciclo de sincronización, no en uno por petición.
+"""
+import threading
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+import numpy as np
+
+from database.readings_store import reading_store
+from database.shared_state import get_state_backend, state_sync
+from utils.replication import replication_shipper
+
+# Canal de publicación de lecturas entre workers
+READINGS_CHANNEL = "readings"
+
+# Lecturas acumuladas a partir de las cuales se publican sin esperar al ciclo
+MAX_PENDING_READINGS = 10000
+
+ReadingBatch = Dict[Hashable, Tuple[List[float], List[float]]]
+
+_pending: ReadingBatch = {}
+_pending_count = 0
+_pending_lock = threading.Lock()
+
+
+def group_readings(readings: Iterable[Tuple[Hashable, float, float]]) -> ReadingBatch:
+    """
+    Agrupa lecturas ``(sensor_id, timestamp, value)`` por sensor.
+    """
+    batch: ReadingBatch = {}
+    for sensor_id, timestamp, value in readings:
+        timestamps, values = batch.setdefault(sensor_id, ([], []))
+        timestamps.append(timestamp)
+        values.append(value)
+    return batch
+
+
+def _store(batch: ReadingBatch, only_missing: bool = False) -> int:
+    count = 0
+    for sensor_id, (timestamps, values) in batch.items():
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if only_missing:
+            count += reading_store.add_missing(sensor_id, timestamps, values)
+        else:
+            reading_store.extend(sensor_id, timestamps, values)
+            count += timestamps.size
+    return count
+
+
+def ingest_readings(batch: ReadingBatch, only_missing: bool = False) -> int:
+    """
+    Guarda un lote de lecturas agrupado por sensor, lo publica a los demás
+    workers y lo registra para replicarlo. Con ``only_missing`` se ignoran
+    las lecturas que ya estén en el almacén (un segmento de replicación
+    reenviado). Devuelve el número de lecturas guardadas.
+    """
+    if not batch:
+        return 0
+    count = _store(batch, only_missing)
+    if get_state_backend().shared:
+        global _pending_count
+        with _pending_lock:
+            for sensor_id, (timestamps, values) in batch.items():
+                pending_timestamps, pending_values = _pending.setdefault(sensor_id, ([], []))
+                pending_timestamps.extend(timestamps)
+                pending_values.extend(values)
+                _pending_count += len(timestamps)
+            full = _pending_count >= MAX_PENDING_READINGS
+        if full:
+            publish_pending_readings()
+    replication_shipper.capture_readings(batch)
+    return count
+
+
+def publish_pending_readings():
+    """
+    Publica a los demás workers las lecturas acumuladas.
+    """
+    global _pending_count
+    with _pending_lock:
+        if not _pending:
+            return
+        payload = [[sensor_id, timestamps, values] for sensor_id, (timestamps, values) in _pending.items()]
+        _pending.clear()
+        _pending_count = 0
+    get_state_backend().publish(READINGS_CHANNEL, payload)
+
+
+def _apply_remote_readings(payload: List[list]):
+    """
+    Aplica al almacén local las lecturas recibidas por otro worker. Las que ya
+    tenga (recuperadas al arrancar de los segmentos o recibidas otra vez al
+    repasar los últimos eventos) se ignoran.
+    """
+    for sensor_id, timestamps, values in payload:
+        reading_store.add_missing(sensor_id, np.asarray(timestamps, dtype=np.float64), np.asarray(values, dtype=np.float64))
+
+
+state_sync.subscribe(READINGS_CHANNEL, _apply_remote_readings)
+state_sync.add_flusher(publish_pending_readings)
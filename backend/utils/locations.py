@@ -0,0 +1,299 @@
+"""
+Jerarquía de ubicaciones (granja → invernadero → zona) y agregados por
+ubicación y tipo de sensor.
+
+El campo ``location`` de sensores y actuadores es texto libre; una "/" separa
+el invernadero de la zona ("Invernadero 1/Zona A"). Sin "/" el sensor está en
+el invernadero, sin zona concreta, y todos cuelgan de la granja.
+
+Los agregados se mantienen de forma incremental al guardar lecturas, igual
+que los histogramas de ``database/reading_sketches.py``. Para cada ubicación
+(y sus ancestros) y tipo de sensor se guardan:
+
+- cubetas horarias con número de lecturas, suma, mínimo y máximo
+- la última lectura de cada sensor con su estado, el recuento de sensores
+  por estado y la suma de sus valores actuales
+
+Así un panel de la granja obtiene unas pocas filas (la humedad media del
+suelo por invernadero y hora, el peor pH actual por zona) en lugar de pedir
+y agregar cientos de sensores.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from database.readings_store import reading_store
+from utils.sensor_status import STATUS_SEVERITY, classify_value
+
+# Niveles de la jerarquía, de la raíz a las hojas
+LEVELS = ("farm", "greenhouse", "zone")
+LOCATION_SEPARATOR = "/"
+FARM_NAME = os.getenv("FARM_NAME", "Joy's Farm")
+
+HOUR_SECONDS = 3600
+# Capacidad inicial de las cubetas horarias de cada ubicación y tipo
+INITIAL_CAPACITY = 256
+# Un sensor sin lecturas desde hace más de esto cuenta como sin datos recientes
+STALE_SECONDS = float(os.getenv("LOCATION_STALE_SECONDS", 3600))
+
+
+def location_keys(location: Optional[str]) -> List[str]:
+    """
+    Claves de la ubicación y de sus ancestros, de la granja ("") a la más
+    concreta: ``["", "Invernadero 1", "Invernadero 1/Zona A"]``.
+    """
+    parts = [part.strip() for part in (location or "").split(LOCATION_SEPARATOR) if part.strip()]
+    keys = [""]
+    if parts:
+        keys.append(parts[0])
+    if len(parts) > 1:
+        keys.append(LOCATION_SEPARATOR.join(parts))
+    return keys
+
+
+def location_level(key: str) -> str:
+    if not key:
+        return "farm"
+    return "zone" if LOCATION_SEPARATOR in key else "greenhouse"
+
+
+def location_name(key: str) -> str:
+    if not key:
+        return FARM_NAME
+    return key.split(LOCATION_SEPARATOR, 1)[-1]
+
+
+def location_parent(key: str) -> Optional[str]:
+    if not key:
+        return None
+    return key.split(LOCATION_SEPARATOR, 1)[0] if LOCATION_SEPARATOR in key else ""
+
+
+class HourlySeries:
+    """
+    Cubetas horarias ordenadas con número de lecturas, suma, mínimo y máximo.
+
+    Las lecturas nuevas suelen caer en la última hora o después, y se añaden
+    al final; las atrasadas se fusionan.
+    """
+
+    __slots__ = ("hours", "counts", "sums", "mins", "maxs", "size")
+
+    def __init__(self):
+        self.hours = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.counts = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.sums = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.mins = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.maxs = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.size = 0
+
+    def add(self, hours: np.ndarray, counts: np.ndarray, sums: np.ndarray, mins: np.ndarray, maxs: np.ndarray):
+        """
+        Añade cubetas de un lote (horas únicas y ordenadas).
+        """
+        size = self.size
+        if size and hours[0] < self.hours[size - 1]:
+            self._merge(hours, counts, sums, mins, maxs)
+            return
+        if size and hours[0] == self.hours[size - 1]:
+            last = size - 1
+            self.counts[last] += counts[0]
+            self.sums[last] += sums[0]
+            self.mins[last] = min(self.mins[last], mins[0])
+            self.maxs[last] = max(self.maxs[last], maxs[0])
+            hours, counts, sums, mins, maxs = hours[1:], counts[1:], sums[1:], mins[1:], maxs[1:]
+        required = size + hours.size
+        if required > self.hours.size:
+            self._resize(max(required, self.hours.size * 2))
+        for column, new in zip((self.hours, self.counts, self.sums, self.mins, self.maxs), (hours, counts, sums, mins, maxs)):
+            column[size:required] = new
+        self.size = required
+
+    def _resize(self, capacity: int):
+        for name in self.__slots__[:-1]:
+            column = getattr(self, name)
+            resized = np.empty(capacity, dtype=column.dtype)
+            resized[:self.size] = column[:self.size]
+            setattr(self, name, resized)
+
+    def _merge(self, hours, counts, sums, mins, maxs):
+        size = self.size
+        merged_hours = np.union1d(self.hours[:size], hours)
+        old = np.searchsorted(merged_hours, self.hours[:size])
+        new = np.searchsorted(merged_hours, hours)
+        merged_counts = np.zeros(merged_hours.size, dtype=np.int64)
+        merged_sums = np.zeros(merged_hours.size, dtype=np.float64)
+        merged_mins = np.full(merged_hours.size, np.inf)
+        merged_maxs = np.full(merged_hours.size, -np.inf)
+        merged_counts[old] = self.counts[:size]
+        merged_sums[old] = self.sums[:size]
+        merged_mins[old] = self.mins[:size]
+        merged_maxs[old] = self.maxs[:size]
+        merged_counts[new] += counts
+        merged_sums[new] += sums
+        merged_mins[new] = np.minimum(merged_mins[new], mins)
+        merged_maxs[new] = np.maximum(merged_maxs[new], maxs)
+        self.hours, self.counts, self.sums = merged_hours, merged_counts, merged_sums
+        self.mins, self.maxs = merged_mins, merged_maxs
+        self.size = merged_hours.size
+
+    def range(self, first_hour: int, last_hour: int) -> Tuple[np.ndarray, ...]:
+        """
+        Copias de las cubetas con ``first_hour <= hora <= last_hour``.
+        """
+        lo = int(np.searchsorted(self.hours[:self.size], first_hour, side="left"))
+        hi = int(np.searchsorted(self.hours[:self.size], last_hour, side="right"))
+        return tuple(column[lo:hi].copy() for column in (self.hours, self.counts, self.sums, self.mins, self.maxs))
+
+
+class LocationState:
+    """
+    Estado actual de los sensores de un tipo en una ubicación.
+    """
+
+    __slots__ = ("unit", "sensors", "status_counts", "value_sum", "last_timestamp")
+
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.sensors: Set[Hashable] = set()
+        self.status_counts: Dict[str, int] = {}
+        self.value_sum = 0.0
+        self.last_timestamp = -np.inf
+
+
+class LocationAggregates:
+    """
+    Agregados por ubicación y tipo de sensor del proceso, actualizados con
+    cada escritura del almacén de lecturas.
+    """
+
+    def __init__(self):
+        self._hourly: Dict[Tuple[str, str], HourlySeries] = {}
+        self._states: Dict[Tuple[str, str], LocationState] = {}
+        # Última lectura de cada sensor: (timestamp, valor, estado)
+        self._latest: Dict[Hashable, Tuple[float, float, str]] = {}
+        # Tipo, unidad y ubicaciones de cada sensor registrado
+        self._sensors: Dict[Hashable, Tuple[str, str, List[str]]] = {}
+        self._resolve: Optional[Callable[[Hashable], Optional[Dict[str, Any]]]] = None
+        self._lock = threading.RLock()
+
+    def bind(self, resolve: Callable[[Hashable], Optional[Dict[str, Any]]]):
+        """
+        Indica cómo obtener un sensor del registro (tipo, unidad y ubicación).
+        """
+        self._resolve = resolve
+
+    def _sensor(self, sensor_id: Hashable) -> Optional[Tuple[str, str, List[str]]]:
+        meta = self._sensors.get(sensor_id)
+        if meta is not None:
+            return meta
+        sensor = self._resolve(sensor_id) if self._resolve is not None and isinstance(sensor_id, int) else None
+        if sensor is None:
+            # Sin guardar: el sensor puede registrarse después (en este worker
+            # o en otro) y sus lecturas siguientes deben contarse
+            return None
+        meta = self._sensors[sensor_id] = (sensor["type"], sensor.get("unit", ""), location_keys(sensor.get("location")))
+        return meta
+
+    def add(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray):
+        """
+        Suscriptor del almacén: añade un lote de lecturas de un sensor.
+        """
+        with self._lock:
+            meta = self._sensor(sensor_id)
+        if meta is None:
+            return
+        sensor_type, unit, keys = meta
+        finite = np.isfinite(values)
+        timestamps, values = np.asarray(timestamps)[finite], np.asarray(values)[finite]
+        if timestamps.size == 0:
+            return
+
+        hours, inverse = np.unique((timestamps // HOUR_SECONDS).astype(np.int64), return_inverse=True)
+        counts = np.bincount(inverse, minlength=hours.size)
+        sums = np.bincount(inverse, weights=values, minlength=hours.size)
+        mins = np.full(hours.size, np.inf)
+        maxs = np.full(hours.size, -np.inf)
+        np.minimum.at(mins, inverse, values)
+        np.maximum.at(maxs, inverse, values)
+        newest = int(np.argmax(timestamps))
+        newest_timestamp, newest_value = float(timestamps[newest]), float(values[newest])
+
+        with self._lock:
+            for key in keys:
+                series = self._hourly.get((key, sensor_type))
+                if series is None:
+                    series = self._hourly[(key, sensor_type)] = HourlySeries()
+                series.add(hours, counts, sums, mins, maxs)
+
+            previous = self._latest.get(sensor_id)
+            if previous is not None and previous[0] > newest_timestamp:
+                return
+            status = classify_value(sensor_type, newest_value)
+            self._latest[sensor_id] = (newest_timestamp, newest_value, status)
+            for key in keys:
+                state = self._states.get((key, sensor_type))
+                if state is None:
+                    state = self._states[(key, sensor_type)] = LocationState(unit)
+                if previous is not None:
+                    state.status_counts[previous[2]] -= 1
+                    state.value_sum -= previous[1]
+                state.sensors.add(sensor_id)
+                state.status_counts[status] = state.status_counts.get(status, 0) + 1
+                state.value_sum += newest_value
+                state.last_timestamp = max(state.last_timestamp, newest_timestamp)
+
+    def status(self, level: Optional[str] = None, sensor_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Estado actual por ubicación y tipo: media de los valores actuales,
+        peor estado, sensores por estado y sensores sin datos recientes.
+        """
+        stale_before = time.time() - STALE_SECONDS
+        rows = []
+        with self._lock:
+            for (key, state_type), state in sorted(self._states.items()):
+                if (level is not None and location_level(key) != level) or (sensor_type is not None and state_type != sensor_type):
+                    continue
+                counts = {name: count for name, count in state.status_counts.items() if count}
+                rows.append({
+                    "location": key,
+                    "name": location_name(key),
+                    "level": location_level(key),
+                    "sensor_type": state_type,
+                    "unit": state.unit,
+                    "sensors": len(state.sensors),
+                    "current_avg": state.value_sum / len(state.sensors) if state.sensors else None,
+                    "worst_status": max(counts, key=STATUS_SEVERITY.get, default="normal"),
+                    "status_counts": counts,
+                    "stale": sum(1 for sensor_id in state.sensors if self._latest[sensor_id][0] < stale_before),
+                    "last_reading_time": state.last_timestamp if np.isfinite(state.last_timestamp) else None,
+                })
+        return rows
+
+    def hourly(self, key: str, sensor_type: str, start: float, end: float) -> Optional[Tuple[np.ndarray, ...]]:
+        """
+        Cubetas horarias ``(horas, lecturas, sumas, mínimos, máximos)`` de una
+        ubicación y tipo entre ``start`` y ``end``, o None si no hay datos.
+        """
+        with self._lock:
+            series = self._hourly.get((key, sensor_type))
+            if series is None:
+                return None
+            return series.range(int(start // HOUR_SECONDS), int(end // HOUR_SECONDS))
+
+    def locations(self, level: Optional[str] = None, sensor_type: Optional[str] = None) -> List[str]:
+        """
+        Ubicaciones con agregados del tipo indicado.
+        """
+        with self._lock:
+            keys = {key for key, key_type in self._hourly if sensor_type is None or key_type == sensor_type}
+        return sorted(key for key in keys if level is None or location_level(key) == level)
+
+
+# Agregados compartidos por todas las rutas del proceso
+location_aggregates = LocationAggregates()
+
+reading_store.subscribe(location_aggregates.add, on_load=True)
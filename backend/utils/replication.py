@@ -0,0 +1,540 @@
+"""
+Replicación de datos de un nodo (la Raspberry Pi de un invernadero) a un
+servidor central que ejecuta esta misma API.
+
+El nodo guarda en un registro local (SQLite) todo lo que debe replicar,
+separado en flujos con su propia secuencia:
+
+- ``actuator_events``: comandos de los actuadores
+- ``rollups``: resúmenes horarios (media, mínimo, máximo y número de lecturas)
+- ``readings``: lecturas en bruto, tal como se ingieren
+
+Un único proceso del nodo (elegido con un bloqueo de fichero) envía los
+registros pendientes en segmentos JSON comprimidos con gzip a
+``POST /replication/segments`` del servidor central. Cada registro lleva su
+número de secuencia y el servidor guarda, por nodo y flujo, la última
+secuencia aplicada, así que reenviar un segmento no duplica datos. Tras un
+corte de conexión el nodo pregunta al servidor por su cursor y continúa desde
+ahí, con reintentos de espera exponencial. El ancho de banda se limita con un
+cubo de fichas sobre los bytes enviados.
+
+Configuración del nodo:
+
+- ``REPLICATION_UPSTREAM_URL``: URL del servidor central (sin ella no se replica)
+- ``REPLICATION_NODE_ID``: identificador del nodo (por defecto, el nombre del host)
+- ``REPLICATION_TOKEN``: token compartido con el servidor central
+- ``REPLICATION_STREAMS``: flujos a enviar, separados por comas (por defecto, todos)
+- ``REPLICATION_MAX_KBPS``: límite de ancho de banda en KB/s (0 = sin límite)
+- ``REPLICATION_OUTBOX``: fichero del registro local
+
+Uso como script (desde el directorio ``backend``)::
+
+    python -m utils.replication status
+    python -m utils.replication push
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from database.readings_store import reading_store
+
+logger = logging.getLogger(__name__)
+
+# Flujos en orden de prioridad: con poco ancho de banda llegan antes los
+# comandos y los resúmenes que las lecturas en bruto
+STREAMS = ("actuator_events", "rollups", "readings")
+
+# Límites de cada segmento
+SEGMENT_MAX_RECORDS = 500
+SEGMENT_MAX_BYTES = 512 * 1024
+
+# Segundos entre ciclos de envío y espera máxima entre reintentos
+SHIP_INTERVAL = float(os.getenv("REPLICATION_INTERVAL", 5))
+MAX_BACKOFF = 300.0
+
+# Resúmenes horarios: se emiten para las horas cerradas hace al menos este margen
+ROLLUP_STEP = 3600
+ROLLUP_LATENESS = 300
+
+REQUEST_TIMEOUT = 30
+
+
+def replication_enabled() -> bool:
+    return bool(os.getenv("REPLICATION_UPSTREAM_URL"))
+
+
+def node_id() -> str:
+    return os.getenv("REPLICATION_NODE_ID") or socket.gethostname()
+
+
+def encode_segment(segment: Dict[str, Any]) -> Tuple[bytes, str]:
+    """
+    Serializa y comprime un segmento; devuelve el cuerpo y su suma SHA-256.
+    """
+    body = gzip.compress(json.dumps(segment, separators=(",", ":")).encode("utf-8"), compresslevel=6)
+    return body, hashlib.sha256(body).hexdigest()
+
+
+def decode_segment(body: bytes, checksum: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Verifica y descomprime un segmento. Lanza ValueError si está dañado.
+    """
+    if checksum and hashlib.sha256(body).hexdigest() != checksum:
+        raise ValueError("La suma de comprobación del segmento no coincide")
+    try:
+        return json.loads(gzip.decompress(body))
+    except (OSError, ValueError) as exc:
+        raise ValueError(f"Segmento no válido: {exc}")
+
+
+class TokenBucket:
+    """
+    Cubo de fichas para limitar los bytes enviados por segundo.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def delay(self, amount: float) -> float:
+        """
+        Consume ``amount`` fichas y devuelve los segundos que hay que esperar
+        antes de enviar (0 si hay fichas suficientes).
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= amount
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class Outbox:
+    """
+    Registro local de solo añadir con una secuencia por flujo.
+
+    Es un fichero SQLite en modo WAL, de modo que todos los workers del nodo
+    pueden añadir registros y sobreviven a reinicios y cortes de conexión.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                stream TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (stream, seq)
+            );
+            CREATE TABLE IF NOT EXISTS cursors (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+        """)
+
+    def append(self, stream: str, payloads: List[Dict[str, Any]]):
+        """
+        Añade registros a un flujo asignándoles números de secuencia consecutivos.
+        """
+        if not payloads:
+            return
+        now = time.time()
+        encoded = [json.dumps(payload, separators=(",", ":")) for payload in payloads]
+        with self._lock:
+            # BEGIN IMMEDIATE serializa la asignación de secuencias entre procesos
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                last = self._get_cursor(f"seq:{stream}")
+                self._conn.executemany(
+                    "INSERT INTO outbox (stream, seq, created_at, payload) VALUES (?, ?, ?, ?)",
+                    [(stream, int(last) + i + 1, now, payload) for i, payload in enumerate(encoded)],
+                )
+                self._set_cursor(f"seq:{stream}", last + len(encoded))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def pending(self, stream: str, after_seq: int, limit: int = SEGMENT_MAX_RECORDS) -> List[Tuple[int, str]]:
+        """
+        Registros del flujo con secuencia mayor que ``after_seq``, sin decodificar.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, payload FROM outbox WHERE stream = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (stream, after_seq, limit),
+            ).fetchall()
+
+    def first_seq(self, stream: str) -> Optional[int]:
+        with self._lock:
+            return self._conn.execute("SELECT MIN(seq) FROM outbox WHERE stream = ?", (stream,)).fetchone()[0]
+
+    def acknowledge(self, stream: str, seq: int):
+        """
+        Guarda el cursor confirmado por el servidor y borra lo ya replicado.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._set_cursor(f"acked:{stream}", seq)
+                self._conn.execute("DELETE FROM outbox WHERE stream = ? AND seq <= ?", (stream, seq))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def cursor(self, name: str) -> float:
+        with self._lock:
+            return self._get_cursor(name)
+
+    def set_cursor(self, name: str, value: float):
+        with self._lock:
+            self._set_cursor(name, value)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for stream in STREAMS:
+                count, oldest = self._conn.execute(
+                    "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE stream = ?", (stream,)
+                ).fetchone()
+                result[stream] = {
+                    "last_seq": int(self._get_cursor(f"seq:{stream}")),
+                    "acked_seq": int(self._get_cursor(f"acked:{stream}")),
+                    "pending": count,
+                    "oldest_pending": datetime.fromtimestamp(oldest).isoformat() if oldest else None,
+                }
+            return result
+
+    def _get_cursor(self, name: str) -> float:
+        row = self._conn.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_cursor(self, name: str, value: float):
+        self._conn.execute(
+            "INSERT INTO cursors (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value),
+        )
+
+
+def hourly_rollups(sensor_id: Hashable, start: float, end: float) -> List[Dict[str, Any]]:
+    """
+    Resúmenes horarios de un sensor en ``[start, end)``.
+    """
+    timestamps, values = reading_store.range(sensor_id, start, end)
+    if timestamps.size and timestamps[-1] >= end:
+        keep = timestamps < end
+        timestamps, values = timestamps[keep], values[keep]
+    if timestamps.size == 0:
+        return []
+    buckets = ((timestamps - start) // ROLLUP_STEP).astype(np.int64)
+    # Índices donde empieza cada hora (las lecturas están ordenadas)
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    counts = np.diff(np.concatenate((starts, [buckets.size])))
+    return [
+        {
+            "sensor_id": sensor_id,
+            "hour": start + int(bucket) * ROLLUP_STEP,
+            "mean": float(mean),
+            "min": float(minimum),
+            "max": float(maximum),
+            "count": int(count),
+        }
+        for bucket, mean, minimum, maximum, count in zip(
+            buckets[starts].tolist(),
+            np.add.reduceat(values, starts) / counts,
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            counts,
+        )
+    ]
+
+
+class ReplicationShipper:
+    """
+    Captura los datos del nodo en el registro local y los envía al servidor central.
+    """
+
+    def __init__(self):
+        self.upstream = (os.getenv("REPLICATION_UPSTREAM_URL") or "").rstrip("/")
+        self.node_id = node_id()
+        self.token = os.getenv("REPLICATION_TOKEN")
+        streams = os.getenv("REPLICATION_STREAMS")
+        self.streams = [stream for stream in STREAMS if not streams or stream in streams.split(",")]
+        self.bucket = TokenBucket(float(os.getenv("REPLICATION_MAX_KBPS", 0)) * 1024)
+        self._outbox: Optional[Outbox] = None
+        self._outbox_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._lock_file = None
+        self._backoff = 0.0
+        self._describe: Optional[Callable[[str, List[Hashable]], Dict[str, Any]]] = None
+        self.last_error: Optional[str] = None
+        self.bytes_sent = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.upstream)
+
+    @property
+    def outbox(self) -> Outbox:
+        if self._outbox is None:
+            with self._outbox_lock:
+                if self._outbox is None:
+                    self._outbox = Outbox(os.getenv("REPLICATION_OUTBOX", "./data/replication_outbox.db"))
+        return self._outbox
+
+    # Captura
+    def capture_readings(self, batch: Dict[Hashable, Tuple[List[float], List[float]]]):
+        if self.enabled and "readings" in self.streams:
+            self.outbox.append("readings", [
+                {"sensor_id": sensor_id, "timestamps": list(timestamps), "values": list(values)}
+                for sensor_id, (timestamps, values) in batch.items()
+            ])
+
+    def capture_actuator_event(self, entry: Dict[str, Any]):
+        if self.enabled and "actuator_events" in self.streams:
+            self.outbox.append("actuator_events", [entry])
+
+    def capture_rollups(self, now: Optional[float] = None):
+        """
+        Añade los resúmenes de las horas cerradas desde la última ejecución.
+        """
+        if "rollups" not in self.streams:
+            return
+        now = time.time() if now is None else now
+        closed = (now - ROLLUP_LATENESS) // ROLLUP_STEP * ROLLUP_STEP
+        start = self.outbox.cursor("rollups")
+        if not start:
+            # Primera ejecución: empezar por la última hora cerrada
+            start = closed - ROLLUP_STEP
+        if closed <= start:
+            return
+        records = []
+        for sensor_id in reading_store.sensor_ids():
+            records.extend(hourly_rollups(sensor_id, start, closed))
+        self.outbox.append("rollups", records)
+        self.outbox.set_cursor("rollups", closed)
+
+    # Envío
+    def _request(self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None):
+        request = urllib.request.Request(self.upstream + path, data=body, method=method)
+        for key, value in (headers or {}).items():
+            request.add_header(key, value)
+        if self.token:
+            request.add_header("X-Replication-Token", self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                return response.status, json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as exc:
+            try:
+                return exc.code, json.loads(exc.read() or b"null")
+            except ValueError:
+                return exc.code, None
+
+    def sync_cursors(self):
+        """
+        Toma como cursor de cada flujo la última secuencia aplicada en el servidor.
+        """
+        status, body = self._request("GET", f"/replication/nodes/{self.node_id}")
+        if status != 200:
+            raise ConnectionError(f"El servidor central respondió {status} al consultar los cursores")
+        for stream in self.streams:
+            self.outbox.set_cursor(f"acked:{stream}", body["cursors"].get(stream, 0))
+
+    def _build_segment(self, stream: str, after_seq: int) -> Optional[Dict[str, Any]]:
+        rows = self.outbox.pending(stream, after_seq)
+        if not rows:
+            return None
+        records = []
+        size = 0
+        for seq, payload in rows:
+            size += len(payload)
+            if records and size > SEGMENT_MAX_BYTES:
+                break
+            records.append({"seq": seq, **json.loads(payload)})
+        segment = {"node_id": self.node_id, "stream": stream, "records": records}
+        # Si el servidor ya no tiene los anteriores (p. ej., se restauró una
+        # copia), se le indica que el hueco es esperado
+        segment["resync"] = records[0]["seq"] > after_seq + 1
+        if self._describe is not None:
+            key = "actuator_id" if stream == "actuator_events" else "sensor_id"
+            segment["sources"] = self._describe(stream, list({record[key] for record in records}))
+        return segment
+
+    def ship_stream(self, stream: str) -> int:
+        """
+        Envía los segmentos pendientes de un flujo. Devuelve los registros enviados.
+        """
+        sent = 0
+        while True:
+            acked = int(self.outbox.cursor(f"acked:{stream}"))
+            segment = self._build_segment(stream, acked)
+            if segment is None:
+                return sent
+            body, checksum = encode_segment(segment)
+            wait = self.bucket.delay(len(body))
+            if wait:
+                time.sleep(wait)
+            status, response = self._request("POST", "/replication/segments", body, {
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+                "X-Segment-Checksum": checksum,
+            })
+            self.bytes_sent += len(body)
+            if status == 409 and response:
+                # El servidor esperaba otra secuencia: continuar desde su cursor
+                self.outbox.set_cursor(f"acked:{stream}", response["detail"]["acked_seq"])
+                continue
+            if status != 200:
+                raise ConnectionError(f"El servidor central respondió {status}: {response}")
+            self.outbox.acknowledge(stream, response["acked_seq"])
+            sent += len(segment["records"])
+
+    def ship_once(self) -> Dict[str, int]:
+        """
+        Un ciclo completo: resúmenes nuevos y envío de todos los flujos.
+        """
+        self.capture_rollups()
+        return {stream: self.ship_stream(stream) for stream in self.streams}
+
+    def _acquire_leadership(self) -> bool:
+        """
+        Solo un worker del nodo envía: el que obtiene el bloqueo del fichero.
+        """
+        if self._lock_file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:  # sin fcntl (Windows) hay un único proceso
+            self._lock_file = True
+            return True
+        handle = open(self.outbox.path + ".lock", "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        synced = False
+        while True:
+            delay = SHIP_INTERVAL
+            try:
+                if await loop.run_in_executor(None, self._acquire_leadership):
+                    if not synced:
+                        await loop.run_in_executor(None, self.sync_cursors)
+                        synced = True
+                    await loop.run_in_executor(None, self.ship_once)
+                self._backoff = 0.0
+                self.last_error = None
+            except (OSError, ConnectionError, ValueError) as exc:
+                # Sin conexión: reintentar con espera exponencial y volver a
+                # consultar los cursores al reconectar
+                synced = False
+                delay = self._fail(exc)
+                logger.warning("Replicación interrumpida (%s); reintento en %.0f s", exc, delay)
+            except Exception as exc:
+                # Cualquier otro error (registro local bloqueado, respuesta
+                # inesperada del servidor...) no debe detener la replicación
+                synced = False
+                delay = self._fail(exc)
+                logger.exception("Error en la replicación; reintento en %.0f s", delay)
+            await asyncio.sleep(delay)
+
+    def _fail(self, exc: Exception) -> float:
+        """
+        Registra el error y devuelve la espera (exponencial) hasta el reintento.
+        """
+        self.last_error = f"{type(exc).__name__}: {exc}" if not isinstance(exc, (OSError, ValueError)) else str(exc)
+        self._backoff = min(MAX_BACKOFF, max(SHIP_INTERVAL, self._backoff * 2))
+        return self._backoff * random.uniform(0.8, 1.2)
+
+    def start(self, describe: Optional[Callable[[str, List[Hashable]], Dict[str, Any]]] = None):
+        """
+        Arranca el envío en segundo plano. ``describe`` devuelve los metadatos
+        (nombre, tipo, unidad...) de los sensores o actuadores de un segmento.
+        """
+        self._describe = describe
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "node_id": self.node_id,
+            "upstream": self.upstream or None,
+            "streams": self.outbox.status() if self.enabled else {},
+            "bytes_sent": self.bytes_sent,
+            "last_error": self.last_error,
+        }
+
+
+# Replicador del proceso, arrancado desde el lifespan de la aplicación
+replication_shipper = ReplicationShipper()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replicación del nodo al servidor central")
+    parser.add_argument("command", choices=["status", "push"], help="status: estado del registro local; push: enviar ahora")
+    args = parser.parse_args(argv)
+
+    if not replication_shipper.enabled:
+        print("REPLICATION_UPSTREAM_URL no está definido", file=sys.stderr)
+        return 2
+    if args.command == "status":
+        print(json.dumps(replication_shipper.status(), indent=2, ensure_ascii=False))
+        return 0
+    try:
+        # Los resúmenes horarios los genera el servidor del nodo, que tiene las
+        # lecturas en memoria; aquí solo se envía lo que ya está en el registro
+        replication_shipper.sync_cursors()
+        sent = {stream: replication_shipper.ship_stream(stream) for stream in replication_shipper.streams}
+    except (OSError, ConnectionError, ValueError) as exc:
+        print(f"Error de replicación: {exc}", file=sys.stderr)
+        return 1
+    print(json.dumps({"sent": sent, "bytes_sent": replication_shipper.bytes_sent}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Clasificación del estado (normal, warning, critical) de las lecturas.
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Umbrales por tipo de sensor: (mínimo, máximo) para cada nivel; None = sin límite
+STATUS_THRESHOLDS: Dict[str, Dict[str, Tuple[Optional[float], Optional[float]]]] = {
+    "temperature": {"warning": (None, 30.0), "critical": (None, 35.0)},
+    "soil_moisture": {"warning": (40.0, None), "critical": (20.0, None)},
+    "ph": {"warning": (6.0, 7.5), "critical": (5.5, 8.0)},
+    "vpd": {"warning": (0.4, 1.6), "critical": (0.2, 2.0)},
+}
+
+# Orden de gravedad de los estados
+STATUS_SEVERITY = {"normal": 0, "warning": 1, "critical": 2}
+
+
+def _outside(values: np.ndarray, bounds: Tuple[Optional[float], Optional[float]]) -> np.ndarray:
+    low, high = bounds
+    mask = np.zeros(values.shape, dtype=bool)
+    if low is not None:
+        mask |= values < low
+    if high is not None:
+        mask |= values > high
+    return mask
+
+
+def classify_status(sensor_type: str, values: np.ndarray) -> np.ndarray:
+    """
+    Devuelve el estado de cada valor según los umbrales de su tipo de sensor.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    status = np.full(values.shape, "normal", dtype=object)
+    thresholds = STATUS_THRESHOLDS.get(sensor_type)
+    if thresholds:
+        status[_outside(values, thresholds["warning"])] = "warning"
+        status[_outside(values, thresholds["critical"])] = "critical"
+    return status
+
+
+def classify_value(sensor_type: str, value: float) -> str:
+    """
+    Estado de un único valor.
+    """
+    return str(classify_status(sensor_type, np.array([value]))[0])
@@ -0,0 +1,132 @@
+"""
+Perfilado del arranque y estado de preparación (readiness) de la aplicación.
+
+El arranque se divide en fases cronometradas (importación de routers,
+calentamiento de componentes...). Los componentes costosos se calientan en
+segundo plano después de que la API empiece a responder, de modo que
+``/health`` (liveness) contesta de inmediato y ``/ready`` indica cuándo el
+servicio está completamente preparado.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """
+    Duración de cada fase del arranque, en milisegundos.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready_after_ms: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - t0) * 1000, 2)
+            if os.getenv("PROFILE_STARTUP"):
+                logger.warning("Arranque: %s %.2f ms", name, self.phases[name])
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases_ms": dict(self.phases),
+            "ready_after_ms": self.ready_after_ms,
+        }
+
+
+class Readiness:
+    """
+    Estado de preparación de los componentes que se calientan en segundo plano.
+
+    Cada componente está en ``pending``, ``ready`` o ``failed``.
+    """
+
+    def __init__(self):
+        self._components: Dict[str, str] = {}
+        self._errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str):
+        with self._lock:
+            self._components[name] = "pending"
+
+    def mark_ready(self, name: str):
+        with self._lock:
+            self._components[name] = "ready"
+
+    def mark_failed(self, name: str, error: str):
+        with self._lock:
+            self._components[name] = "failed"
+            self._errors[name] = error
+
+    def status(self, name: str, default: str = "pending") -> str:
+        with self._lock:
+            return self._components.get(name, default)
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(state == "ready" for state in self._components.values())
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"components": dict(self._components), "errors": dict(self._errors)}
+
+
+def run_warmup(tasks: List[Tuple[str, Callable[[], None]]]):
+    """
+    Ejecuta en orden las tareas de calentamiento, registrando su duración y
+    actualizando el estado de preparación. Un fallo no detiene las demás.
+    """
+    for name, task in tasks:
+        try:
+            with startup_profile.phase(f"warmup:{name}"):
+                task()
+        except Exception as exc:
+            logger.exception("Fallo al calentar %s", name)
+            readiness.mark_failed(name, str(exc))
+        else:
+            readiness.mark_ready(name)
+    if readiness.is_ready():
+        startup_profile.ready_after_ms = startup_profile.elapsed_ms()
+
+
+def warmup_forecasting():
+    """
+    Carga el módulo de IA y ajusta una vez el modelo por defecto para que la
+    primera predicción no pague la importación ni la inicialización de NumPy.
+
+    Con ``WARMUP_ML_MODELS=1`` se importan también las librerías de los
+    modelos opcionales (scikit-learn, Prophet), que son las más lentas.
+    """
+    import numpy as np
+
+    from ai import backtesting  # noqa: F401
+    from ai.forecasting import DEFAULT_MODEL, MODEL_CLASSES, available_models, create_model
+
+    timestamps = np.arange(0, 2 * 86400, 600, dtype=np.float64)
+    values = np.sin(2 * np.pi * timestamps / 86400)
+    create_model(DEFAULT_MODEL).fit(timestamps, values).predict(timestamps[-12:] + 86400)
+
+    if os.getenv("WARMUP_ML_MODELS") == "1":
+        models = available_models()
+        for model_class in MODEL_CLASSES:
+            if model_class.name in models and getattr(model_class, "requires", None):
+                __import__(model_class.requires)
+
+
+# Instancias compartidas por la aplicación
+startup_profile = StartupProfile()
+readiness = Readiness()
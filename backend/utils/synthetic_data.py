@@ -0,0 +1,331 @@
+"""
+Generador vectorizado de datos sintéticos de la granja.
+
+Produce series de lecturas realistas para todos los tipos de sensores (incluidos
+los Atlas Scientific) con ciclos diarios y estacionales, ruido, deriva, huecos y
+anomalías inyectadas, y permite cargarlas en bloque en el almacén de lecturas.
+Se usa en el modo de desarrollo, en los benchmarks y en los backtests de
+predicción.
+"""
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400.0
+DAYS_PER_YEAR = 365.25
+
+# Perfiles de comportamiento por tipo de sensor.
+# - base: valor medio anual
+# - daily_amplitude / daily_peak_hour: ciclo diario (amplitud negativa = mínimo a esa hora)
+# - seasonal_amplitude / seasonal_peak_day: ciclo anual (día del año con el máximo)
+# - noise: desviación típica del ruido gaussiano
+# - drift_per_day: deriva máxima del sensor por día (el signo se elige al azar)
+# - minimum / maximum: límites físicos
+SENSOR_PROFILES: Dict[str, Dict[str, Any]] = {
+    "temperature": {
+        "unit": "°C", "base": 22.0, "daily_amplitude": 5.0, "daily_peak_hour": 14.0,
+        "seasonal_amplitude": 6.0, "seasonal_peak_day": 200, "noise": 0.3,
+        "drift_per_day": 0.0, "minimum": -10.0, "maximum": 50.0,
+    },
+    "humidity": {
+        "unit": "%", "base": 68.0, "daily_amplitude": -12.0, "daily_peak_hour": 14.0,
+        "seasonal_amplitude": -5.0, "seasonal_peak_day": 200, "noise": 1.5,
+        "drift_per_day": 0.01, "minimum": 0.0, "maximum": 100.0,
+    },
+    "soil_moisture": {
+        "unit": "%", "base": 62.0, "daily_amplitude": -4.0, "daily_peak_hour": 16.0,
+        "seasonal_amplitude": -6.0, "seasonal_peak_day": 200, "noise": 0.8,
+        "drift_per_day": 0.02, "minimum": 0.0, "maximum": 100.0,
+    },
+    "ph": {
+        "unit": "pH", "base": 6.8, "daily_amplitude": 0.08, "daily_peak_hour": 15.0,
+        "seasonal_amplitude": 0.1, "seasonal_peak_day": 200, "noise": 0.03,
+        "drift_per_day": 0.002, "minimum": 0.0, "maximum": 14.0,
+    },
+    "light": {
+        "unit": "lux", "base": 0.0, "peak": 30000.0, "daylight": True,
+        "seasonal_amplitude": 0.35, "seasonal_peak_day": 172, "noise": 300.0,
+        "drift_per_day": 0.0, "minimum": 0.0, "maximum": 120000.0,
+    },
+    "ec": {
+        "unit": "μS/cm", "base": 1500.0, "daily_amplitude": 40.0, "daily_peak_hour": 15.0,
+        "seasonal_amplitude": 80.0, "seasonal_peak_day": 200, "noise": 15.0,
+        "drift_per_day": 1.0, "minimum": 0.0, "maximum": 10000.0,
+    },
+    "do": {
+        "unit": "mg/L", "base": 7.5, "daily_amplitude": -0.6, "daily_peak_hour": 15.0,
+        "seasonal_amplitude": -0.8, "seasonal_peak_day": 200, "noise": 0.08,
+        "drift_per_day": 0.003, "minimum": 0.0, "maximum": 20.0,
+    },
+    "rtd": {
+        "unit": "°C", "base": 21.0, "daily_amplitude": 1.5, "daily_peak_hour": 16.0,
+        "seasonal_amplitude": 4.0, "seasonal_peak_day": 205, "noise": 0.05,
+        "drift_per_day": 0.0, "minimum": -5.0, "maximum": 45.0,
+    },
+    "orp": {
+        "unit": "mV", "base": 250.0, "daily_amplitude": 15.0, "daily_peak_hour": 13.0,
+        "seasonal_amplitude": 10.0, "seasonal_peak_day": 200, "noise": 4.0,
+        "drift_per_day": 0.2, "minimum": -1000.0, "maximum": 1000.0,
+    },
+    "co2": {
+        "unit": "ppm", "base": 650.0, "daily_amplitude": -180.0, "daily_peak_hour": 13.0,
+        "seasonal_amplitude": 40.0, "seasonal_peak_day": 15, "noise": 20.0,
+        "drift_per_day": 0.5, "minimum": 300.0, "maximum": 5000.0,
+    },
+}
+
+# Tipos sin perfil propio que se comportan como otro tipo
+PROFILE_ALIASES = {"temp": "temperature", "hum": "humidity"}
+
+# Programación diaria de los actuadores: (hora de encendido, minutos encendido).
+# Cada día la hora se desplaza y la duración varía al azar.
+ACTUATOR_SCHEDULES: Dict[str, List[Tuple[float, float]]] = {
+    "pump": [(6.0, 15.0), (12.0, 10.0), (18.0, 15.0)],
+    "light": [(6.0, 840.0)],
+    "fan": [(11.0, 90.0), (14.0, 120.0)],
+    "heater": [(0.5, 300.0)],
+}
+
+# Desplazamiento máximo de la hora de encendido (minutos) y variación relativa de la duración
+SCHEDULE_JITTER_MINUTES = 20.0
+SCHEDULE_DURATION_SPREAD = 0.3
+
+
+class SyntheticSeries(NamedTuple):
+    """
+    Serie sintética: marcas de tiempo (segundos epoch), valores y máscara de
+    lecturas con anomalías inyectadas.
+    """
+    timestamps: np.ndarray
+    values: np.ndarray
+    anomalies: np.ndarray
+
+
+def get_profile(sensor_type: str) -> Dict[str, Any]:
+    """
+    Devuelve el perfil del tipo de sensor indicado.
+    """
+    sensor_type = PROFILE_ALIASES.get(sensor_type, sensor_type)
+    if sensor_type not in SENSOR_PROFILES:
+        raise ValueError(
+            f"Tipo de sensor sin perfil sintético: {sensor_type}. Debe ser uno de: {', '.join(SENSOR_PROFILES)}"
+        )
+    return SENSOR_PROFILES[sensor_type]
+
+
+def sensor_seed(seed: int, sensor_id: Hashable) -> int:
+    """
+    Semilla estable por sensor, independiente del orden de generación.
+    """
+    return (seed * 1_000_003 + zlib.crc32(str(sensor_id).encode("utf-8"))) & 0xFFFFFFFF
+
+
+def _time_features(timestamps: np.ndarray):
+    """
+    Hora del día (0-24) y día del año (0-365) de cada marca de tiempo local.
+    """
+    first = datetime.fromtimestamp(float(timestamps[0]))
+    midnight = datetime(first.year, first.month, first.day)
+    new_year = datetime(first.year, 1, 1)
+    hours = ((timestamps - midnight.timestamp()) % SECONDS_PER_DAY) / 3600.0
+    days = ((timestamps - new_year.timestamp()) / SECONDS_PER_DAY) % DAYS_PER_YEAR
+    return hours, days
+
+
+def expected_values(sensor_type: str, timestamps: np.ndarray) -> np.ndarray:
+    """
+    Curva esperada (sin ruido, deriva ni anomalías) de un tipo de sensor.
+    """
+    profile = get_profile(sensor_type)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if timestamps.size == 0:
+        return np.empty(0, dtype=np.float64)
+    hours, days = _time_features(timestamps)
+    seasonal = np.cos(2 * np.pi * (days - profile["seasonal_peak_day"]) / DAYS_PER_YEAR)
+
+    if profile.get("daylight"):
+        # Campana solar entre el amanecer y el atardecer, más larga en verano
+        day_length = 12.0 + 2.5 * seasonal
+        sunrise = 13.0 - day_length / 2
+        phase = np.clip((hours - sunrise) / day_length, 0.0, 1.0)
+        intensity = profile["peak"] * (1 + profile["seasonal_amplitude"] * seasonal)
+        return profile["base"] + intensity * np.sin(np.pi * phase) ** 2
+
+    diurnal = np.cos(2 * np.pi * (hours - profile["daily_peak_hour"]) / 24.0)
+    return profile["base"] + profile["daily_amplitude"] * diurnal + profile["seasonal_amplitude"] * seasonal
+
+
+def generate_series(
+    sensor_type: str,
+    start: datetime,
+    end: datetime,
+    interval_seconds: float = 600.0,
+    seed: int = 0,
+    drift_origin: Optional[datetime] = None,
+    drift_seed: Optional[int] = None,
+    gap_rate: float = 0.0,
+    anomaly_rate: float = 0.0,
+) -> SyntheticSeries:
+    """
+    Genera una serie sintética para un tipo de sensor.
+
+    - ``gap_rate``: fracción aproximada de lecturas perdidas, agrupadas en huecos
+    - ``anomaly_rate``: fracción aproximada de lecturas anómalas (picos y
+      valores congelados)
+    - ``drift_origin`` / ``drift_seed``: instante en el que la deriva del sensor
+      es cero (por defecto ``start``) y semilla de su pendiente (por defecto
+      ``seed``). Fijarlos permite generar por bloques una serie continua.
+    """
+    profile = get_profile(sensor_type)
+    rng = np.random.default_rng(seed)
+    origin = (drift_origin or start).timestamp()
+
+    timestamps = np.arange(start.timestamp(), end.timestamp() + 1e-9, interval_seconds, dtype=np.float64)
+    n = timestamps.size
+    if n == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return SyntheticSeries(empty, empty, np.empty(0, dtype=bool))
+
+    values = expected_values(sensor_type, timestamps)
+
+    # Nubosidad diaria para la luz: un factor aleatorio por día
+    if profile.get("daylight"):
+        day_index = ((timestamps - timestamps[0]) // SECONDS_PER_DAY).astype(np.int64)
+        cloud = rng.uniform(0.4, 1.0, size=int(day_index[-1]) + 1)
+        values = profile["base"] + (values - profile["base"]) * cloud[day_index]
+
+    # Deriva lineal del sensor con pendiente y signo propios
+    drift_rng = rng if drift_seed is None else np.random.default_rng(drift_seed)
+    drift_rate = profile["drift_per_day"] * drift_rng.uniform(-1.0, 1.0)
+    values = values + drift_rate * (timestamps - origin) / SECONDS_PER_DAY
+
+    # Ruido gaussiano
+    values = values + rng.normal(0.0, profile["noise"], size=n)
+
+    # Anomalías: picos aislados y tramos de valor congelado
+    anomalies = np.zeros(n, dtype=bool)
+    if anomaly_rate > 0:
+        spread = max(abs(profile.get("daily_amplitude", 0.0)), profile["noise"] * 10, profile.get("peak", 0.0) * 0.2)
+        spikes = rng.random(n) < anomaly_rate / 2
+        values[spikes] += rng.choice([-1.0, 1.0], size=int(spikes.sum())) * spread * rng.uniform(2.0, 4.0, size=int(spikes.sum()))
+        anomalies |= spikes
+
+        stuck_starts = np.nonzero(rng.random(n) < anomaly_rate / 40)[0]
+        for stuck_start in stuck_starts:
+            stuck_end = min(n, stuck_start + int(rng.integers(10, 40)))
+            values[stuck_start:stuck_end] = values[stuck_start]
+            anomalies[stuck_start:stuck_end] = True
+
+    values = np.clip(values, profile["minimum"], profile["maximum"])
+
+    # Huecos: tramos contiguos de lecturas perdidas
+    if gap_rate > 0:
+        mean_gap = 12
+        gap_starts = rng.random(n) < gap_rate / mean_gap
+        lengths = rng.geometric(1.0 / mean_gap, size=int(gap_starts.sum()))
+        coverage = np.zeros(n + 1, dtype=np.int64)
+        starts = np.nonzero(gap_starts)[0]
+        np.add.at(coverage, starts, 1)
+        np.add.at(coverage, np.minimum(starts + lengths, n), -1)
+        keep = np.cumsum(coverage[:n]) == 0
+        timestamps, values, anomalies = timestamps[keep], values[keep], anomalies[keep]
+
+    return SyntheticSeries(timestamps, values, anomalies)
+
+
+def generate_readings(
+    sensor_type: str,
+    count: int,
+    end: Optional[datetime] = None,
+    interval_seconds: float = 600.0,
+    seed: int = 0,
+) -> SyntheticSeries:
+    """
+    Genera las ``count`` lecturas más recientes hasta ``end`` (por defecto, ahora).
+    """
+    end = end or datetime.now()
+    start = end - timedelta(seconds=interval_seconds * max(count - 1, 0))
+    series = generate_series(sensor_type, start, end, interval_seconds, seed=seed)
+    return SyntheticSeries(series.timestamps[-count:], series.values[-count:], series.anomalies[-count:])
+
+
+def bulk_load(
+    store,
+    sensors: Iterable[Dict[str, Any]],
+    start: datetime,
+    end: datetime,
+    interval_seconds: float = 600.0,
+    seed: int = 0,
+    gap_rate: float = 0.0,
+    anomaly_rate: float = 0.0,
+    chunk_days: int = 30,
+) -> int:
+    """
+    Carga en el almacén lecturas sintéticas de varios sensores.
+
+    ``sensors`` son diccionarios con al menos ``id`` y ``type`` (como los de
+    ``SAMPLE_SENSORS``). La generación se hace por bloques de ``chunk_days`` días
+    para acotar la memoria al cargar años de datos. Devuelve el número de
+    lecturas cargadas.
+    """
+    loaded = 0
+    chunk = timedelta(days=chunk_days)
+    for sensor in sensors:
+        base_seed = sensor_seed(seed, sensor["id"])
+        chunk_start = start
+        chunk_index = 0
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + chunk - timedelta(seconds=interval_seconds), end)
+            series = generate_series(
+                sensor["type"], chunk_start, chunk_end, interval_seconds,
+                seed=base_seed + chunk_index, drift_origin=start, drift_seed=base_seed,
+                gap_rate=gap_rate, anomaly_rate=anomaly_rate,
+            )
+            store.extend(sensor["id"], series.timestamps, series.values)
+            loaded += int(series.timestamps.size)
+            chunk_start += chunk
+            chunk_index += 1
+    return loaded
+
+
+def generate_actuator_schedule(
+    actuator_type: str,
+    start: datetime,
+    end: datetime,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Genera los cambios de estado de un actuador según su programación diaria.
+
+    Devuelve las marcas de tiempo y los estados (encendido/apagado alternos)
+    dentro de ``[start, end]``. Los tipos sin programación no tienen cambios.
+    """
+    schedule = ACTUATOR_SCHEDULES.get(actuator_type)
+    first_day = datetime(start.year, start.month, start.day)
+    days = (end - first_day).days + 1
+    if not schedule or days <= 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=bool)
+
+    rng = np.random.default_rng(seed)
+    midnights = np.array([(first_day + timedelta(days=d)).timestamp() for d in range(days)], dtype=np.float64)
+    hours = np.array([hour for hour, _ in schedule], dtype=np.float64)
+    minutes = np.array([duration for _, duration in schedule], dtype=np.float64)
+
+    jitter = rng.uniform(-SCHEDULE_JITTER_MINUTES, SCHEDULE_JITTER_MINUTES, size=(days, len(schedule)))
+    spread = rng.uniform(1 - SCHEDULE_DURATION_SPREAD, 1 + SCHEDULE_DURATION_SPREAD, size=(days, len(schedule)))
+    on = midnights[:, None] + hours * 3600 + jitter * 60
+    off = on + minutes * spread * 60
+
+    timestamps = np.column_stack((on.ravel(), off.ravel())).ravel()
+    states = np.tile(np.array([True, False]), on.size)
+    keep = (timestamps >= start.timestamp()) & (timestamps <= end.timestamp())
+    return timestamps[keep], states[keep]
+
+
+def supported_types() -> List[str]:
+    """
+    Tipos de sensores con perfil sintético.
+    """
+    return list(SENSOR_PROFILES)
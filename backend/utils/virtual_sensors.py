@@ -0,0 +1,440 @@
+"""
+Sensores virtuales: series calculadas a partir de otros sensores.
+
+Un sensor virtual se define con una expresión sobre variables asociadas a
+sensores del registro, por ejemplo ``vpd(t, rh)`` con ``t`` → sensor de
+temperatura y ``rh`` → sensor de humedad. Opcionalmente acumula su valor en
+una ventana (``integral`` o ``sum`` por hora, día o semana), como la integral
+de luz diaria (DLI) o los totales de dosificación de nutrientes.
+
+Los sensores virtuales forman un grafo de dependencias. Cuando llega una
+lectura de un sensor, solo se recalculan los sensores virtuales que dependen
+de él (y los que dependen de estos), en los instantes nuevos. Un instante se
+calcula cuando todas las entradas han llegado hasta él (marca de agua), o
+cuando una entrada lleva más de la antigüedad máxima sin reportar; en cada
+instante se usa la última lectura de cada entrada.
+Los resultados se guardan en el almacén de lecturas con el identificador del
+sensor virtual, así que ``/history`` y ``/sensors`` los sirven como cualquier
+otro sensor.
+"""
+import ast
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from database.readings_store import reading_store
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad máxima (segundos) de un valor de entrada para usarlo en el cálculo
+DEFAULT_MAX_STALENESS = 15 * 60
+
+# Intervalo máximo (segundos) entre dos lecturas que se integra; los huecos
+# mayores no cuentan para no inventar datos
+MAX_INTEGRATION_GAP = 30 * 60
+
+AGGREGATES = ("integral", "sum")
+WINDOWS = {"hourly": timedelta(hours=1), "daily": timedelta(days=1), "weekly": timedelta(weeks=1)}
+
+
+def saturation_vapor_pressure(t):
+    """
+    Presión de vapor de saturación (kPa) a la temperatura ``t`` (°C), fórmula de Tetens.
+    """
+    return 0.6108 * np.exp(17.27 * t / (t + 237.3))
+
+
+def vapor_pressure_deficit(t, rh):
+    """
+    Déficit de presión de vapor (kPa) a partir de temperatura (°C) y humedad relativa (%).
+    """
+    return saturation_vapor_pressure(t) * (1 - np.clip(rh, 0, 100) / 100)
+
+
+def dew_point(t, rh):
+    """
+    Punto de rocío (°C) con la aproximación de Magnus.
+    """
+    gamma = np.log(np.clip(rh, 1e-6, 100) / 100) + 17.62 * t / (243.12 + t)
+    return 243.12 * gamma / (17.62 - gamma)
+
+
+# Funciones y constantes que pueden usarse en las expresiones
+FUNCTIONS: Dict[str, Callable] = {
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "clip": np.clip,
+    "where": np.where,
+    "svp": saturation_vapor_pressure,
+    "vpd": vapor_pressure_deficit,
+    "dew_point": dew_point,
+}
+CONSTANTS = {"pi": np.float64(np.pi), "e": np.float64(np.e)}
+
+# Límites de tamaño de las expresiones (se validan en el bucle de eventos)
+MAX_EXPRESSION_LENGTH = 500
+MAX_EXPRESSION_NODES = 200
+MAX_EXPRESSION_DEPTH = 20
+
+# Prefijo reservado para las constantes numéricas de la expresión compilada
+_CONSTANT_PREFIX = "__const_"
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.USub, ast.UAdd,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+
+def _depth(node: ast.AST) -> int:
+    children = list(ast.iter_child_nodes(node))
+    return 1 + max((_depth(child) for child in children), default=0)
+
+
+class _FloatConstants(ast.NodeTransformer):
+    """
+    Sustituye cada constante por una variable ``np.float64``: con enteros de
+    Python, ``9**9**9`` se calcularía con precisión arbitraria y no terminaría;
+    en coma flotante da ``inf``.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, np.float64] = {}
+
+    def visit_Constant(self, node: ast.Constant) -> ast.AST:
+        try:
+            value = np.float64(node.value)
+        except OverflowError:
+            raise ValueError("Constante numérica fuera de rango")
+        name = f"{_CONSTANT_PREFIX}{len(self.values)}"
+        self.values[name] = value
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+
+class Expression:
+    """
+    Expresión aritmética validada que se evalúa con arrays de NumPy.
+
+    Solo se admiten números, las variables declaradas, operadores aritméticos,
+    comparaciones y las funciones de ``FUNCTIONS``. Las constantes se evalúan
+    como ``np.float64`` y el tamaño de la expresión está limitado, así que
+    validarla y evaluarla tarda un tiempo acotado.
+    """
+
+    def __init__(self, source: str, variables: List[str]):
+        if len(source) > MAX_EXPRESSION_LENGTH:
+            raise ValueError(f"La expresión supera los {MAX_EXPRESSION_LENGTH} caracteres")
+        reserved = [name for name in variables if name.startswith(_CONSTANT_PREFIX)]
+        if reserved:
+            raise ValueError(f"Nombre de variable reservado: {reserved[0]}")
+        try:
+            tree = ast.parse(source, mode="eval")
+        except (SyntaxError, RecursionError, MemoryError) as exc:
+            raise ValueError(f"Expresión no válida: {getattr(exc, 'msg', 'demasiado anidada')}")
+        nodes = list(ast.walk(tree))
+        if len(nodes) > MAX_EXPRESSION_NODES:
+            raise ValueError(f"La expresión supera los {MAX_EXPRESSION_NODES} elementos")
+        if _depth(tree) > MAX_EXPRESSION_DEPTH:
+            raise ValueError(f"La expresión supera los {MAX_EXPRESSION_DEPTH} niveles de anidamiento")
+        for node in nodes:
+            if not isinstance(node, _ALLOWED_NODES):
+                raise ValueError(f"Elemento no permitido en la expresión: {type(node).__name__}")
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError("Solo se admiten constantes numéricas")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                    raise ValueError(f"Función no permitida. Debe ser una de: {', '.join(FUNCTIONS)}")
+            elif isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+                if node.id not in variables and node.id not in CONSTANTS:
+                    raise ValueError(f"Variable no definida en la expresión: {node.id}")
+        self.source = source
+        self.variables = [name for name in variables if any(
+            isinstance(node, ast.Name) and node.id == name for node in ast.walk(tree)
+        )]
+        constants = _FloatConstants()
+        tree = ast.fix_missing_locations(constants.visit(tree))
+        self._constants = constants.values
+        self._code = compile(tree, "<sensor virtual>", "eval")
+        try:
+            self.evaluate({name: np.ones(2) for name in self.variables})
+        except Exception as exc:
+            raise ValueError(f"Expresión no válida: {exc}")
+
+    def evaluate(self, env: Dict[str, np.ndarray]) -> np.ndarray:
+        with np.errstate(all="ignore"):
+            result = eval(self._code, {"__builtins__": {}}, {**FUNCTIONS, **CONSTANTS, **env, **self._constants})
+        return np.asarray(result, dtype=np.float64)
+
+
+def _window_starts(first: float, last: float, window: timedelta) -> np.ndarray:
+    """
+    Inicios (hora local) de las ventanas que cubren ``[first, last]``.
+    """
+    start = datetime.fromtimestamp(first)
+    if window < timedelta(days=1):
+        start = start.replace(minute=0, second=0, microsecond=0)
+    else:
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        if window == WINDOWS["weekly"]:
+            start -= timedelta(days=start.weekday())
+    starts = [start.timestamp()]
+    while starts[-1] <= last:
+        start += window
+        starts.append(start.timestamp())
+    return np.array(starts, dtype=np.float64)
+
+
+class VirtualSensor:
+    """
+    Sensor virtual con su expresión y el estado de su ventana de acumulación.
+    """
+
+    def __init__(self, sensor_id: Hashable, definition: Dict[str, Any]):
+        self.sensor_id = sensor_id
+        self.inputs: Dict[str, Hashable] = dict(definition["inputs"])
+        if not self.inputs:
+            raise ValueError("Un sensor virtual necesita al menos una entrada")
+        self.expression = Expression(definition["expression"], list(self.inputs))
+        self.aggregate: Optional[str] = definition.get("aggregate")
+        if self.aggregate is not None and self.aggregate not in AGGREGATES:
+            raise ValueError(f"Agregación no válida. Debe ser una de: {', '.join(AGGREGATES)}")
+        window = definition.get("window") or "daily"
+        if window not in WINDOWS:
+            raise ValueError(f"Ventana no válida. Debe ser una de: {', '.join(WINDOWS)}")
+        self.window = WINDOWS[window]
+        self.max_staleness = float(definition.get("max_staleness_seconds") or DEFAULT_MAX_STALENESS)
+
+        # Estado incremental: último instante calculado y, para las
+        # agregaciones, ventana actual, acumulado y último valor de entrada
+        self.last_timestamp = -np.inf
+        self._window_start = -np.inf
+        self._accumulated = 0.0
+        self._last_rate = np.nan
+        self._last_rate_timestamp = -np.inf
+
+    def resume(self, timestamp: float, value: float):
+        """
+        Continúa tras el último punto ya guardado (por ejemplo, cargado de los
+        segmentos al arrancar) en lugar de recalcular todo el historial. En
+        las agregaciones el valor guardado es el acumulado de su ventana.
+        """
+        self.last_timestamp = timestamp
+        if self.aggregate:
+            self._window_start = float(_window_starts(timestamp, timestamp, self.window)[0])
+            self._accumulated = value
+
+    def input_ids(self) -> List[Hashable]:
+        return [self.inputs[name] for name in self.expression.variables]
+
+    def _join_inputs(self, timestamps: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Valor de cada entrada en cada instante: su última lectura hasta ese
+        momento (NaN si no hay ninguna o es demasiado antigua).
+        """
+        env = {}
+        for name in self.expression.variables:
+            input_timestamps, input_values = reading_store.range(
+                self.inputs[name], float(timestamps[0]) - self.max_staleness, float(timestamps[-1])
+            )
+            joined = np.full(timestamps.size, np.nan)
+            if input_timestamps.size:
+                index = np.searchsorted(input_timestamps, timestamps, side="right") - 1
+                valid = index >= 0
+                valid[valid] = timestamps[valid] - input_timestamps[index[valid]] <= self.max_staleness
+                joined[valid] = input_values[index[valid]]
+            env[name] = joined
+        return env
+
+    def _accumulate(self, timestamps: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """
+        Acumulado de la ventana en cada instante, continuando el estado anterior.
+        """
+        starts = _window_starts(float(timestamps[0]), float(timestamps[-1]), self.window)
+        window_start = starts[np.searchsorted(starts, timestamps, side="right") - 1]
+
+        if self.aggregate == "sum":
+            contributions = values.copy()
+        else:
+            # Integral por trapecios desde la lectura anterior (o desde el
+            # inicio de la ventana si la anterior es de otra ventana)
+            previous_timestamps = np.concatenate(([self._last_rate_timestamp], timestamps[:-1]))
+            previous_values = np.concatenate(([self._last_rate], values[:-1]))
+            same_window = previous_timestamps >= window_start
+            elapsed = np.where(same_window, timestamps - previous_timestamps, timestamps - window_start)
+            rate = np.where(same_window, (previous_values + values) / 2, values)
+            contributions = np.where(
+                np.isfinite(rate) & (elapsed <= MAX_INTEGRATION_GAP), rate * elapsed, 0.0
+            )
+
+        # Suma acumulada que se reinicia en cada ventana
+        totals = np.cumsum(contributions)
+        new_window = np.concatenate(([True], window_start[1:] != window_start[:-1]))
+        offsets = np.maximum.accumulate(np.where(new_window, np.arange(totals.size), 0))
+        carried = self._accumulated if window_start[0] == self._window_start else 0.0
+        base = np.where(new_window, totals - contributions, 0.0)[offsets]
+        result = totals - base
+        result[offsets == 0] += carried
+
+        self._window_start = float(window_start[-1])
+        self._accumulated = float(result[-1])
+        self._last_rate = float(values[-1])
+        self._last_rate_timestamp = float(timestamps[-1])
+        return result
+
+    def watermark(self) -> Optional[float]:
+        """
+        Instante hasta el que se puede calcular: todas las entradas han llegado
+        hasta él, salvo las que llevan más de ``max_staleness`` sin reportar.
+        """
+        latest = [reading_store.latest(input_id) for input_id in self.input_ids()]
+        latest = [reading[0] for reading in latest if reading is not None]
+        if not latest:
+            return None
+        return max(min(latest), max(latest) - self.max_staleness)
+
+    def compute(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calcula el sensor en los instantes de sus entradas posteriores al
+        último calculado y anteriores a la marca de agua, y devuelve los
+        puntos válidos.
+        """
+        watermark = self.watermark()
+        empty = np.empty(0, dtype=np.float64)
+        if watermark is None or watermark <= self.last_timestamp:
+            return empty, empty
+        start = None if np.isinf(self.last_timestamp) else self.last_timestamp
+        timestamps = np.unique(np.concatenate([
+            reading_store.range(input_id, start, watermark)[0] for input_id in self.input_ids()
+        ]))
+        timestamps = timestamps[timestamps > self.last_timestamp]
+        if timestamps.size == 0:
+            return empty, empty
+        self.last_timestamp = float(timestamps[-1])
+
+        values = self.expression.evaluate(self._join_inputs(timestamps))
+        values = np.broadcast_to(values, timestamps.shape)
+        valid = np.isfinite(values)
+        timestamps, values = timestamps[valid], values[valid]
+        if timestamps.size and self.aggregate:
+            values = self._accumulate(timestamps, values)
+        return timestamps, values
+
+
+class VirtualSensorGraph:
+    """
+    Grafo de dependencias de los sensores virtuales del proceso.
+
+    Escucha las escrituras del almacén de lecturas y recalcula en cascada los
+    sensores virtuales afectados.
+    """
+
+    def __init__(self):
+        self._sensors: Dict[Hashable, VirtualSensor] = {}
+        self._dependents: Dict[Hashable, List[Hashable]] = {}
+        self._lock = threading.RLock()
+        reading_store.subscribe(self._on_readings)
+
+    def __contains__(self, sensor_id: Hashable) -> bool:
+        return sensor_id in self._sensors
+
+    def _depends_on(self, sensor_id: Hashable, target: Hashable) -> bool:
+        """
+        Indica si ``sensor_id`` depende, directa o indirectamente, de ``target``.
+        """
+        pending = [sensor_id]
+        seen = set()
+        while pending:
+            current = pending.pop()
+            if current == target:
+                return True
+            if current in seen or current not in self._sensors:
+                continue
+            seen.add(current)
+            pending.extend(self._sensors[current].input_ids())
+        return False
+
+    def validate(self, sensor_id: Hashable, definition: Dict[str, Any]) -> VirtualSensor:
+        """
+        Construye el sensor virtual comprobando la expresión y que no crea ciclos.
+        """
+        sensor = VirtualSensor(sensor_id, definition)
+        with self._lock:
+            for input_id in sensor.input_ids():
+                if self._depends_on(input_id, sensor_id):
+                    raise ValueError(f"La entrada {input_id} crea una dependencia circular")
+        return sensor
+
+    def register(self, sensor_id: Hashable, definition: Dict[str, Any], backfill: bool = True) -> int:
+        """
+        Añade un sensor virtual al grafo y, opcionalmente, calcula su historial
+        a partir del de sus entradas. Devuelve el número de puntos calculados.
+        """
+        sensor = self.validate(sensor_id, definition)
+        with self._lock:
+            if sensor_id in self._sensors:
+                return 0
+            self._sensors[sensor_id] = sensor
+            for input_id in set(sensor.input_ids()):
+                self._dependents.setdefault(input_id, []).append(sensor_id)
+            if not backfill:
+                sensor.last_timestamp = sensor.watermark() or -np.inf
+                return 0
+            stored = reading_store.latest(sensor_id)
+            if stored is not None:
+                sensor.resume(*stored)
+            timestamps, values = sensor.compute()
+        if timestamps.size:
+            reading_store.extend(sensor_id, timestamps, values)
+        return int(timestamps.size)
+
+    def load(self, sensors: List[Dict[str, Any]]):
+        """
+        Registra los sensores virtuales de una lista de sensores del registro,
+        en orden de dependencias, calculando su historial.
+        """
+        pending = [sensor for sensor in sensors if sensor.get("virtual") and sensor["id"] not in self]
+        while pending:
+            known = {sensor["id"] for sensor in pending}
+            ready = [
+                sensor for sensor in pending
+                if not any(input_id in known for input_id in sensor["virtual"]["inputs"].values())
+            ]
+            if not ready:
+                logger.error("Sensores virtuales con dependencias circulares: %s", sorted(known))
+                return
+            for sensor in ready:
+                try:
+                    self.register(sensor["id"], sensor["virtual"])
+                except ValueError:
+                    logger.exception("Sensor virtual %s no válido", sensor["id"])
+            pending = [sensor for sensor in pending if sensor not in ready]
+
+    def _on_readings(self, sensor_id: Hashable, timestamps: np.ndarray, values: np.ndarray):
+        """
+        Recalcula los sensores virtuales que dependen del sensor que ha recibido lecturas.
+        """
+        dependents = self._dependents.get(sensor_id)
+        if not dependents:
+            return
+        for dependent_id in list(dependents):
+            with self._lock:
+                sensor = self._sensors[dependent_id]
+                try:
+                    new_timestamps, new_values = sensor.compute()
+                except Exception:
+                    logger.exception("Error calculando el sensor virtual %s", dependent_id)
+                    continue
+            # Al guardar se notifica de nuevo y se propaga a los siguientes sensores virtuales
+            if new_timestamps.size:
+                reading_store.extend(dependent_id, new_timestamps, new_values)
+
+
+# Grafo compartido por todas las rutas del proceso
+virtual_sensor_graph = VirtualSensorGraph()